@@ -0,0 +1 @@
+from .synthetic_slide import *
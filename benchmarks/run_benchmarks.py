@@ -0,0 +1,367 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+from collections import namedtuple
+from pathlib import Path
+
+import gin
+import numpy as np
+
+from histo_lib import WSI, RandomTiler, Tile
+from preprocessing.check_tiles import check_tile
+from preprocessing.tables import write_table
+from recompact_valid_tiles import recompact_slide
+
+from .synthetic_slide import synthetic_slide
+
+BenchmarkResult = namedtuple(
+    "BenchmarkResult",
+    (
+        "name",
+        "n_tiles",
+        "n_bytes",
+        "repeats",
+        "best_seconds",
+        "median_seconds",
+        "tiles_per_s",
+        "mb_per_s",
+    ),
+)
+
+
+def _timings(function, repeats, setup=None):
+    """Run `function` `repeats` times, returning its last result and the timings."""
+    timings = []
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return result, timings
+
+
+def _result(name, n_tiles, n_bytes, timings):
+    best = min(timings)
+    return BenchmarkResult(
+        name=name,
+        n_tiles=n_tiles,
+        n_bytes=n_bytes,
+        repeats=len(timings),
+        best_seconds=best,
+        median_seconds=float(np.median(timings)),
+        tiles_per_s=n_tiles / best if best else None,
+        mb_per_s=n_bytes / 2 ** 20 / best if best and n_bytes else None,
+    )
+
+
+def _format_rate(rate):
+    """Format a throughput of the report, '-' if the benchmark does not measure it."""
+    return f"{'-':>10}" if rate is None else f"{rate:10.1f}"
+
+
+def _reset_dir(path):
+    shutil.rmtree(path, ignore_errors=True)
+    path.mkdir(parents=True)
+
+
+def _files_size(filenames):
+    return sum(os.path.getsize(filename) for filename in filenames)
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(
+    slide_filename, workdir, tile_size=512, n_tiles=100, level=0, repeats=3, seed=7
+):
+    """
+    Time the hot paths of tiles extraction and checking on a slide.
+
+    Throughputs are computed on the best of `repeats` runs; bytes are the decoded pixel
+    bytes for in-memory benchmarks and the file bytes for the others.
+
+    Parameters
+    ----------
+    slide_filename : str or pathlib.Path
+        Path of the slide, e.g. written by `synthetic_slide`
+    workdir : str or pathlib.Path
+        Folder where tiles are written
+    tile_size : int
+        Side of the tiles. Default is 512.
+    n_tiles : int
+        Number of tiles of each benchmark. Default is 100.
+    level : int
+        Level from which the tiles are extracted. Default is 0.
+    repeats : int
+        Number of runs of each benchmark. Default is 3.
+    seed : int
+        Seed of the tiles coordinates. Default is 7.
+
+    Returns
+    -------
+    list of BenchmarkResult
+        The result of each benchmark
+
+    """
+    workdir = Path(workdir)
+    gin.bind_parameter("check_tile_size.tile_size", tile_size)
+    gin.bind_parameter("check_tile_shape.tile_size", tile_size)
+    results = []
+
+    # tissue detection on the thumbnail, on a new WSI each run (no memoization)
+    _, timings = _timings(lambda: WSI(slide_filename).tissue_box_coords_wsi, repeats)
+    results.append(_result("WSI.tissue_box_coords_wsi", 1, 0, timings))
+
+    wsi = WSI(slide_filename)
+    tiler = RandomTiler(tile_size, n_tiles, level=level, seed=seed)
+    np.random.seed(seed)
+    coords = tiler._random_tile_coordinates(wsi, n_tiles).tolist()
+
+    tiles, timings = _timings(
+        lambda: [wsi.extract_tile(c, level, size=tiler.tile_size) for c in coords],
+        repeats,
+    )
+    tiles_bytes = sum(np.asarray(tile.image).nbytes for tile in tiles)
+    results.append(_result("WSI.extract_tile", n_tiles, tiles_bytes, timings))
+
+    _, timings = _timings(lambda: [tile.has_enough_tissue() for tile in tiles], repeats)
+    results.append(_result("Tile.has_enough_tissue", n_tiles, tiles_bytes, timings))
+
+    _, timings = _timings(lambda: Tile.has_enough_tissue_batch(tiles), repeats)
+    results.append(
+        _result("Tile.has_enough_tissue_batch", n_tiles, tiles_bytes, timings)
+    )
+
+    saved_dir = workdir / "saved"
+    filenames = [saved_dir / f"tile_{i}.png" for i in range(n_tiles)]
+    _, timings = _timings(
+        lambda: [tile.save(f) for tile, f in zip(tiles, filenames)],
+        repeats,
+        setup=lambda: _reset_dir(saved_dir),
+    )
+    results.append(_result("Tile.save", n_tiles, _files_size(filenames), timings))
+
+    extracted_dir = workdir / "extracted"
+    extract_tiler = RandomTiler(
+        tile_size, n_tiles, level=level, seed=seed, prefix=f"{extracted_dir}/"
+    )
+    tile_filenames, timings = _timings(
+        lambda: extract_tiler.extract(wsi),
+        repeats,
+        setup=lambda: _reset_dir(extracted_dir),
+    )
+    results.append(
+        _result(
+            "RandomTiler.extract",
+            len(tile_filenames),
+            _files_size(tile_filenames),
+            timings,
+        )
+    )
+
+    tiles_files_size = _files_size(tile_filenames)
+    for header_only in (False, True):
+        _, timings = _timings(
+            lambda: [check_tile(f, header_only) for f in tile_filenames], repeats
+        )
+        results.append(
+            _result(
+                "check_tile(header_only)" if header_only else "check_tile",
+                len(tile_filenames),
+                tiles_files_size,
+                timings,
+            )
+        )
+
+    summary_path = workdir / "summary.csv"
+    tile_basenames = [os.path.basename(f) for f in tile_filenames]
+    write_table({"filename": tile_basenames}, summary_path)
+    recompacted_dir = workdir / "recompacted"
+    for link_mode in ("hardlink", "copy"):
+        _, timings = _timings(
+            lambda: recompact_slide(
+                extracted_dir, tile_basenames, summary_path, recompacted_dir, link_mode
+            ),
+            repeats,
+            setup=lambda: _reset_dir(recompacted_dir),
+        )
+        results.append(
+            _result(
+                f"recompact_slide({link_mode})",
+                len(tile_filenames),
+                tiles_files_size,
+                timings,
+            )
+        )
+
+    return results
+
+
+def compare_results(baseline, results):
+    """
+    Return the speedup of each benchmark of `results` over the same one of `baseline`.
+
+    Parameters
+    ----------
+    baseline : list of dict
+        Results of the reference version, as written by `main`
+    results : list of dict
+        Results of the current version
+
+    Returns
+    -------
+    dict
+        Current over baseline throughput (tiles/s) of each benchmark present in both
+
+    """
+    baseline_throughput = {r["name"]: r["tiles_per_s"] for r in baseline}
+    return {
+        r["name"]: r["tiles_per_s"] / baseline_throughput[r["name"]]
+        for r in results
+        if baseline_throughput.get(r["name"]) and r["tiles_per_s"] is not None
+    }
+
+
+def main(
+    output_filename,
+    width,
+    height,
+    tissue_density,
+    tile_size,
+    n_tiles,
+    level,
+    repeats,
+    seed,
+    workdir=None,
+    baseline_filename=None,
+):
+    keep_workdir = workdir is not None
+    workdir = Path(workdir or tempfile.mkdtemp(prefix="histo_lib_benchmarks_"))
+    workdir.mkdir(parents=True, exist_ok=True)
+
+    try:
+        slide_filename = workdir / "synthetic_slide.tiff"
+        start = time.perf_counter()
+        synthetic_slide(slide_filename, width, height, tissue_density, seed=seed)
+        print(f"Synthetic slide written in {time.perf_counter() - start:.1f} s")
+
+        # failed checks and extraction summaries are printed
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            results = run_benchmarks(
+                slide_filename, workdir, tile_size, n_tiles, level, repeats, seed
+            )
+    finally:
+        if not keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    results = [r._asdict() for r in results]
+    report = {
+        "metadata": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+            "slide": {
+                "width": width,
+                "height": height,
+                "tissue_density": tissue_density,
+            },
+            "tile_size": tile_size,
+            "n_tiles": n_tiles,
+            "level": level,
+            "seed": seed,
+        },
+        "results": results,
+    }
+    with open(output_filename, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+
+    speedups = {}
+    if baseline_filename is not None:
+        with open(baseline_filename) as baseline_file:
+            speedups = compare_results(json.load(baseline_file)["results"], results)
+
+    for r in results:
+        line = (
+            f"{r['name']:32} {_format_rate(r['tiles_per_s'])} tiles/s "
+            f"{_format_rate(r['mb_per_s'])} MiB/s"
+        )
+        if r["name"] in speedups:
+            line += f" {speedups[r['name']]:6.2f}x"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark tiles extraction and checking on a synthetic slide"
+    )
+    parser.add_argument(
+        "output_filename", type=str, help="Path of the JSON file with the results"
+    )
+    parser.add_argument(
+        "--width", type=int, default=8192, help="Width of the synthetic slide"
+    )
+    parser.add_argument(
+        "--height", type=int, default=6144, help="Height of the synthetic slide"
+    )
+    parser.add_argument(
+        "--tissue_density",
+        type=float,
+        default=0.3,
+        help="Proportion of the synthetic slide covered by tissue",
+    )
+    parser.add_argument("--tile_size", type=int, default=512, help="Side of the tiles")
+    parser.add_argument(
+        "--n_tiles", type=int, default=100, help="Number of tiles of each benchmark"
+    )
+    parser.add_argument(
+        "--level", type=int, default=0, help="Level from which tiles are extracted"
+    )
+    parser.add_argument(
+        "--repeats", type=int, default=3, help="Number of runs of each benchmark"
+    )
+    parser.add_argument("--seed", type=int, default=7, help="Random seed")
+    parser.add_argument(
+        "--workdir",
+        type=str,
+        help="Folder where the slide and the tiles are written and kept. "
+        "By default a temporary folder, removed at the end",
+    )
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        help="JSON results of a previous run, to print the speedup of each benchmark",
+    )
+
+    args = parser.parse_args()
+
+    main(
+        args.output_filename,
+        args.width,
+        args.height,
+        args.tissue_density,
+        args.tile_size,
+        args.n_tiles,
+        args.level,
+        args.repeats,
+        args.seed,
+        args.workdir,
+        args.baseline,
+    )
@@ -0,0 +1,149 @@
+import numpy as np
+import tifffile
+from scipy import ndimage
+
+TIFF_TILE_SIZE = 256
+# pixel size written in the TIFF resolution tags, as a 20x scan
+SYNTHETIC_MPP = 0.5
+BACKGROUND_COLOR = 240
+# mean H&E-like tissue color and amplitude of its noise
+TISSUE_COLOR = (180, 90, 170)
+TISSUE_NOISE = 30
+# hematoxylin-like nuclei, jittered on a regular grid, interrupted by diagonal bands of
+# lighter stroma: tiles within tissue have both dark and light areas, as real tissue
+NUCLEUS_COLOR = (60, 20, 100)
+NUCLEUS_RADIUS = 3
+NUCLEUS_SPACING = 10
+STROMA_PERIOD = 80
+STROMA_WIDTH = 20
+
+
+def _tissue_mask(width, height, tissue_density, random_state, blob_size=64):
+    """
+    Return a (height, width) mask of smooth random blobs covering `tissue_density` of
+    the slide.
+
+    """
+    h_low = -(-height // blob_size)
+    w_low = -(-width // blob_size)
+    field = ndimage.gaussian_filter(random_state.rand(h_low, w_low), sigma=3)
+    threshold = np.quantile(field, 1 - tissue_density)
+    mask_low = field > threshold if tissue_density < 1 else np.ones_like(field, bool)
+
+    mask = np.repeat(np.repeat(mask_low, blob_size, axis=0), blob_size, axis=1)
+    return mask[:height, :width]
+
+
+def _nuclei_mask(width, height, random_state):
+    """Return a (height, width) mask of nuclei-like spots outside the stroma bands."""
+    ys, xs = np.mgrid[0:height:NUCLEUS_SPACING, 0:width:NUCLEUS_SPACING]
+    ys = np.minimum(
+        ys + random_state.randint(NUCLEUS_SPACING, size=ys.shape), height - 1
+    )
+    xs = np.minimum(
+        xs + random_state.randint(NUCLEUS_SPACING, size=xs.shape), width - 1
+    )
+    centers = np.zeros((height, width), dtype=bool)
+    centers[ys, xs] = True
+
+    y, x = np.ogrid[
+        -NUCLEUS_RADIUS : NUCLEUS_RADIUS + 1, -NUCLEUS_RADIUS : NUCLEUS_RADIUS + 1
+    ]
+    nuclei = ndimage.binary_dilation(
+        centers, structure=x ** 2 + y ** 2 <= NUCLEUS_RADIUS ** 2
+    )
+
+    # row by row shifts of the bands, wavy diagonals
+    rows = np.arange(height)
+    shifts = (rows + (20 * np.sin(rows / 40)).astype(int)) % STROMA_PERIOD
+    outside_bands = (
+        np.add.outer(np.arange(STROMA_PERIOD), np.arange(width)) % STROMA_PERIOD
+        >= STROMA_WIDTH
+    )
+    return nuclei & outside_bands[shifts]
+
+
+def _write_level(tiff, image, subfiletype):
+    kwargs = dict(
+        photometric="rgb",
+        tile=(TIFF_TILE_SIZE, TIFF_TILE_SIZE),
+        subfiletype=subfiletype,
+        resolution=(1e4 / SYNTHETIC_MPP, 1e4 / SYNTHETIC_MPP, "CENTIMETER"),
+    )
+    if hasattr(tiff, "write"):  # tifffile >= 2020.9.30
+        tiff.write(image, compression="zlib", **kwargs)
+    else:
+        tiff.save(image, compress=6, **kwargs)
+
+
+def synthetic_slide(
+    filename,
+    width=8192,
+    height=6144,
+    tissue_density=0.3,
+    n_levels=3,
+    downsample=4,
+    seed=7,
+):
+    """
+    Write a synthetic pyramidal TIFF slide, readable by OpenSlide as a generic TIFF.
+
+    The slide has a white-ish background and noisy H&E-like tissue blobs, textured by
+    nuclei-like spots and lighter stroma bands so that tiles within tissue pass the
+    tissue check of `Tile.has_enough_tissue`. It is stored in tiled, zlib compressed
+    levels, each one `downsample` times smaller than the previous one (marked as
+    reduced-resolution images).
+
+    Parameters
+    ----------
+    filename : str or pathlib.Path
+        Path of the TIFF file
+    width : int
+        Width in pixels of level 0. Default is 8192.
+    height : int
+        Height in pixels of level 0. Default is 6144.
+    tissue_density : float
+        Number between 0.0 and 1.0 representing the proportion of the slide covered
+        by tissue. Default is 0.3.
+    n_levels : int
+        Number of levels of the pyramid. Default is 3.
+    downsample : int
+        Downsample factor between consecutive levels. Default is 4.
+    seed : int
+        Seed for RandomState. Default is 7.
+
+    Returns
+    -------
+    int
+        Number of tissue pixels at level 0
+
+    Raises
+    ------
+    ValueError
+        If tissue_density is not between 0.0 and 1.0
+
+    """
+    if not 0 <= tissue_density <= 1:
+        raise ValueError(
+            f"tissue_density must be between 0.0 and 1.0. Got {tissue_density}."
+        )
+
+    random_state = np.random.RandomState(seed)
+    mask = _tissue_mask(width, height, tissue_density, random_state)
+
+    image = np.full((height, width, 3), BACKGROUND_COLOR, dtype=np.uint8)
+    noise = random_state.randint(-TISSUE_NOISE, TISSUE_NOISE + 1, size=(mask.sum(), 1))
+    image[mask] = np.clip(np.array(TISSUE_COLOR) + noise, 0, 255)
+    nuclei = _nuclei_mask(width, height, random_state) & mask
+    noise = random_state.randint(
+        -TISSUE_NOISE, TISSUE_NOISE + 1, size=(nuclei.sum(), 1)
+    )
+    image[nuclei] = np.clip(np.array(NUCLEUS_COLOR) + noise, 0, 255)
+
+    with tifffile.TiffWriter(str(filename), bigtiff=image.nbytes >= 2 ** 32) as tiff:
+        level_image = image
+        for level in range(n_levels):
+            _write_level(tiff, level_image, subfiletype=1 if level else 0)
+            level_image = level_image[::downsample, ::downsample]
+
+    return int(mask.sum())
@@ -1,3 +1,5 @@
+from .shards import *
+from .stains import *
 from .tile import *
 from .tiler import *
 from .utils import *
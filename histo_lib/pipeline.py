@@ -0,0 +1,72 @@
+from collections import deque
+from itertools import islice
+
+
+def ordered_map(function, iterable, executor, max_pending):
+    """
+    Lazily map `function` over `iterable` with `executor`, yielding the results in order.
+
+    At most `max_pending` items are submitted and not yet consumed at any time, so a
+    slow consumer stops the producer (backpressure) and memory stays capped. Items are
+    pulled from `iterable` in the calling thread only. Closing the generator cancels
+    the tasks not yet started.
+
+    Parameters
+    ----------
+    function : callable
+        Function applied to each item
+    iterable : iterable
+        Items to process
+    executor : concurrent.futures.Executor
+        Executor running `function`
+    max_pending : int
+        Maximum number of submitted and not yet consumed items
+
+    Yields
+    ------
+    object
+        Result of `function` for each item of `iterable`, in the same order
+
+    """
+    assert max_pending > 0, "max_pending must be positive"
+
+    iterator = iter(iterable)
+    pending = deque(
+        executor.submit(function, item) for item in islice(iterator, max_pending)
+    )
+    try:
+        while pending:
+            result = pending.popleft().result()
+            pending.extend(
+                executor.submit(function, item) for item in islice(iterator, 1)
+            )
+            yield result
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def batched(iterable, batch_size):
+    """
+    Lazily split `iterable` in lists of `batch_size` items (the last one may be shorter).
+
+    Parameters
+    ----------
+    iterable : iterable
+        Items to split
+    batch_size : int
+        Maximum number of items of each batch
+
+    Yields
+    ------
+    list
+        Consecutive items of `iterable`
+
+    """
+    assert batch_size > 0, "batch_size must be positive"
+
+    iterator = iter(iterable)
+    batch = list(islice(iterator, batch_size))
+    while batch:
+        yield batch
+        batch = list(islice(iterator, batch_size))
@@ -0,0 +1,347 @@
+import csv
+import io
+import os
+from collections import namedtuple
+from pathlib import Path
+from threading import Lock
+
+import numpy as np
+from PIL import Image
+
+ShardRecord = namedtuple(
+    "ShardRecord",
+    (
+        "name",
+        "slide_id",
+        "level",
+        "x_ul",
+        "y_ul",
+        "x_br",
+        "y_br",
+        "tissue_fraction",
+        "shard",
+        "offset",
+        "length",
+    ),
+)
+
+SHARD_PREFIX = "shard_"
+SHARD_DATA_SUFFIX = ".bin"
+SHARD_INDEX_SUFFIX = ".idx"
+INDEX_COLUMNS = [field for field in ShardRecord._fields if field != "shard"]
+
+
+def _shard_ids(root):
+    return sorted(
+        int(path.stem[len(SHARD_PREFIX) :])
+        for path in Path(root).glob(f"{SHARD_PREFIX}*{SHARD_DATA_SUFFIX}")
+    )
+
+
+class ShardWriter:
+    """
+    Writer of tiles into shard files.
+
+    Encoded tiles are appended to large shard files (`shard_XXXXX.bin`), each one with an
+    index (`shard_XXXXX.idx`, tab separated) holding name, slide id, level, level-0
+    coordinates, tissue fraction, offset and length of every tile.
+    A writer only creates new shards, so appending new slides never rewrites existing
+    shards, and many writers (e.g. one per process) can safely share the same folder.
+    The data of each tile is flushed before its index record is written, so that after
+    a crash the indexes only point to written data. `append` is thread safe.
+
+    Attributes
+    ----------
+    root : pathlib.Path
+        Folder containing the shards
+    max_shard_size : int
+        Size in bytes after which a new shard is started. Default is 1 GiB.
+    shards : list of pathlib.Path
+        Data files of the shards written by this writer
+
+    """
+
+    def __init__(self, root, max_shard_size=2 ** 30):
+        self.root = Path(root)
+        self.max_shard_size = max_shard_size
+        self.shards = []
+
+        self._lock = Lock()
+        self._data_file = None
+        self._index_file = None
+        self._index_writer = None
+        self._offset = 0
+
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def append(self, name, data, slide_id, level, coords, tissue_fraction=np.nan):
+        """
+        Append an encoded tile to the current shard.
+
+        Parameters
+        ----------
+        name : str
+            Unique name of the tile, e.g. its filename
+        data : bytes
+            The encoded tile (e.g. PNG bytes)
+        slide_id : str
+            Identifier of the slide from which the tile is extracted
+        level : int
+            Level from which the tile is extracted
+        coords : Coordinates
+            Level-0 (x_ul, y_ul, x_br, y_br) coordinates of the tile
+        tissue_fraction : float, optional
+            Proportion of tissue over the total area of the tile. Default is NaN.
+
+        """
+        x_ul, y_ul, x_br, y_br = coords
+
+        with self._lock:
+            if self._data_file is None or (
+                self._offset and self._offset + len(data) > self.max_shard_size
+            ):
+                self._open_new_shard()
+
+            self._data_file.write(data)
+            # data first, so that the buffered index never points to unwritten bytes
+            self._data_file.flush()
+            self._index_writer.writerow(
+                [
+                    name,
+                    slide_id,
+                    level,
+                    x_ul,
+                    y_ul,
+                    x_br,
+                    y_br,
+                    tissue_fraction,
+                    self._offset,
+                    len(data),
+                ]
+            )
+            self._offset += len(data)
+
+    def flush(self):
+        """Flush the data and then the index of the current shard to disk."""
+        with self._lock:
+            if self._data_file is not None:
+                self._data_file.flush()
+                self._index_file.flush()
+
+    def close(self):
+        """Flush and close the current shard."""
+        with self._lock:
+            self._close_shard()
+
+    def _open_new_shard(self):
+        self._close_shard()
+
+        shard_ids = _shard_ids(self.root)
+        shard_id = shard_ids[-1] + 1 if shard_ids else 0
+        while True:
+            data_path = self.root / f"{SHARD_PREFIX}{shard_id:05d}{SHARD_DATA_SUFFIX}"
+            try:
+                # O_EXCL: the shard is claimed atomically, even among concurrent writers
+                fd = os.open(data_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+            except FileExistsError:
+                shard_id += 1
+            else:
+                break
+
+        self._data_file = os.fdopen(fd, "wb")
+        self._index_file = open(
+            data_path.with_suffix(SHARD_INDEX_SUFFIX), "w", newline=""
+        )
+        self._index_writer = csv.writer(self._index_file, delimiter="\t")
+        self._index_writer.writerow(INDEX_COLUMNS)
+        self._offset = 0
+        self.shards.append(data_path)
+
+    def _close_shard(self):
+        if self._data_file is not None:
+            # data first, so that the index never points to missing bytes
+            self._data_file.close()
+            self._index_file.close()
+            self._data_file = self._index_file = self._index_writer = None
+
+
+class ShardReader:
+    """
+    Random-access reader of the tiles written by `ShardWriter`.
+
+    All the shard indexes are loaded at construction, so that looking up a tile by name
+    is O(1); reads are positional and thread safe. If a name appears in more than one
+    shard, the most recent shard wins. Index rows that are incomplete (e.g. torn by a
+    crashed writer or by a writer still appending), that don't parse, or that point past
+    the end of their data file are skipped.
+
+    Attributes
+    ----------
+    root : pathlib.Path
+        Folder containing the shards
+
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self._records = {}
+        self._fds = {}
+        self._fds_lock = Lock()
+
+        for shard_id in _shard_ids(self.root):
+            data_path = self.root / f"{SHARD_PREFIX}{shard_id:05d}{SHARD_DATA_SUFFIX}"
+            index_path = data_path.with_suffix(SHARD_INDEX_SUFFIX)
+            if not index_path.exists():
+                continue
+
+            data_size = data_path.stat().st_size
+            with open(index_path, newline="") as index_file:
+                index_text = index_file.read()
+            # a last line without newline was torn by a crashed or still running writer
+            if not index_text.endswith("\n"):
+                index_text = index_text[: index_text.rfind("\n") + 1]
+
+            for row in csv.DictReader(io.StringIO(index_text), delimiter="\t"):
+                record = self._parse_record(row, data_path, data_size)
+                if record is not None:
+                    self._records[record.name] = record
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, name):
+        return name in self._records
+
+    def __iter__(self):
+        return iter(self._records)
+
+    @property
+    def names(self):
+        return list(self._records)
+
+    def record(self, name):
+        """
+        Return the index record of a tile.
+
+        Parameters
+        ----------
+        name : str
+            Name of the tile
+
+        Returns
+        -------
+        ShardRecord
+            The index record of the tile
+
+        Raises
+        ------
+        KeyError
+            If there is no tile named `name`
+
+        """
+        return self._records[name]
+
+    def records(self):
+        """Return the index records of all the tiles."""
+        return list(self._records.values())
+
+    def read_bytes(self, name):
+        """
+        Read the encoded bytes of a tile.
+
+        Parameters
+        ----------
+        name : str
+            Name of the tile
+
+        Returns
+        -------
+        bytes
+            The encoded tile
+
+        Raises
+        ------
+        KeyError
+            If there is no tile named `name`
+
+        """
+        record = self._records[name]
+        return os.pread(self._fd(record.shard), record.length, record.offset)
+
+    def read_image(self, name):
+        """
+        Read a tile as a PIL image.
+
+        Parameters
+        ----------
+        name : str
+            Name of the tile
+
+        Returns
+        -------
+        PIL.Image
+            The decoded tile
+
+        Raises
+        ------
+        KeyError
+            If there is no tile named `name`
+
+        """
+        return Image.open(io.BytesIO(self.read_bytes(name)))
+
+    def close(self):
+        """Close the shard files."""
+        with self._fds_lock:
+            for fd in self._fds.values():
+                os.close(fd)
+            self._fds = {}
+
+    def _fd(self, shard):
+        fd = self._fds.get(shard)
+        if fd is None:
+            with self._fds_lock:
+                fd = self._fds.get(shard)
+                if fd is None:
+                    fd = self._fds[shard] = os.open(shard, os.O_RDONLY)
+        return fd
+
+    @staticmethod
+    def _parse_record(row, data_path, data_size):
+        """Return the record of an index row, None if incomplete or out of the data."""
+        try:
+            record = ShardRecord(
+                name=row["name"],
+                slide_id=row["slide_id"],
+                level=int(row["level"]),
+                x_ul=int(row["x_ul"]),
+                y_ul=int(row["y_ul"]),
+                x_br=int(row["x_br"]),
+                y_br=int(row["y_br"]),
+                tissue_fraction=float(row["tissue_fraction"]),
+                shard=data_path,
+                offset=int(row["offset"]),
+                length=int(row["length"]),
+            )
+        except (KeyError, TypeError, ValueError):
+            return None
+
+        if record.name is None or record.slide_id is None:
+            return None
+        if record.offset < 0 or record.length < 0:
+            return None
+        if record.offset + record.length > data_size:
+            return None
+        return record
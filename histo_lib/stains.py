@@ -0,0 +1,543 @@
+import hashlib
+from abc import ABC, abstractmethod
+from threading import Lock
+
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.decomposition import PCA
+
+from .tile import Tile
+from .tiler import RandomTiler
+from .utils import atomic_open, images_to_array, rgba_to_rgb
+
+STAIN_METHODS = ("PCA", "kmeans")
+STAIN_SAMPLE_PIXELS = 100000
+STAIN_BATCH_SIZE = 4096
+
+# Reinhard et al. 2001: RGB to LMS cone space, and log LMS to decorrelated lab space
+RGB_TO_LMS = np.array(
+    [[0.3811, 0.5783, 0.0402], [0.1967, 0.7244, 0.0782], [0.0241, 0.1288, 0.8444]]
+)
+LOG_LMS_TO_LAB = np.diag([3 ** -0.5, 6 ** -0.5, 2 ** -0.5]) @ np.array(
+    [[1, 1, 1], [1, 1, -2], [1, -1, 0]]
+)
+# Macenko et al. 2009: optical density threshold of tissue pixels and angle percentile
+MACENKO_BETA = 0.15
+MACENKO_ALPHA = 1
+
+
+def fit_stain_colors(pixels, n_colors=3, method="kmeans", seed=7):
+    """
+    Fit the stain colors of a sample of pixels, as `Tile.detect_colors` does on a tile.
+
+    Pixels are min-max normalized over the whole sample, then fitted with mini-batch
+    KMeans or randomized PCA, so that large samples are fitted in roughly linear time.
+
+    Parameters
+    ----------
+    pixels : ndarray
+        (N, 3) array of RGB pixels
+    n_colors : int
+        Number of colors to detect. Default is 3.
+    method : {kmeans, PCA}
+        Algorithm used to detect the colors. Default is kmeans.
+    seed : int
+        Seed of the random state of the algorithm. Default is 7.
+
+    Returns
+    -------
+    ndarray
+        (n_colors, 3) array of the detected colors
+
+    Raises
+    ------
+    ValueError
+        If method is not 'kmeans' or 'PCA'
+
+    """
+    if method not in STAIN_METHODS:
+        raise ValueError(f"method must be 'kmeans' or 'PCA'. Got {method}.")
+
+    pixels = Tile.maxmin_norm(np.asarray(pixels, dtype=np.float64))
+
+    if method == "PCA":
+        assert n_colors <= 3, "Maximum 3 n_colors when using PCA"
+        clt = PCA(n_components=n_colors, svd_solver="randomized", random_state=seed)
+        clt.fit(pixels)
+        return clt.components_
+
+    clt = MiniBatchKMeans(
+        n_clusters=n_colors,
+        batch_size=min(STAIN_BATCH_SIZE, len(pixels)),
+        n_init=3,
+        random_state=seed,
+    )
+    clt.fit(pixels)
+    return clt.cluster_centers_
+
+
+def sample_tissue_pixels(
+    wsi, n_pixels=STAIN_SAMPLE_PIXELS, tile_size=256, n_tiles=64, level=0, seed=7
+):
+    """
+    Sample pixels at random from tissue tiles spread over the whole slide.
+
+    Tiles are drawn around the tissue mask of the slide (see `RandomTiler` with
+    sampling 'mask'), and the same number of pixels is drawn from each tile with
+    enough tissue.
+
+    Parameters
+    ----------
+    wsi : WSI
+        The Whole Slide Image from which to sample the pixels
+    n_pixels : int
+        Number of pixels to sample. Default is 100000.
+    tile_size : int, tuple or list of int
+        (width, height) of the tiles from which pixels are sampled. Default is 256.
+    n_tiles : int
+        Number of tiles from which pixels are sampled. Default is 64.
+    level : int
+        Level from which the tiles are read. Default is 0.
+    seed : int
+        Seed of the tiles and pixels sampling. Default is 7.
+
+    Returns
+    -------
+    ndarray of uint8
+        (M, 3) array of RGB pixels, with M <= `n_pixels` (0 if the slide has no tissue
+        tiles)
+
+    """
+    # RandomTiler seeds the global random state: keep the one of the caller
+    global_state = np.random.get_state()
+    try:
+        batches = _sample_tissue_tiles(wsi, tile_size, n_tiles, level, seed)
+    finally:
+        np.random.set_state(global_state)
+    if not batches:
+        return np.zeros((0, 3), dtype=np.uint8)
+
+    tiles_pixels = np.concatenate(batches)
+    tiles_pixels = tiles_pixels.reshape(len(tiles_pixels), -1, 3)
+    n_found, n_tile_pixels = tiles_pixels.shape[:2]
+
+    random_state = np.random.RandomState(seed)
+    pixels_idx = random_state.randint(
+        n_tile_pixels, size=(n_found, max(n_pixels // n_found, 1))
+    )
+    pixels = tiles_pixels[np.arange(n_found)[:, np.newaxis], pixels_idx]
+    return pixels.reshape(-1, 3)[:n_pixels]
+
+
+def _sample_tissue_tiles(wsi, tile_size, n_tiles, level, seed):
+    tiler = RandomTiler(
+        tile_size,
+        n_tiles,
+        level=level,
+        seed=seed,
+        max_iter=max(1e4, n_tiles),
+        sampling="mask",
+    )
+    return [images for _, images in tiler.stream(wsi, batch_size=n_tiles)]
+
+
+def slide_stain_colors(
+    wsi,
+    n_colors=3,
+    method="kmeans",
+    n_pixels=STAIN_SAMPLE_PIXELS,
+    tile_size=256,
+    n_tiles=64,
+    level=0,
+    seed=7,
+):
+    """
+    Estimate the stain colors of a whole slide, fitting once a sample of tissue pixels.
+
+    The colors are estimated on pixels sampled from many tissue tiles (see
+    `sample_tissue_pixels` and `fit_stain_colors`), instead of on a single tile as
+    `Tile.detect_colors` does, so that they can be shared by all the tiles of the slide
+    (e.g. with `Tile.separate_colors`). The colors are computed only once for each
+    parameters and memoized on `wsi`; if `cache_dir` of `wsi` is set, they are also
+    saved to (and loaded from) a sidecar file keyed by slide and parameters.
+
+    Parameters
+    ----------
+    wsi : WSI
+        The Whole Slide Image whose stain colors are estimated
+    n_colors : int
+        Number of colors to detect. Default is 3.
+    method : {kmeans, PCA}
+        Algorithm used to detect the colors. Default is kmeans.
+    n_pixels : int
+        Number of pixels to sample. Default is 100000.
+    tile_size : int, tuple or list of int
+        (width, height) of the tiles from which pixels are sampled. Default is 256.
+    n_tiles : int
+        Number of tiles from which pixels are sampled. Default is 64.
+    level : int
+        Level from which the tiles are read. Default is 0.
+    seed : int
+        Seed of the sampling and of the fitting algorithm. Default is 7.
+
+    Returns
+    -------
+    ndarray
+        (n_colors, 3) array of the detected colors
+
+    Raises
+    ------
+    ValueError
+        If method is not 'kmeans' or 'PCA', or if the slide has no tissue tiles
+
+    """
+    params = repr((n_colors, method, n_pixels, tile_size, n_tiles, level, seed))
+    if params in wsi._stain_colors:
+        return wsi._stain_colors[params]
+
+    # concurrent calls, e.g. from the threads of a tiler, fit the colors only once
+    with wsi._stain_colors_lock:
+        if params not in wsi._stain_colors:
+            wsi._stain_colors[params] = _load_or_fit_stain_colors(
+                wsi, params, n_colors, method, n_pixels, tile_size, n_tiles, level, seed
+            )
+    return wsi._stain_colors[params]
+
+
+def _load_or_fit_stain_colors(
+    wsi, params, n_colors, method, n_pixels, tile_size, n_tiles, level, seed
+):
+    params_hash = hashlib.sha1(params.encode("utf-8")).hexdigest()[:8]
+    cache_filename = wsi.cache_filename(f"_stains_{params_hash}.npy")
+
+    if cache_filename is not None and cache_filename.exists():
+        try:
+            return np.load(cache_filename)
+        except (OSError, ValueError):
+            pass  # unreadable cache: compute it again
+
+    pixels = sample_tissue_pixels(wsi, n_pixels, tile_size, n_tiles, level, seed)
+    if not len(pixels):
+        raise ValueError(f"No tissue tiles found in {wsi.filename}")
+    colors = fit_stain_colors(pixels, n_colors, method, seed)
+
+    if cache_filename is not None:
+        cache_filename.parent.mkdir(parents=True, exist_ok=True)
+        # other processes may cache the same slide
+        with atomic_open(cache_filename) as cache_file:
+            np.save(cache_file, colors)
+
+    return colors
+
+
+def _optical_density(pixels):
+    return -np.log((pixels + 1.0) * (1 / 256))
+
+
+class StainNormalizer(ABC):
+    """
+    Stain normalization of tiles towards the stain statistics of a reference.
+
+    The target statistics are fitted once (`fit` or `fit_wsi`) and can be saved and
+    loaded (`save` and `load`). The statistics of each source slide are estimated once
+    on pixels sampled from its tissue tiles (see `sample_tissue_pixels`), memoized and,
+    if the `cache_dir` of the slide is set, cached in a sidecar file. Tiles are then
+    normalized in vectorized batches (`normalize`), e.g. by a tiler during extraction.
+    `normalize` is thread safe.
+
+    Attributes
+    ----------
+    target : dict of ndarray or None
+        Stain statistics of the reference. None if not fitted yet.
+    n_pixels : int
+        Number of pixels sampled from each slide. Default is 100000.
+    tile_size : int, tuple or list of int
+        (width, height) of the tiles from which pixels are sampled. Default is 256.
+    n_tiles : int
+        Number of tiles from which pixels are sampled. Default is 64.
+    level : int
+        Level from which the tiles are read. Default is 0.
+    seed : int
+        Seed of the sampling. Default is 7.
+
+    """
+
+    def __init__(
+        self,
+        n_pixels=STAIN_SAMPLE_PIXELS,
+        tile_size=256,
+        n_tiles=64,
+        level=0,
+        seed=7,
+    ):
+        self.target = None
+        self.n_pixels = n_pixels
+        self.tile_size = tile_size
+        self.n_tiles = n_tiles
+        self.level = level
+        self.seed = seed
+
+        self._slides_params = {}
+        # one lock per slide, so that slides are fitted concurrently but only once
+        self._slides_locks = {}
+        self._slides_locks_lock = Lock()
+
+    @abstractmethod
+    def _fit_pixels(self, pixels):
+        """Return the stain statistics (dict of ndarray) of (N, 3) RGB pixels."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def _transform(self, pixels, params):
+        """Normalize (N, 3) RGB pixels with source statistics `params` towards `target`."""
+        raise NotImplementedError
+
+    def fit(self, images):
+        """
+        Fit the target statistics on reference images.
+
+        Parameters
+        ----------
+        images : ndarray, or list of Tile or PIL.Image
+            (N, H, W, 3) array (an alpha channel is composited over white), or list of
+            N tiles or images of the same size.
+
+        Returns
+        -------
+        StainNormalizer
+            The fitted normalizer
+
+        """
+        pixels = rgba_to_rgb(images_to_array(images)).reshape(-1, 3)
+        self.target = self._fit_pixels(pixels.astype(np.float64))
+        return self
+
+    def fit_wsi(self, wsi):
+        """
+        Fit the target statistics on a reference slide.
+
+        Parameters
+        ----------
+        wsi : WSI
+            The reference Whole Slide Image
+
+        Returns
+        -------
+        StainNormalizer
+            The fitted normalizer
+
+        """
+        self.target = self.slide_params(wsi)
+        return self
+
+    def save(self, filename):
+        """
+        Save the target statistics to a .npz file.
+
+        Parameters
+        ----------
+        filename : str or pathlib.Path
+            Path of the .npz file
+
+        """
+        assert self.target is not None, "The normalizer must be fitted before saving"
+        with atomic_open(filename) as target_file:
+            np.savez(target_file, **self.target)
+
+    def load(self, filename):
+        """
+        Load the target statistics saved by `save`.
+
+        Parameters
+        ----------
+        filename : str or pathlib.Path
+            Path of the .npz file
+
+        Returns
+        -------
+        StainNormalizer
+            The fitted normalizer
+
+        """
+        with np.load(filename) as target:
+            self.target = {key: target[key] for key in target.files}
+        return self
+
+    def slide_params(self, wsi):
+        """
+        Return the stain statistics of a slide, estimated once on its tissue pixels.
+
+        Parameters
+        ----------
+        wsi : WSI
+            The Whole Slide Image
+
+        Returns
+        -------
+        dict of ndarray
+            The stain statistics of the slide
+
+        Raises
+        ------
+        ValueError
+            If the slide has no tissue tiles
+
+        """
+        key = str(wsi.filename.resolve())
+        if key in self._slides_params:
+            return self._slides_params[key]
+
+        with self._slides_locks_lock:
+            slide_lock = self._slides_locks.setdefault(key, Lock())
+        with slide_lock:
+            if key not in self._slides_params:
+                self._slides_params[key] = self._load_or_fit_slide(wsi)
+        return self._slides_params[key]
+
+    def _load_or_fit_slide(self, wsi):
+        params = (
+            type(self).__name__,
+            self.n_pixels,
+            self.tile_size,
+            self.n_tiles,
+            self.level,
+            self.seed,
+        )
+        params_hash = hashlib.sha1(repr(params).encode("utf-8")).hexdigest()[:8]
+        cache_filename = wsi.cache_filename(f"_stain_params_{params_hash}.npz")
+
+        if cache_filename is not None and cache_filename.exists():
+            try:
+                with np.load(cache_filename) as cached:
+                    return {key: cached[key] for key in cached.files}
+            except (OSError, ValueError):
+                pass  # unreadable cache: compute it again
+
+        pixels = sample_tissue_pixels(
+            wsi, self.n_pixels, self.tile_size, self.n_tiles, self.level, self.seed
+        )
+        if not len(pixels):
+            raise ValueError(f"No tissue tiles found in {wsi.filename}")
+        slide_params = self._fit_pixels(pixels.astype(np.float64))
+
+        if cache_filename is not None:
+            cache_filename.parent.mkdir(parents=True, exist_ok=True)
+            # other processes may cache the same slide
+            with atomic_open(cache_filename) as cache_file:
+                np.savez(cache_file, **slide_params)
+
+        return slide_params
+
+    def normalize(self, images, wsi=None):
+        """
+        Normalize a batch of images towards the target statistics.
+
+        Parameters
+        ----------
+        images : ndarray, or list of Tile or PIL.Image
+            (N, H, W, 3) array (an alpha channel is composited over white), or list of
+            N tiles or images of the same size.
+        wsi : WSI, optional
+            The Whole Slide Image from which the images are extracted, whose statistics
+            (see `slide_params`) are used as source statistics. By default the source
+            statistics are fitted on the batch itself.
+
+        Returns
+        -------
+        ndarray of uint8
+            (N, H, W, 3) array of the normalized RGB images
+
+        """
+        assert self.target is not None, "The normalizer must be fitted first"
+
+        images_arr = rgba_to_rgb(images_to_array(images))
+        pixels = images_arr.reshape(-1, 3).astype(np.float64)
+        params = self._fit_pixels(pixels) if wsi is None else self.slide_params(wsi)
+
+        normalized = self._transform(pixels, params)
+        np.clip(normalized, 0, 255, out=normalized)
+        return np.rint(normalized).astype(np.uint8).reshape(images_arr.shape)
+
+
+class ReinhardNormalizer(StainNormalizer):
+    """
+    Reinhard color transfer: matches mean and standard deviation of each channel of the
+    decorrelated lab color space.
+
+    See `StainNormalizer` for the attributes.
+
+    """
+
+    @staticmethod
+    def _rgb_to_lab(pixels):
+        lms = np.maximum(pixels @ RGB_TO_LMS.T, 1.0)
+        return np.log10(lms) @ LOG_LMS_TO_LAB.T
+
+    @staticmethod
+    def _lab_to_rgb(lab):
+        lms = 10 ** (lab @ np.linalg.inv(LOG_LMS_TO_LAB).T)
+        return lms @ np.linalg.inv(RGB_TO_LMS).T
+
+    def _fit_pixels(self, pixels):
+        lab = self._rgb_to_lab(pixels)
+        return {"mean": lab.mean(axis=0), "std": lab.std(axis=0)}
+
+    def _transform(self, pixels, params):
+        scale = self.target["std"] / np.maximum(params["std"], 1e-6)
+        offset = self.target["mean"] - params["mean"] * scale
+        return self._lab_to_rgb(self._rgb_to_lab(pixels) * scale + offset)
+
+
+class MacenkoNormalizer(StainNormalizer):
+    """
+    Macenko stain normalization: estimates the two stain vectors (e.g. hematoxylin and
+    eosin) and the 99th percentile of their concentrations, and maps the source
+    concentrations onto the target stain vectors.
+
+    See `StainNormalizer` for the attributes.
+
+    """
+
+    def _fit_pixels(self, pixels):
+        densities = _optical_density(pixels)
+        tissue_densities = densities[np.all(densities >= MACENKO_BETA, axis=1)]
+        if len(tissue_densities) < 2:
+            raise ValueError("Not enough stained pixels to estimate the stain vectors")
+
+        # plane of the two main eigenvectors, oriented towards positive densities
+        _, eigvecs = np.linalg.eigh(np.cov(tissue_densities.T))
+        eigvecs = eigvecs[:, [2, 1]]
+        eigvecs *= np.where(eigvecs.sum(axis=0) < 0, -1, 1)
+
+        projected = tissue_densities @ eigvecs
+        angles = np.arctan2(projected[:, 1], projected[:, 0])
+        min_angle, max_angle = np.percentile(
+            angles, [MACENKO_ALPHA, 100 - MACENKO_ALPHA]
+        )
+        v_min = eigvecs @ [np.cos(min_angle), np.sin(min_angle)]
+        v_max = eigvecs @ [np.cos(max_angle), np.sin(max_angle)]
+
+        # hematoxylin first: it is the vector with the larger red component
+        if v_min[0] > v_max[0]:
+            stain_matrix = np.stack([v_min, v_max], axis=1)
+        else:
+            stain_matrix = np.stack([v_max, v_min], axis=1)
+
+        concentrations = densities @ np.linalg.pinv(stain_matrix).T
+        return {
+            "stain_matrix": stain_matrix,
+            "max_concentrations": np.percentile(concentrations, 99, axis=0),
+        }
+
+    def _transform(self, pixels, params):
+        concentrations = (
+            _optical_density(pixels) @ np.linalg.pinv(params["stain_matrix"]).T
+        )
+        concentrations *= self.target["max_concentrations"] / np.maximum(
+            params["max_concentrations"], 1e-6
+        )
+        densities = concentrations @ self.target["stain_matrix"].T
+        return 256 * np.exp(-densities) - 1
+
+
+STAIN_NORMALIZERS = {"reinhard": ReinhardNormalizer, "macenko": MacenkoNormalizer}
@@ -1,15 +1,20 @@
+import io
 import os
 from pathlib import Path
 
 import numpy as np
 import skimage.morphology as morph
+from PIL import Image
 from scipy import linalg, ndimage
 from skimage import color
 from skimage.filters import threshold_otsu
+from skimage.util import img_as_float
 from sklearn.cluster import KMeans
 from sklearn.decomposition import PCA
 
-from .utils import CoordinatePair
+from .utils import CoordinatePair, images_to_array, rgba_to_rgb
+
+GRAY_COEFFICIENTS = np.array([0.2125, 0.7154, 0.0721])
 
 
 class Tile:
@@ -54,6 +59,9 @@ class Tile:
 
         """
         image_arr = np.array(self._image)
+        if image_arr.ndim == 3:
+            # the alpha channel is ignored, as by has_enough_tissue_batch
+            image_arr = image_arr[..., :3]
         image_gray = color.rgb2gray(image_arr)
         # Check if image is FULL-WHITE
         if (
@@ -81,7 +89,135 @@ class Tile:
 
         return np.mean(image_bw_filled) > threshold
 
-    def save(self, path):
+    @staticmethod
+    def has_enough_tissue_batch(images, threshold=0.8, near_zero_var_threshold=0.1):
+        """
+        Check if each image of a batch has enough tissue, as `has_enough_tissue` does.
+
+        Grayscale conversion, Otsu thresholding (on per-image histograms), dilation and
+        hole filling are computed on the whole batch at once, skipping the white images.
+        White and single-color images (on which Otsu threshold is not defined) have a
+        tissue fraction of 0.
+
+        Parameters
+        ----------
+        images : ndarray, or list of Tile or PIL.Image
+            (N, H, W, 3) uint8 array (an alpha channel is ignored), or list of N tiles
+            or images of the same size.
+        threshold : float
+            Number between 0.0 and 1.0 representing the minimum required proportion
+            of tissue over the total area of the image
+        near_zero_var_threshold : float
+            Minimum image variance after morphological operations (dilation, fill holes)
+
+        Returns
+        -------
+        enough_tissue : ndarray of bool
+            (N,) array, True where the image has enough tissue
+        tissue_fraction : ndarray of float
+            (N,) array with the proportion of tissue over the total area of each image
+
+        """
+        images_arr = images_to_array(images)
+        n_images = images_arr.shape[0]
+        if not n_images:
+            return np.zeros(0, dtype=bool), np.zeros(0)
+
+        # Same conversion as color.rgb2gray, on the whole batch
+        images_float = images_arr[..., :3] * (1.0 / 255)
+        images_gray = images_float @ GRAY_COEFFICIENTS
+        del images_float
+        pixels_gray = images_gray.reshape(n_images, -1)
+
+        # Check if image is FULL-WHITE
+        white = (pixels_gray.mean(axis=1) > 0.9) & (pixels_gray.std(axis=1) < 0.09)
+        tissue_fraction = np.zeros(n_images)
+
+        # Thresholding and morphology are computed on the non-white images only
+        candidates = np.flatnonzero(~white)
+        thresh, single_color = Tile._threshold_otsu_batch(pixels_gray[candidates])
+        candidates = candidates[~single_color]
+        thresh = thresh[~single_color]
+        if not len(candidates):
+            return np.zeros(n_images, dtype=bool), tissue_fraction
+
+        # Filter out the Background
+        images_bw = images_gray[candidates] < thresh[:, np.newaxis, np.newaxis]
+        # Dilate and fill holes of each image independently: the structuring elements
+        # do not span along the batch axis
+        strel = morph.disk(5).astype(bool)[np.newaxis]
+        images_bw_dilated = ndimage.binary_dilation(images_bw, structure=strel)
+        images_bw_filled = ndimage.binary_fill_holes(
+            images_bw_dilated, structure=np.ones((1, 5, 5))
+        )
+
+        tissue_fraction[candidates] = images_bw_filled.reshape(
+            len(candidates), -1
+        ).mean(axis=1)
+        # variance of a binary image
+        variance = tissue_fraction * (1 - tissue_fraction)
+
+        enough_tissue = (variance >= near_zero_var_threshold) & (
+            tissue_fraction > threshold
+        )
+        return enough_tissue, tissue_fraction
+
+    @staticmethod
+    def _threshold_otsu_batch(pixels, nbins=256):
+        """
+        Compute the Otsu threshold of each row of `pixels`, as `threshold_otsu` does.
+
+        Parameters
+        ----------
+        pixels : ndarray of float
+            (N, P) array with the P pixel values of each of the N images
+        nbins : int
+            Number of bins used to calculate the histograms
+
+        Returns
+        -------
+        thresholds : ndarray of float
+            (N,) array of thresholds
+        single_color : ndarray of bool
+            (N,) array, True where the image has a single color (threshold undefined)
+
+        """
+        n_images = pixels.shape[0]
+        mins = pixels.min(axis=1)
+        maxs = pixels.max(axis=1)
+        single_color = mins == maxs
+        ranges = np.where(single_color, 1.0, maxs - mins)
+
+        bins = np.floor(
+            (pixels - mins[:, np.newaxis]) * (nbins / ranges)[:, np.newaxis]
+        )
+        bins = np.clip(bins, 0, nbins - 1).astype(np.intp)
+        bins += (np.arange(n_images) * nbins)[:, np.newaxis]
+        hist = np.bincount(bins.ravel(), minlength=n_images * nbins)
+        hist = hist.reshape(n_images, nbins).astype(float)
+
+        bin_edges = mins[:, np.newaxis] + ranges[:, np.newaxis] * (
+            np.arange(nbins + 1) / nbins
+        )
+        bin_centers = (bin_edges[:, :-1] + bin_edges[:, 1:]) / 2
+
+        weight1 = np.cumsum(hist, axis=1)
+        weight2 = np.cumsum(hist[:, ::-1], axis=1)[:, ::-1]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean1 = np.cumsum(hist * bin_centers, axis=1) / weight1
+            mean2 = (
+                np.cumsum((hist * bin_centers)[:, ::-1], axis=1) / weight2[:, ::-1]
+            )[:, ::-1]
+        variance12 = (
+            weight1[:, :-1] * weight2[:, 1:] * (mean1[:, :-1] - mean2[:, 1:]) ** 2
+        )
+
+        idx = np.argmax(np.where(single_color[:, np.newaxis], 0, variance12), axis=1)
+        thresholds = bin_centers[np.arange(n_images), idx]
+
+        return thresholds, single_color
+
+    def save(self, path, make_parents=True):
         """
         Save tile at given path. The format to use is determined from the filename
         extension (to be compatible to PIL.Image formats). 
@@ -91,6 +227,8 @@ class Tile:
         ---------
         path: str or pathlib.Path
             Path to which the tile is saved.
+        make_parents: bool
+            Whether to create the parent folders of `path` if missing. Default is True.
 
         """
         ext = os.path.splitext(path)[1]
@@ -98,44 +236,156 @@ class Tile:
         if not ext:
             path = f"{path}.png"
 
-        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        if make_parents:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
 
-        self._image.save(path)
+        self._pil_image().save(path)
+
+    def encode(self, format="PNG"):
+        """
+        Encode the tile in the given format.
+
+        Arguments
+        ---------
+        format: str
+            PIL.Image format name. Default is PNG.
+
+        Returns
+        -------
+        bytes
+            The encoded tile
+
+        """
+        buffer = io.BytesIO()
+        self._pil_image().save(buffer, format=format)
+        return buffer.getvalue()
+
+    def _pil_image(self):
+        if isinstance(self._image, np.ndarray):
+            return Image.fromarray(self._image)
+        return self._image
 
     @staticmethod
     def maxmin_norm(img):
         return (img - np.min(img)) / (np.max(img) - np.min(img))
 
     def invert_grays(self):
-        return -1 * (self._image - np.max(self._image))
+        return self.invert_grays_batch([self._image])[0]
+
+    @staticmethod
+    def invert_grays_batch(images):
+        """
+        Invert the gray levels of each image of a batch, with respect to its maximum.
+
+        Parameters
+        ----------
+        images : ndarray, or list of Tile or PIL.Image
+            (N, H, W, 3) uint8 array (an alpha channel is composited over white), or list
+            of N tiles or images of the same size.
+
+        Returns
+        -------
+        ndarray of uint8
+            (N, H, W, 3) array of the inverted images
+
+        """
+        images_arr = rgba_to_rgb(images_to_array(images))
+        return images_arr.max(axis=(1, 2, 3), keepdims=True) - images_arr
 
     def is_grayscale(self):
-        h_r = np.histogram(self._image[:, :, 0].ravel(), bins=np.arange(0, 256))
-        h_g = np.histogram(self._image[:, :, 1].ravel(), bins=np.arange(0, 256))
-        h_b = np.histogram(self._image[:, :, 2].ravel(), bins=np.arange(0, 256))
-        return np.all(h_r[0] == h_g[0]) and np.all(h_r[0] == h_b[0])
+        return bool(self.is_grayscale_batch([self._image])[0])
+
+    @staticmethod
+    def is_grayscale_batch(images):
+        """
+        Check if each image of a batch is grayscale, i.e. its R, G and B channels are equal.
+
+        If the whole batch is grayscale (the common case when screening scans), it is
+        checked with a single comparison over all the pixels.
+
+        Parameters
+        ----------
+        images : ndarray, or list of Tile or PIL.Image
+            (N, H, W, 3) array (an alpha channel is ignored), or list of N tiles or
+            images of the same size.
+
+        Returns
+        -------
+        ndarray of bool
+            (N,) array, True where the image is grayscale
+
+        """
+        images_arr = images_to_array(images)
+        red, green, blue = images_arr[..., 0], images_arr[..., 1], images_arr[..., 2]
+        if np.array_equal(red, green) and np.array_equal(red, blue):
+            return np.ones(len(images_arr), dtype=bool)
+
+        equal = (red == green) & (red == blue)
+        return equal.reshape(len(images_arr), -1).all(axis=1)
 
     # color processing
 
     # dummy white balance
     def balance_white(self):
-        # simple white balance: the maximum value of each image should be white
-        img_balanced = np.zeros_like(self._image)
-        img_balanced[:, :, 0] = (
-            self._image[:, :, 0] / np.max(self._image[:, :, 0].ravel()) * 255.0
-        )
-        img_balanced[:, :, 1] = (
-            self._image[:, :, 1] / np.max(self._image[:, :, 1].ravel()) * 255.0
-        )
-        img_balanced[:, :, 2] = (
-            self._image[:, :, 2] / np.max(self._image[:, :, 2].ravel()) * 255.0
+        return self.balance_white_batch([self._image])[0]
+
+    @staticmethod
+    def balance_white_batch(images):
+        """
+        Balance the white of each image of a batch: the maximum value of each channel
+        of each image becomes 255.
+
+        Parameters
+        ----------
+        images : ndarray, or list of Tile or PIL.Image
+            (N, H, W, 3) uint8 array (an alpha channel is composited over white), or list
+            of N tiles or images of the same size.
+
+        Returns
+        -------
+        ndarray of uint8
+            (N, H, W, 3) array of the balanced images (black channels stay black)
+
+        """
+        images_arr = rgba_to_rgb(images_to_array(images))
+        n_images = len(images_arr)
+        maxs = images_arr.reshape(n_images, -1, 3).max(axis=1)
+        # one 256 values lookup table per image and channel: no float copy of the batch
+        luts = (np.arange(256) / np.maximum(maxs, 1)[..., np.newaxis] * 255.0).astype(
+            np.uint8
         )
-        return img_balanced
+
+        # luts[i, c, images_arr[i, y, x, c]] for every pixel, in one fancy-index
+        return luts[
+            np.arange(n_images)[:, np.newaxis, np.newaxis, np.newaxis],
+            np.arange(3),
+            images_arr,
+        ]
 
     # deconvolution
     def detect_colors(self, n_colors=3, method="kmeans"):
+        """
+        Detect the main colors of the tile, fitting all its pixels.
+
+        To share the same colors among all the tiles of a slide, see
+        `slide_stain_colors`, which fits once a sample of pixels of many tiles.
+
+        Parameters
+        ----------
+        n_colors : int
+            Number of colors to detect. Default is 3.
+        method : {kmeans, PCA}
+            Algorithm used to detect the colors. Default is kmeans.
+
+        Returns
+        -------
+        ndarray
+            (n_colors, 3) array of the detected colors, in the min-max normalized
+            RGB space of the tile
+
+        """
         assert method in ["PCA", "kmeans"]
-        img = self.maxmin_norm(self._image)
+        img = self.maxmin_norm(rgba_to_rgb(np.asarray(self._image)).astype(np.float64))
         img_l = img.reshape((img.shape[0] * img.shape[1], img.shape[2]))
 
         if method == "PCA":
@@ -172,22 +422,95 @@ class Tile:
         img_tinted = color * img_stacked
         return img_tinted
 
-    def separate_colors(self, colors, colorize=True):
+    @staticmethod
+    def stain_projection(colors):
+        """
+        Return the matrix projecting optical densities on the main stain of each color.
+
+        For each color, the stain base is built with the next color (see
+        `find_color_base`) and inverted; only its first column (the main stain) is kept.
+
+        Parameters
+        ----------
+        colors : ndarray
+            (K, 3) array of colors, e.g. from `detect_colors` or `slide_stain_colors`
+
+        Returns
+        -------
+        ndarray
+            (3, K) projection matrix
+
+        """
         colors_new = np.vstack([colors, colors[0, :]])
-        stain_images = []
-        for id_col in range(colors.shape[0]):
-            color_1 = colors_new[id_col, :]
-            color_2 = colors_new[id_col + 1, :]
-            colors_base = self.find_color_base(color_1, color_2)
-            color_matrix = linalg.inv(colors_base)
+        return np.stack(
+            [
+                linalg.inv(Tile.find_color_base(colors_new[i], colors_new[i + 1]))[:, 0]
+                for i in range(colors.shape[0])
+            ],
+            axis=1,
+        )
+
+    @staticmethod
+    def separate_colors_batch(images, colors, colorize=True):
+        """
+        Separate the main stain of each color from a batch of images.
+
+        Same as `separate_colors` on each image, with a single optical density
+        transform and projection for the whole batch.
+
+        Parameters
+        ----------
+        images : ndarray, or list of Tile or PIL.Image
+            (N, H, W, 3) array (an alpha channel is composited over white), or list of
+            N tiles or images of the same size.
+        colors : ndarray
+            (K, 3) array of colors, e.g. from `detect_colors` or `slide_stain_colors`
+        colorize : bool
+            Whether to tint each stain image with its color. Default is True.
 
-            separated = color.separate_stains(self._image, color_matrix)
-            separated_main = separated[:, :, 0]
-            separated_main = self.maxmin_norm(separated_main)
+        Returns
+        -------
+        ndarray
+            (N, K, H, W) array of the stain images, min-max normalized per image, or
+            (N, K, H, W, 3) array if `colorize` is True
 
-            if colorize:
-                separated_main = self._colorize_image(separated_main, color_1)
+        """
+        images_arr = img_as_float(rgba_to_rgb(images_to_array(images)))
+        n_images, height, width = images_arr.shape[:3]
+
+        # same optical density as color.separate_stains, for all the colors at once
+        densities = -np.log(images_arr.reshape(n_images, height * width, 3) + 2)
+        # (N, K, H * W): each stain image is contiguous, for fast min-max reductions
+        stains = np.matmul(
+            Tile.stain_projection(colors).T, densities.transpose(0, 2, 1)
+        )
+
+        mins = stains.min(axis=2, keepdims=True)
+        maxs = stains.max(axis=2, keepdims=True)
+        stains -= mins
+        stains /= maxs - mins
+        stains = stains.reshape(n_images, -1, height, width)
 
-            stain_images.append(separated_main)
+        if colorize:
+            stains = stains[..., np.newaxis] * colors[:, np.newaxis, np.newaxis, :]
+        return stains
 
-        return stain_images
+    def separate_colors(self, colors, colorize=True):
+        """
+        Separate the main stain of each color from the tile.
+
+        Parameters
+        ----------
+        colors : ndarray
+            (K, 3) array of colors, e.g. from `detect_colors` or `slide_stain_colors`
+        colorize : bool
+            Whether to tint each stain image with its color. Default is True.
+
+        Returns
+        -------
+        list of ndarray
+            K (H, W) stain images, min-max normalized, or (H, W, 3) if `colorize` is
+            True
+
+        """
+        return list(self.separate_colors_batch([self._image], colors, colorize)[0])
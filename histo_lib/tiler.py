@@ -1,17 +1,282 @@
 from abc import ABC, abstractmethod
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
 
 import numpy as np
+from PIL import Image
 
+from .pipeline import batched, ordered_map
 from .tile import Tile
-from .utils import CoordinatePair, scale_coordinates
+from .utils import (
+    CoordinatePair,
+    grid_coordinates,
+    images_to_array,
+    mask_fraction,
+    rgba_to_rgb,
+    scale_coordinates,
+)
 from .wsi import WSI
 
+COORDINATES_BLOCK_SIZE = 1024
+# maximum number of tiles checked for tissue at once
+TISSUE_CHECK_BATCH_SIZE = 16
+
 
 class Tiler(ABC):
     @abstractmethod
-    def extract(self, wsi):
+    def extract(self, wsi, writer=None):
         raise NotImplementedError
 
+    @abstractmethod
+    def _tiles_generator(self, wsi):
+        raise NotImplementedError
+
+    def stream(self, wsi, batch_size=32):
+        """
+        Extract tiles and yield them in batches of arrays, without writing to disk.
+
+        Tiles are the same that `extract` would save, in the same order; the alpha channel
+        is composited over a white background. If `normalizer` attribute is set, tiles
+        are stain normalized during the extraction, without any encode and decode.
+
+        Parameters
+        ----------
+        wsi : WSI
+            The Whole Slide Image from which to extract the tiles.
+        batch_size : int
+            Maximum number of tiles of each batch. Default is 32.
+
+        Yields
+        ------
+        coords : ndarray of int64
+            (B, 4) array of the level-0 coordinates of the tiles of the batch
+        images : ndarray of uint8
+            (B, H, W, 3) RGB array of the tiles of the batch
+
+        Raises
+        ------
+        TypeError
+            If wsi is not an instance of WSI.
+
+        """
+        self._check_wsi(wsi)
+
+        batch = []
+        for tile, tile_wsi_coords, _ in self._tiles_generator(wsi):
+            batch.append((tile_wsi_coords, rgba_to_rgb(np.asarray(tile.image))))
+
+            if len(batch) == batch_size:
+                yield self._stack_batch(batch)
+                batch = []
+
+        if batch:
+            yield self._stack_batch(batch)
+
+    @staticmethod
+    def _stack_batch(batch):
+        coords, images = zip(*batch)
+        return np.array(coords, dtype="int64"), images_to_array(images)
+
+    def _check_wsi(self, wsi):
+        """
+        Check that tiles can be extracted from `wsi` at the tiler level.
+
+        Raises
+        ------
+        TypeError
+            If wsi is not an instance of WSI.
+
+        """
+        if not isinstance(wsi, WSI):
+            raise TypeError("wsi must be of type WSI.")
+
+        assert (
+            self.level in wsi.levels
+        ), f"Level {self.level} not available. Please select {', '.join(map(str, wsi.levels[:-1]))} or {wsi.levels[-1]}"
+
+    def _tile_filename(self, tile_wsi_coords, tiles_counter):
+        x_ul_wsi, y_ul_wsi, x_br_wsi, y_br_wsi = tile_wsi_coords
+        tile_filename = f"{self.prefix}tile_{tiles_counter}_level{self.level}_{x_ul_wsi}-{y_ul_wsi}-{x_br_wsi}-{y_br_wsi}{self.suffix}"
+        return tile_filename
+
+    def _read_tile(self, wsi, tile_wsi_coords):
+        # arrays: with the read cache, tiles are views of the cached super-regions
+        return wsi.extract_tile(
+            tile_wsi_coords, self.level, size=self.tile_size, as_array=True
+        )
+
+    def _check_tiles(self, wsi, tiles):
+        """
+        Check if a batch of tiles of the same size have enough tissue.
+
+        If `normalizer` attribute is set, the accepted tiles are stain normalized in a
+        single batch.
+
+        Parameters
+        ----------
+        wsi : WSI
+            The Whole Slide Image from which the tiles are extracted.
+        tiles : list of Tile
+            The tiles to check
+
+        Returns
+        -------
+        list of (Tile, bool, float)
+            Each tile (stain normalized if accepted and `normalizer` is set), whether it
+            is eligible to be saved and its tissue fraction (NaN if `check_tissue` is
+            False)
+
+        """
+        if self.check_tissue:
+            enough_tissue, tissue_fractions = Tile.has_enough_tissue_batch(tiles)
+        else:
+            enough_tissue = np.ones(len(tiles), dtype=bool)
+            tissue_fractions = np.full(len(tiles), np.nan)
+
+        tiles = list(tiles)
+        accepted_idxs = np.flatnonzero(enough_tissue)
+        if self.normalizer is not None and len(accepted_idxs):
+            normalized = self.normalizer.normalize(
+                [tiles[i] for i in accepted_idxs], wsi
+            )
+            for i, normalized_image in zip(accepted_idxs, normalized):
+                tiles[i] = Tile(normalized_image, tiles[i].level, tiles[i].coords)
+
+        return list(zip(tiles, enough_tissue.tolist(), tissue_fractions.tolist()))
+
+    def _candidate_tiles(self, wsi, coordinates, batch_size=TISSUE_CHECK_BATCH_SIZE):
+        """
+        Read the tiles at the given coordinates and check if they have enough tissue.
+
+        Tissue is checked on batches of up to `batch_size` consecutive tiles. If
+        `n_workers` attribute is greater than 1, region reads and tissue checks run in
+        two pipelined stages of `n_workers` threads each, with at most `2 * n_workers`
+        tiles being read and `n_workers` batches being checked. The tiles are yielded in
+        the order of `coordinates`. If `normalizer` attribute is set, the accepted tiles
+        are stain normalized in the tissue check stage.
+
+        Parameters
+        ----------
+        wsi : WSI
+            The Whole Slide Image from which to extract the tiles.
+        coordinates : iterable of Coordinates
+            The level-0 coordinates of the tiles
+        batch_size : int
+            Maximum number of tiles checked at once. Default is
+            `TISSUE_CHECK_BATCH_SIZE`.
+
+        Yields
+        ------
+        tile : Tile
+            The extracted Tile (stain normalized if accepted and `normalizer` is set)
+        coords : Coordinates
+            The level-0 coordinates of the extracted tile
+        accepted : bool
+            Whether the tile is eligible to be saved
+        tissue_fraction : float
+            Proportion of tissue over the total area of the tile (NaN if `check_tissue`
+            is False)
+
+        """
+        if self.normalizer is not None:
+            # the slide statistics are estimated once, before reading any tile
+            self.normalizer.slide_params(wsi)
+
+        if self.n_workers <= 1:
+            tiles = (self._read_tile(wsi, coords) for coords in coordinates)
+            for tiles_batch in batched(tiles, batch_size):
+                for tile, accepted, tissue_fraction in self._check_tiles(
+                    wsi, tiles_batch
+                ):
+                    yield tile, tile.coords, accepted, tissue_fraction
+            return
+
+        with ThreadPoolExecutor(self.n_workers) as readers, ThreadPoolExecutor(
+            self.n_workers
+        ) as checkers:
+            tiles = ordered_map(
+                partial(self._read_tile, wsi), coordinates, readers, 2 * self.n_workers
+            )
+            checked_batches = ordered_map(
+                partial(self._check_tiles, wsi),
+                batched(tiles, batch_size),
+                checkers,
+                self.n_workers,
+            )
+            try:
+                for checked_tiles in checked_batches:
+                    for tile, accepted, tissue_fraction in checked_tiles:
+                        yield tile, tile.coords, accepted, tissue_fraction
+            finally:
+                checked_batches.close()
+                tiles.close()
+
+    def _save_tile(self, wsi, writer, counter_and_tile):
+        tiles_counter, (tile, tile_wsi_coords, tissue_fraction) = counter_and_tile
+        tile_filename = self._tile_filename(tile_wsi_coords, tiles_counter)
+
+        if writer is None:
+            tile.save(tile_filename, make_parents=False)
+        else:
+            ext = os.path.splitext(tile_filename)[1].lower()
+            writer.append(
+                os.path.basename(tile_filename),
+                tile.encode(Image.registered_extensions().get(ext, "PNG")),
+                wsi.filename.stem,
+                self.level,
+                tile_wsi_coords,
+                tissue_fraction,
+            )
+        return tile_filename
+
+    def _save_tiles(self, wsi, tiles, writer=None):
+        """
+        Save the tiles to disk, numbering them in order.
+
+        If `n_workers` attribute is greater than 1, tiles are encoded and written by
+        `n_workers` threads, with at most `2 * n_workers` tiles waiting to be written.
+
+        Parameters
+        ----------
+        wsi : WSI
+            The Whole Slide Image from which the tiles are extracted.
+        tiles : iterable of (Tile, Coordinates, float)
+            The tiles to save, with their level-0 coordinates and tissue fraction
+        writer : ShardWriter, optional
+            If provided, tiles are appended to its shards (named after the basename of
+            their filename) instead of being saved as separate files.
+
+        Returns
+        -------
+        list of str
+            Filenames of the saved tiles
+
+        """
+        if writer is None:
+            Path(f"{self.prefix}tile").parent.mkdir(parents=True, exist_ok=True)
+
+        save_tile = partial(self._save_tile, wsi, writer)
+
+        if self.n_workers <= 1:
+            saved_tiles = map(save_tile, enumerate(tiles))
+            return self._collect_saved_tiles(saved_tiles)
+
+        with ThreadPoolExecutor(self.n_workers) as writers:
+            saved_tiles = ordered_map(
+                save_tile, enumerate(tiles), writers, 2 * self.n_workers
+            )
+            return self._collect_saved_tiles(saved_tiles)
+
+    def _collect_saved_tiles(self, saved_tiles):
+        tile_filenames = []
+        for tiles_counter, tile_filename in enumerate(saved_tiles):
+            tile_filenames.append(tile_filename)
+            if self.verbose:
+                print(f"\t Tile {tiles_counter} saved: {tile_filename}")
+        return tile_filenames
+
 
 class RandomTiler(Tiler):
     """
@@ -36,6 +301,29 @@ class RandomTiler(Tiler):
     max_iter : int
         Maximum number of iterations performed when searching for eligible (if check_tissue=True) tiles.
         Must be grater than or equal to `n_tiles`.
+    sampling : {box, mask}
+        How candidate tiles are drawn:
+        * box: uniformly within the box returned by `box_coords`
+        * mask: from the tile-sized cells overlapping the WSI thumbnail tissue mask,
+          with probability proportional to the cell tissue fraction
+
+        Default is box.
+    n_workers : int
+        Number of threads of each extraction stage (region read, tissue check, encode and
+        write). Default is 1, i.e. tiles are processed serially.
+    normalizer : StainNormalizer or None
+        If set, the accepted tiles are stain normalized (as RGB images) before being
+        saved or streamed. Default is None.
+    verbose : bool
+        Whether to print the filename of every saved tile. Default is False.
+    block_sampling : bool
+        Whether to draw each random variable of the candidates (e.g. x, then y) for
+        blocks of `COORDINATES_BLOCK_SIZE` candidates at once, which is faster with mask
+        sampling but, for a given seed, yields different tiles than drawing them one at a
+        time. Default is False.
+    acceptance_rate : float or None
+        Fraction of the candidate tiles accepted during the last extraction.
+        None if no extraction has been performed yet.
 
     """
 
@@ -49,6 +337,11 @@ class RandomTiler(Tiler):
         prefix="",
         suffix=".png",
         max_iter=1e4,
+        sampling="box",
+        n_workers=1,
+        normalizer=None,
+        verbose=False,
+        block_sampling=False,
     ):
         """
         RandomTiler constructor.
@@ -72,11 +365,39 @@ class RandomTiler(Tiler):
         max_iter : int
             Maximum number of iterations performed when searching for eligible (if check_tissue=True) tiles.
             Must be grater than or equal to `n_tiles`.
+        sampling : {box, mask}
+            How candidate tiles are drawn:
+            * box: uniformly within the box returned by `box_coords`
+            * mask: from the tile-sized cells overlapping the WSI thumbnail tissue mask,
+              with probability proportional to the cell tissue fraction
+
+            Default is box.
+        n_workers : int
+            Number of threads of each extraction stage (region read, tissue check, encode
+            and write). Default is 1, i.e. tiles are processed serially.
+        normalizer : StainNormalizer, optional
+            If provided, the accepted tiles are stain normalized (as RGB images) before
+            being saved or streamed. Default is None.
+        verbose : bool
+            Whether to print the filename of every saved tile. Default is False.
+        block_sampling : bool
+            Whether to draw each random variable of the candidates (e.g. x, then y) for
+            blocks of `COORDINATES_BLOCK_SIZE` candidates at once, which is faster with
+            mask sampling but, for a given seed, yields different tiles than drawing
+            them one at a time. Default is False.
+
+        Raises
+        ------
+        ValueError
+            If sampling is not 'box' or 'mask'
 
         """
 
         super().__init__()
 
+        if sampling not in ["box", "mask"]:
+            raise ValueError(f"sampling must be 'box' or 'mask'. Got {sampling}.")
+
         try:
             getattr(tile_size, "__len__")
             assert len(tile_size) == 2, "size should be integer or [size_w, size_h]"
@@ -98,6 +419,12 @@ class RandomTiler(Tiler):
         self.check_tissue = check_tissue
         self.prefix = prefix
         self.suffix = suffix
+        self.sampling = sampling
+        self.n_workers = n_workers
+        self.normalizer = normalizer
+        self.verbose = verbose
+        self.block_sampling = block_sampling
+        self.acceptance_rate = None
 
     def box_coords(self, wsi):
         """Return Coordinates at level 0 of the box to consider for tiles extraction.
@@ -120,7 +447,7 @@ class RandomTiler(Tiler):
             return wsi.tissue_box_coords_wsi
         else:
             w_wsi, h_wsi = wsi.get_dimensions(level=0)
-            return Coordinates(0, 0, w_wsi, h_wsi)
+            return CoordinatePair(0, 0, w_wsi, h_wsi)
 
     def box_coords_lvl(self, wsi):
         """Return Coordinates at level `level` of the box to consider for tiles extraction.
@@ -152,12 +479,25 @@ class RandomTiler(Tiler):
 
         return box_coords_lvl
 
-    def extract(self, wsi):
+    def extract(self, wsi, writer=None):
         """
         Extract tiles consuming `random_tiles_generator` and save them to disk,
         following this filename pattern:
             `{prefix}tile_{tiles_counter}_level{level}_{x_ul_wsi}-{y_ul_wsi}-{x_br_wsi}-{y_br_wsi}{suffix}`
 
+        Parameters
+        ----------
+        wsi : WSI
+            The Whole Slide Image from which to extract the tiles.
+        writer : ShardWriter, optional
+            If provided, tiles are appended to its shards, named after the basename of
+            their filename, instead of being saved as separate files.
+
+        Returns
+        -------
+        list of str
+            Filenames of the saved tiles
+
         Raises
         ------
         TypeError
@@ -166,56 +506,155 @@ class RandomTiler(Tiler):
         """
         # TODO: manage alpha channel
 
-        np.random.seed(self.seed)
+        self._check_wsi(wsi)
 
-        if not isinstance(wsi, WSI):
-            raise TypeError("wsi must be of type WSI.")
+        random_tiles = self._tiles_generator(wsi)
 
-        assert (
-            self.level in wsi.levels
-        ), f"Level {level} not available. Please select {', '.join(wsi.levels[:-1])} or {wsi.levels[-1]}"
+        tile_filenames = self._save_tiles(wsi, random_tiles, writer)
+        print(f"{len(tile_filenames)} Random Tiles have been saved.")
+        print(f"Acceptance rate: {self.acceptance_rate:.3f}")
 
-        random_tiles = self._random_tiles_generator(wsi)
+        return tile_filenames
+
+    def _tiles_generator(self, wsi):
+        np.random.seed(self.seed)
+        return self._random_tiles_generator(wsi)
 
-        for tiles_counter, (tile, tile_wsi_coords) in enumerate(random_tiles):
-            tile_filename = self._tile_filename(tile_wsi_coords, tiles_counter)
-            tile.save(tile_filename)
-            print(f"\t Tile {tiles_counter} saved: {tile_filename}")
-        print(f"{tiles_counter} Random Tiles have been saved.")
+    def _random_tile_coordinates(self, wsi, n_tiles, box_coords_lvl=None):
+        """Return 0-level coordinates of `n_tiles` tiles picked at random within the box.
 
-    def _random_tile_coordinates(self, wsi):
-        """Return 0-level Coordinates of a tile picked at random within the tissue box.
+        If `block_sampling` attribute is False, the x and y of each tile are drawn one
+        after the other, as if the tiles were drawn one at a time.
 
         Parameters
         ----------
         wsi : WSI
             WSI from which calculate the coordinates.
             Needed to calculate the box.
+        n_tiles : int
+            Number of tiles to pick
+        box_coords_lvl : Coordinates, optional
+            The box at level `level` (see `box_coords_lvl`), if already computed
 
         Returns
         -------
-        Coordinates
-            Random tile Coordinates at level 0
+        ndarray of int64
+            (n_tiles, 4) array of random tiles coordinates at level 0
         """
-        box_coords_lvl = self.box_coords_lvl(wsi)
+        if box_coords_lvl is None:
+            box_coords_lvl = self.box_coords_lvl(wsi)
         tile_w_lvl, tile_h_lvl = self.tile_size
+        x_low, x_high = box_coords_lvl.x_ul, box_coords_lvl.x_br - (tile_w_lvl + 1)
+        y_low, y_high = box_coords_lvl.y_ul, box_coords_lvl.y_br - (tile_h_lvl + 1)
 
-        x_ul_lvl = np.random.randint(
-            box_coords_lvl.x_ul, box_coords_lvl.x_br - (tile_w_lvl + 1),
-        )
-        y_ul_lvl = np.random.randint(
-            box_coords_lvl.y_ul, box_coords_lvl.y_br - (tile_h_lvl + 1),
+        if self.block_sampling:
+            x_ul_lvl = np.random.randint(x_low, x_high, size=n_tiles)
+            y_ul_lvl = np.random.randint(y_low, y_high, size=n_tiles)
+        else:
+            # bounds broadcast over the (x, y) columns: the draws are made row by row
+            x_ul_lvl, y_ul_lvl = np.random.randint(
+                [x_low, y_low], [x_high, y_high], size=(n_tiles, 2)
+            ).T
+
+        return self._tiles_coords_wsi(wsi, x_ul_lvl, y_ul_lvl)
+
+    def _tiles_coords_wsi(self, wsi, x_ul_lvl, y_ul_lvl):
+        """Scale to level 0 the tiles with upper-left corners (`x_ul_lvl`, `y_ul_lvl`)."""
+        tile_w_lvl, tile_h_lvl = self.tile_size
+        tiles_coords_lvl = np.stack(
+            [x_ul_lvl, y_ul_lvl, x_ul_lvl + tile_w_lvl, y_ul_lvl + tile_h_lvl], axis=1
         )
-        x_br_lvl = x_ul_lvl + tile_w_lvl
-        y_br_lvl = y_ul_lvl + tile_h_lvl
 
-        tile_wsi_coords = scale_coordinates(
-            reference_coords=(x_ul_lvl, y_ul_lvl, x_br_lvl, y_br_lvl),
+        return scale_coordinates(
+            reference_coords=tiles_coords_lvl,
             reference_size=wsi.get_dimensions(level=self.level),
             target_size=wsi.get_dimensions(level=0),
         )
 
-        return tile_wsi_coords
+    def _tissue_cells(self, wsi):
+        """Return the tile-sized cells at level `level` overlapping the tissue mask.
+
+        Parameters
+        ----------
+        wsi : WSI
+            WSI from which calculate the cells.
+
+        Returns
+        -------
+        cells_lvl : ndarray of int64
+            (N, 4) array of the coordinates, at level `level`, of the cells with tissue
+        probabilities : ndarray of float
+            (N,) array of the sampling probabilities of the cells, proportional to their
+            tissue fraction
+        """
+        w_lvl, h_lvl = wsi.get_dimensions(level=self.level)
+        w_wsi, h_wsi = wsi.get_dimensions(level=0)
+
+        cells_lvl = grid_coordinates(
+            (0, 0, w_lvl, h_lvl), self.tile_size, self.tile_size
+        )
+        cells_wsi = scale_coordinates(
+            reference_coords=cells_lvl,
+            reference_size=(w_lvl, h_lvl),
+            target_size=(w_wsi, h_wsi),
+        )
+        fractions = mask_fraction(
+            wsi.tissue_mask, cells_wsi, reference_size=(w_wsi, h_wsi)
+        )
+
+        tissue = fractions > 0
+        return cells_lvl[tissue], fractions[tissue] / np.sum(fractions[tissue])
+
+    def _random_mask_tile_coordinates(self, wsi, cells_lvl, probabilities, n_tiles):
+        """Return 0-level coordinates of `n_tiles` tiles picked at random around tissue cells.
+
+        Cells are drawn with the given probabilities, then each tile is shifted at random
+        by up to half of its size, staying within the level. If `block_sampling`
+        attribute is False, the cell and the shifts of each tile are drawn one after the
+        other, as if the tiles were drawn one at a time.
+
+        Parameters
+        ----------
+        wsi : WSI
+            WSI from which calculate the coordinates.
+        cells_lvl : ndarray of int64
+            (N, 4) array of the cells coordinates at level `level`, see `_tissue_cells`
+        probabilities : ndarray of float
+            (N,) array of the sampling probabilities of the cells
+        n_tiles : int
+            Number of tiles to pick
+
+        Returns
+        -------
+        ndarray of int64
+            (n_tiles, 4) array of random tiles coordinates at level 0
+        """
+        w_lvl, h_lvl = wsi.get_dimensions(level=self.level)
+        tile_w_lvl, tile_h_lvl = self.tile_size
+        dx_low, dx_high = -(tile_w_lvl // 2), tile_w_lvl // 2 + 1
+        dy_low, dy_high = -(tile_h_lvl // 2), tile_h_lvl // 2 + 1
+
+        if self.block_sampling:
+            cells_idxs = np.random.choice(len(cells_lvl), size=n_tiles, p=probabilities)
+            dx = np.random.randint(dx_low, dx_high, size=n_tiles)
+            dy = np.random.randint(dy_low, dy_high, size=n_tiles)
+        else:
+            # the same draws as np.random.choice, with the cdf computed once
+            cdf = np.cumsum(probabilities)
+            cdf /= cdf[-1]
+            cells_idxs = np.empty(n_tiles, dtype="int64")
+            dx = np.empty(n_tiles, dtype="int64")
+            dy = np.empty(n_tiles, dtype="int64")
+            for i in range(n_tiles):
+                cells_idxs[i] = cdf.searchsorted(np.random.random_sample(), "right")
+                dx[i] = np.random.randint(dx_low, dx_high)
+                dy[i] = np.random.randint(dy_low, dy_high)
+
+        cells = cells_lvl[cells_idxs]
+        x_ul_lvl = np.clip(cells[:, 0] + dx, 0, w_lvl - tile_w_lvl)
+        y_ul_lvl = np.clip(cells[:, 1] + dy, 0, h_lvl - tile_h_lvl)
+
+        return self._tiles_coords_wsi(wsi, x_ul_lvl, y_ul_lvl)
 
     def _random_tiles_generator(self, wsi):
         """
@@ -224,10 +663,15 @@ class RandomTiler(Tiler):
         If `check_tissue` attribute is True, the box corresponds to the tissue box,
         otherwise it corresponds to the whole level.
 
+        If `sampling` attribute is 'mask', the candidate tiles are drawn around the cells
+        overlapping the tissue mask instead (see `_tissue_cells`).
+
         Stops if:
         * the number of extracted tiles is equal to `n_tiles` OR
         * the maximum number of iterations `max_iter` is reached
 
+        At the end, `acceptance_rate` is set to the fraction of candidate tiles yielded.
+
         Parameters
         ----------
         wsi : WSI
@@ -239,33 +683,316 @@ class RandomTiler(Tiler):
             The extracted Tile
         coords : Coordinates
             The level-0 coordinates of the extracted tile
+        tissue_fraction : float
+            Proportion of tissue over the total area of the tile (NaN if `check_tissue`
+            is False)
 
         """
 
         iteration = valid_tile_counter = 0
+        self.acceptance_rate = 0.0
 
-        while True:
-            iteration += 1
+        # no more tiles than needed are checked at once
+        candidate_tiles = self._candidate_tiles(
+            wsi,
+            self._random_tiles_coordinates_generator(wsi),
+            max(min(TISSUE_CHECK_BATCH_SIZE, self.n_tiles), 1),
+        )
 
-            tile_wsi_coords = self._random_tile_coordinates(wsi)
+        try:
+            for tile, tile_wsi_coords, accepted, tissue_fraction in candidate_tiles:
+                iteration += 1
 
-            tile = wsi.extract_tile(tile_wsi_coords, self.level)
+                if accepted:
+                    yield tile, tile_wsi_coords, tissue_fraction
+                    valid_tile_counter += 1
 
-            if not self.check_tissue or tile.has_enough_tissue():
-                yield tile, tile_wsi_coords
-                valid_tile_counter += 1
+                self.acceptance_rate = valid_tile_counter / iteration
 
-            if self.max_iter and iteration > self.max_iter:
-                break
+                if valid_tile_counter >= self.n_tiles:
+                    break
+        finally:
+            candidate_tiles.close()
 
-            if valid_tile_counter >= self.n_tiles:
-                break
+    def _random_tiles_coordinates_generator(self, wsi):
+        """
+        Generate the 0-level Coordinates of the candidate random tiles.
 
-    def _tile_filename(self, tile_wsi_coords, tiles_counter):
-        x_ul_wsi, y_ul_wsi, x_br_wsi, y_br_wsi = tile_wsi_coords
-        tile_filename = f"{self.prefix}tile_{tiles_counter}_level{self.level}_{x_ul_wsi}-{y_ul_wsi}-{x_br_wsi}-{y_br_wsi}{self.suffix}"
-        return tile_filename
+        Coordinates are drawn and scaled in blocks. If `block_sampling` attribute is
+        True, blocks have `COORDINATES_BLOCK_SIZE` candidates and every random variable
+        is drawn for the whole block at once. Otherwise blocks grow from `n_tiles` to
+        `COORDINATES_BLOCK_SIZE` candidates, drawn in the same order as one candidate at
+        a time, which keeps the random draws (and so the tiles) of a given seed of the
+        previous releases. Stops when the maximum number of iterations `max_iter` is
+        reached.
+
+        Parameters
+        ----------
+        wsi : WSI
+            The Whole Slide Image from which to extract the tiles.
+
+        Yields
+        ------
+        Coordinates
+            Random tile Coordinates at level 0
+
+        """
+        # the box and the tissue cells are computed once per extraction
+        if self.sampling == "mask":
+            cells_lvl, probabilities = self._tissue_cells(wsi)
+            if not len(cells_lvl):
+                return
+        else:
+            box_coords_lvl = self.box_coords_lvl(wsi)
+
+        # at most max_iter + 1 candidates
+        n_remaining = int(self.max_iter) + 1 if self.max_iter else None
+        if self.block_sampling:
+            block_size = COORDINATES_BLOCK_SIZE
+        else:
+            # the tiles of a block do not depend on its size: few draws if few are needed
+            block_size = min(max(int(self.n_tiles), 1), COORDINATES_BLOCK_SIZE)
+
+        while n_remaining is None or n_remaining > 0:
+            n_block = block_size
+            if n_remaining is not None:
+                n_block = min(n_block, n_remaining)
+                n_remaining -= n_block
+
+            if self.sampling == "mask":
+                block_coords = self._random_mask_tile_coordinates(
+                    wsi, cells_lvl, probabilities, n_block
+                )
+            else:
+                block_coords = self._random_tile_coordinates(
+                    wsi, n_block, box_coords_lvl
+                )
+
+            for tile_wsi_coords in block_coords.tolist():
+                yield CoordinatePair(*tile_wsi_coords)
+
+            block_size = min(2 * block_size, COORDINATES_BLOCK_SIZE)
 
 
 class GridTiler(Tiler):
-    pass
+    """
+    Class for extracting tiles from a WSI on a regular grid, at the given level, with the given size.
+
+    The grid covers the whole level. If `check_tissue` is True, the grid cells not
+    overlapping the tissue mask of the WSI thumbnail are discarded before reading any
+    region from the slide.
+
+    Attributes
+    ----------
+    tile_size : int, tuple or list of int
+        (width, height) of the extracted tiles.
+    level : int
+        Level from which extract the tiles. Default is 0.
+    pixel_overlap : int
+        Number of overlapping pixels (at level `level`) between adjacent tiles.
+        Default is 0, i.e. no overlap.
+    check_tissue : bool
+        Whether to check if the tile has enough tissue to be saved. Default is True.
+    mask_threshold : float
+        Minimum fraction of the tile area covered by the thumbnail tissue mask for the
+        tile to be read from the slide. Used only if `check_tissue` is True. Default is 0.0,
+        i.e. every tile overlapping the tissue mask is read.
+    prefix : str
+        Prefix to be added to the tile filename. Default is an empty string.
+    suffix : str
+        Suffix to be added to the tile filename. Default is '.png'
+    n_workers : int
+        Number of threads of each extraction stage (region read, tissue check, encode and
+        write). Default is 1, i.e. tiles are processed serially.
+    normalizer : StainNormalizer or None
+        If set, the accepted tiles are stain normalized (as RGB images) before being
+        saved or streamed. Default is None.
+    verbose : bool
+        Whether to print the filename of every saved tile. Default is False.
+
+    """
+
+    def __init__(
+        self,
+        tile_size,
+        level=0,
+        pixel_overlap=0,
+        check_tissue=True,
+        mask_threshold=0.0,
+        prefix="",
+        suffix=".png",
+        n_workers=1,
+        normalizer=None,
+        verbose=False,
+    ):
+        """
+        GridTiler constructor.
+
+        Parameters
+        ----------
+        tile_size : int, tuple or list of int
+            (width, height) of the extracted tiles.
+        level : int
+            Level from which extract the tiles. Default is 0.
+        pixel_overlap : int
+            Number of overlapping pixels (at level `level`) between adjacent tiles.
+            Default is 0, i.e. no overlap.
+        check_tissue : bool
+            Whether to check if the tile has enough tissue to be saved. Default is True.
+        mask_threshold : float
+            Minimum fraction of the tile area covered by the thumbnail tissue mask for the
+            tile to be read from the slide. Used only if `check_tissue` is True. Default is 0.0,
+            i.e. every tile overlapping the tissue mask is read.
+        prefix : str
+            Prefix to be added to the tile filename. Default is an empty string.
+        suffix : str
+            Suffix to be added to the tile filename. Default is '.png'
+        n_workers : int
+            Number of threads of each extraction stage (region read, tissue check, encode
+            and write). Default is 1, i.e. tiles are processed serially.
+        normalizer : StainNormalizer, optional
+            If provided, the accepted tiles are stain normalized (as RGB images) before
+            being saved or streamed. Default is None.
+        verbose : bool
+            Whether to print the filename of every saved tile. Default is False.
+
+        """
+
+        super().__init__()
+
+        try:
+            getattr(tile_size, "__len__")
+            assert len(tile_size) == 2, "size should be integer or [size_w, size_h]"
+            tile_w, tile_h = tile_size
+        except AttributeError:
+            tile_w = tile_h = int(tile_size)
+        except AssertionError as ae:
+            raise ae
+
+        assert (
+            0 <= pixel_overlap < min(tile_w, tile_h)
+        ), f"pixel_overlap must be non negative and smaller than the tile size. Got {pixel_overlap}."
+
+        self.tile_size = (tile_w, tile_h)
+        self.level = level
+        self.pixel_overlap = pixel_overlap
+        self.check_tissue = check_tissue
+        self.mask_threshold = mask_threshold
+        self.prefix = prefix
+        self.suffix = suffix
+        self.n_workers = n_workers
+        self.normalizer = normalizer
+        self.verbose = verbose
+
+    @property
+    def stride(self):
+        """(horizontal, vertical) distance between adjacent tiles, at level `level`."""
+        tile_w, tile_h = self.tile_size
+        return (tile_w - self.pixel_overlap, tile_h - self.pixel_overlap)
+
+    def extract(self, wsi, writer=None):
+        """
+        Extract the grid tiles and save them to disk, following this filename pattern:
+            `{prefix}tile_{tiles_counter}_level{level}_{x_ul_wsi}-{y_ul_wsi}-{x_br_wsi}-{y_br_wsi}{suffix}`
+
+        Parameters
+        ----------
+        wsi : WSI
+            The Whole Slide Image from which to extract the tiles.
+        writer : ShardWriter, optional
+            If provided, tiles are appended to its shards, named after the basename of
+            their filename, instead of being saved as separate files.
+
+        Returns
+        -------
+        list of str
+            Filenames of the saved tiles
+
+        Raises
+        ------
+        TypeError
+            If wsi is not an instance of WSI.
+
+        """
+        self._check_wsi(wsi)
+
+        grid_tiles = self._tiles_generator(wsi)
+
+        tile_filenames = self._save_tiles(wsi, grid_tiles, writer)
+        print(f"{len(tile_filenames)} Grid Tiles have been saved.")
+
+        return tile_filenames
+
+    def _tiles_generator(self, wsi):
+        return self._grid_tiles_generator(wsi)
+
+    def _grid_tile_coordinates(self, wsi):
+        """Return the 0-level coordinates of the grid tiles to read from the slide.
+
+        The whole grid is built at once; if `check_tissue` is True, the tiles whose
+        area covered by the thumbnail tissue mask is not greater than `mask_threshold`
+        are discarded.
+
+        Parameters
+        ----------
+        wsi : WSI
+            WSI from which calculate the coordinates.
+
+        Returns
+        -------
+        ndarray of int64
+            (N, 4) array of tiles coordinates at level 0
+        """
+        w_lvl, h_lvl = wsi.get_dimensions(level=self.level)
+        w_wsi, h_wsi = wsi.get_dimensions(level=0)
+
+        grid_coords_lvl = grid_coordinates(
+            (0, 0, w_lvl, h_lvl), self.tile_size, self.stride
+        )
+        grid_coords_wsi = scale_coordinates(
+            reference_coords=grid_coords_lvl,
+            reference_size=(w_lvl, h_lvl),
+            target_size=(w_wsi, h_wsi),
+        )
+
+        if self.check_tissue:
+            fractions = mask_fraction(
+                wsi.tissue_mask, grid_coords_wsi, reference_size=(w_wsi, h_wsi)
+            )
+            grid_coords_wsi = grid_coords_wsi[fractions > self.mask_threshold]
+
+        return grid_coords_wsi
+
+    def _grid_tiles_generator(self, wsi):
+        """
+        Generate the grid tiles of a WSI.
+
+        If `check_tissue` attribute is True, only the tiles overlapping the tissue mask
+        are read and only the ones with enough tissue are yielded.
+
+        Parameters
+        ----------
+        wsi : WSI
+            The Whole Slide Image from which to extract the tiles.
+
+        Yields
+        ------
+        tile : Tile
+            The extracted Tile
+        coords : Coordinates
+            The level-0 coordinates of the extracted tile
+        tissue_fraction : float
+            Proportion of tissue over the total area of the tile (NaN if `check_tissue`
+            is False)
+
+        """
+        grid_coords = (
+            CoordinatePair(*tile_wsi_coords)
+            for tile_wsi_coords in self._grid_tile_coordinates(wsi)
+        )
+
+        candidate_tiles = self._candidate_tiles(wsi, grid_coords)
+
+        for tile, tile_wsi_coords, accepted, tissue_fraction in candidate_tiles:
+            if accepted:
+                yield tile, tile_wsi_coords, tissue_fraction
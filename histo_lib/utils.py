@@ -1,4 +1,8 @@
+import os
+import uuid
 from collections import namedtuple
+from contextlib import contextmanager
+from pathlib import Path
 
 import numpy as np
 
@@ -13,7 +17,7 @@ def scale_coordinates(reference_coords, reference_size, target_size):
     ----------
     reference_coords: tuple, array-like or Coordinates
         (x, y) pair of coordinates referring to the upper left and lower right corners respectively.
-        The function expects a tuple of four elements or a tuple of two pairs of coordinates as input.
+        The function expects a tuple of four elements, or a (N, 4) array of N boxes.
     reference_size: array_like of int
         Reference (width, height) size to which input coordinates refer to
     target_size: array_like of int
@@ -21,17 +25,212 @@ def scale_coordinates(reference_coords, reference_size, target_size):
     
     Returns
     -------
-    coords: Coordinates
-        Coordinates in the scaled image
+    coords: Coordinates or ndarray of int64
+        Coordinates in the scaled image, or (N, 4) array of coordinates if
+        `reference_coords` is a (N, 4) array
         
     """
     assert len(reference_size) == 2
     assert len(target_size) == 2
-    assert len(reference_coords) == 4
 
-    reference_coords = np.asarray(reference_coords).ravel()
-    reference_size = np.tile(reference_size, 2)
-    target_size = np.tile(target_size, 2)
-    return CoordinatePair(
-        *np.floor((reference_coords * target_size) / reference_size).astype("int64")
+    reference_coords = np.asarray(reference_coords)
+    is_batch = reference_coords.ndim == 2
+    if is_batch:
+        assert reference_coords.shape[1] == 4
+    else:
+        assert len(reference_coords) == 4
+
+    w_ref, h_ref = reference_size
+    w_target, h_target = target_size
+    scaled_coords = np.floor(
+        (reference_coords * np.array([w_target, h_target, w_target, h_target]))
+        / np.array([w_ref, h_ref, w_ref, h_ref])
+    ).astype("int64")
+
+    return scaled_coords if is_batch else CoordinatePair(*scaled_coords)
+
+
+def grid_coordinates(box_coords, tile_size, stride):
+    """
+    Compute the coordinates of all the tiles of a regular grid within a box.
+
+    Only tiles entirely contained in the box are returned, sorted row by row.
+
+    Parameters
+    ----------
+    box_coords: tuple, array-like or Coordinates
+        (x_ul, y_ul, x_br, y_br) coordinates of the box to cover with the grid
+    tile_size: array_like of int
+        (width, height) of the tiles
+    stride: array_like of int
+        (horizontal, vertical) distance between the upper left corners of adjacent tiles
+
+    Returns
+    -------
+    coords: ndarray of int64
+        (N, 4) array, where each row holds the (x_ul, y_ul, x_br, y_br) coordinates of a tile
+
+    """
+    x_ul, y_ul, x_br, y_br = box_coords
+    tile_w, tile_h = tile_size
+    stride_w, stride_h = stride
+    assert stride_w > 0 and stride_h > 0, "stride must be positive"
+
+    xs = np.arange(x_ul, x_br - tile_w + 1, stride_w, dtype="int64")
+    ys = np.arange(y_ul, y_br - tile_h + 1, stride_h, dtype="int64")
+    xx, yy = np.meshgrid(xs, ys)
+    xx = xx.ravel()
+    yy = yy.ravel()
+
+    return np.stack([xx, yy, xx + tile_w, yy + tile_h], axis=1)
+
+
+def mask_fraction(mask, boxes, reference_size):
+    """
+    Compute the fraction of each box covered by a (low resolution) binary mask.
+
+    The boxes are scaled from `reference_size` to the mask size and the fractions are
+    computed all at once with a summed-area table. Boxes smaller than one mask pixel
+    are enlarged to the mask pixel they fall in.
+
+    Parameters
+    ----------
+    mask: ndarray of bool
+        (height, width) binary mask
+    boxes: array_like of int
+        (N, 4) array of (x_ul, y_ul, x_br, y_br) coordinates
+    reference_size: array_like of int
+        Reference (width, height) size to which `boxes` refer to
+
+    Returns
+    -------
+    fractions: ndarray of float
+        (N,) array with the fraction of each box covered by the mask
+
+    """
+    assert len(reference_size) == 2
+
+    mask = np.asarray(mask, dtype=bool)
+    boxes = np.asarray(boxes, dtype="float64").reshape(-1, 4)
+    h_mask, w_mask = mask.shape
+    w_ref, h_ref = reference_size
+
+    integral = np.zeros((h_mask + 1, w_mask + 1), dtype="int64")
+    integral[1:, 1:] = mask.cumsum(axis=0).cumsum(axis=1)
+
+    x_ul = np.clip(np.floor(boxes[:, 0] * w_mask / w_ref), 0, w_mask - 1).astype(int)
+    y_ul = np.clip(np.floor(boxes[:, 1] * h_mask / h_ref), 0, h_mask - 1).astype(int)
+    x_br = np.clip(np.ceil(boxes[:, 2] * w_mask / w_ref), x_ul + 1, w_mask).astype(int)
+    y_br = np.clip(np.ceil(boxes[:, 3] * h_mask / h_ref), y_ul + 1, h_mask).astype(int)
+
+    covered = (
+        integral[y_br, x_br]
+        - integral[y_ul, x_br]
+        - integral[y_br, x_ul]
+        + integral[y_ul, x_ul]
+    )
+    area = (x_br - x_ul) * (y_br - y_ul)
+
+    return covered / area
+
+
+def images_to_array(images):
+    """
+    Stack a batch of images into a single array.
+
+    Parameters
+    ----------
+    images: ndarray, or iterable of PIL.Image, ndarray or Tile
+        Either a (N, H, W, C) or (H, W, C) array, or a sequence of images of the same shape.
+        Objects with an `image` attribute (e.g. Tile) are replaced by their image.
+
+    Returns
+    -------
+    images_array: ndarray
+        (N, H, W, C) array of the images
+
+    Raises
+    ------
+    ValueError
+        If the images do not have all the same shape.
+
+    """
+    if isinstance(images, np.ndarray):
+        return images if images.ndim == 4 else images[np.newaxis]
+
+    arrays = [np.asarray(getattr(image, "image", image)) for image in images]
+    if len({array.shape for array in arrays}) > 1:
+        raise ValueError("All the images of the batch must have the same shape")
+
+    return np.stack(arrays)
+
+
+def rgba_to_rgb(images, background=255):
+    """
+    Composite RGBA image(s) over a uniform background.
+
+    OpenSlide returns non premultiplied RGBA regions, with transparent pixels outside
+    the slide; fully opaque images are returned as a view of their RGB channels.
+
+    Parameters
+    ----------
+    images: array_like of uint8
+        (..., 4) RGBA or (..., 3) RGB image(s)
+    background: int
+        Gray level of the background. Default is 255 (white).
+
+    Returns
+    -------
+    rgb: ndarray of uint8
+        (..., 3) RGB image(s)
+
+    """
+    images = np.asarray(images)
+    if images.shape[-1] == 3:
+        return images
+
+    rgb = images[..., :3]
+    alpha = images[..., 3:]
+    if np.all(alpha == 255):
+        return rgb
+
+    alpha = alpha.astype("uint32")
+    composited = (rgb * alpha + background * (255 - alpha) + 127) // 255
+    return composited.astype("uint8")
+
+
+@contextmanager
+def atomic_open(filename, mode="wb", **kwargs):
+    """
+    Open a temporary file that atomically replaces `filename` when closed without errors.
+
+    The temporary file is next to `filename`, with a name unique to the process and the
+    call, so that processes writing the same file (e.g. the sidecar cache of a slide)
+    never write to the same temporary file. It is removed if writing fails.
+
+    Parameters
+    ----------
+    filename: str or pathlib.Path
+        Path of the file to write
+    mode: str
+        Writing mode, as of `open`. Default is "wb".
+    **kwargs
+        Other arguments of `open`, e.g. `newline`
+
+    Yields
+    ------
+    file object
+        The temporary file, open for writing
+
+    """
+    filename = Path(filename)
+    tmp_filename = filename.with_name(
+        f"{filename.name}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
     )
+    try:
+        with open(tmp_filename, mode.replace("w", "x"), **kwargs) as tmp_file:
+            yield tmp_file
+        os.replace(tmp_filename, filename)
+    finally:
+        if tmp_filename.exists():
+            tmp_filename.unlink()
@@ -1,29 +1,87 @@
+import hashlib
 import os
-from collections import namedtuple
+from collections import OrderedDict, namedtuple
 from pathlib import Path
+from threading import Lock
 
 import numpy as np
 import openslide
 import skimage.morphology as morph
+from PIL import Image
 from scipy import ndimage
 from skimage import color
 from skimage.filters import threshold_otsu
 from skimage.measure import label, regionprops
 
 from .tile import Tile
-from .utils import CoordinatePair, scale_coordinates
+from .utils import CoordinatePair, atomic_open, scale_coordinates
 
 Region = namedtuple("Region", ("index", "area", "bbox", "center"))
 
+TISSUE_THUMBNAIL_SIZE = 1000
+# version of the tissue mask algorithm, to be increased when it changes, so that the
+# masks cached by the previous versions are not used
+TISSUE_MASK_VERSION = 1
+SUPER_REGION_SIZE = 2048
+
 
 class WSI:
-    def __init__(self, filename):
+    """
+    Whole Slide Image, wrapping an OpenSlide image.
+
+    Attributes
+    ----------
+    filename : pathlib.Path
+        Path to the slide file.
+    image : openslide.OpenSlide
+        The OpenSlide image.
+    cache_dir : pathlib.Path or None
+        Folder where per-slide results (e.g. the tissue mask and box) are cached
+        on disk. If None, results are only cached in memory.
+    region_cache_bytes : int
+        Maximum size in bytes of the super-region read cache. If 0 (default), the cache
+        is disabled and every tile is read from the slide.
+    super_region_size : int
+        Side, in pixels of the read level, of the aligned square super-regions read
+        and cached by `extract_tile` when the read cache is enabled.
+    region_cache_hits : int
+        Number of super-region lookups served by the read cache
+    region_cache_misses : int
+        Number of super-region lookups read from the slide
+
+    """
+
+    def __init__(
+        self,
+        filename,
+        cache_dir=None,
+        region_cache_bytes=0,
+        super_region_size=SUPER_REGION_SIZE,
+    ):
         assert os.path.exists(filename) and os.path.isfile(
             filename
         ), f"Make sure {filename} exists and it is a file."
+        assert region_cache_bytes >= 0, "region_cache_bytes must be non-negative"
+        assert (
+            not region_cache_bytes or super_region_size ** 2 * 4 <= region_cache_bytes
+        ), f"region_cache_bytes must hold at least one {super_region_size}x{super_region_size} RGBA super-region"
 
         self.filename = Path(filename)
-        self.image = openslide.open_slide(filename)
+        self.image = openslide.open_slide(str(filename))
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self.region_cache_bytes = region_cache_bytes
+        self.super_region_size = super_region_size
+        self.region_cache_hits = 0
+        self.region_cache_misses = 0
+
+        self._tissue_mask = None
+        self._tissue_box_coords_wsi = None
+        # stain colors memoized by stains.slide_stain_colors, by parameters
+        self._stain_colors = {}
+        self._stain_colors_lock = Lock()
+        self._super_regions = OrderedDict()
+        self._super_regions_nbytes = 0
+        self._super_regions_lock = Lock()
 
     @property
     def levels(self):
@@ -73,21 +131,114 @@ class WSI:
 
         return self.image.get_thumbnail(size)
 
+    @property
+    def tissue_mask(self):
+        """
+        Binary mask of the tissue, computed on a thumbnail of the slide.
+
+        The mask is computed only once and memoized. If `cache_dir` is set, it is also
+        saved to (and loaded from) a sidecar file keyed by slide path, size and mtime,
+        thumbnail size (`TISSUE_THUMBNAIL_SIZE`) and version of the algorithm
+        (`TISSUE_MASK_VERSION`).
+
+        Returns
+        -------
+        tissue_mask: ndarray of bool
+            (height, width) mask of the thumbnail, True where there is tissue
+
+        """
+        if self._tissue_mask is None:
+            self._load_or_compute_tissue()
+        return self._tissue_mask
+
     @property
     def tissue_box_coords_wsi(self):
         """
         Returns the coordinates of the box containing the tissue.
+
+        The box is the bounding box of the biggest region of `tissue_mask`, computed only
+        once and memoized (see `tissue_mask`).
         
         Returns
         -------
         box_coords: Coordinates
             [x_ul, y_ul, x_br, y_br] coordinates of the box containing the tissue
 
+        """
+        if self._tissue_box_coords_wsi is None:
+            self._load_or_compute_tissue()
+        return self._tissue_box_coords_wsi
+
+    def cache_filename(self, suffix):
+        """
+        Return the sidecar cache filename for this slide, or None if `cache_dir` is not set.
+
+        The filename is keyed by slide path, size and modification time, so that a
+        modified or replaced slide never hits stale cached results.
+
+        Parameters
+        ----------
+        suffix : str
+            Suffix identifying the cached content, e.g. "_tissue.npz"
+
+        Returns
+        -------
+        pathlib.Path or None
+            Path of the cache file
+
+        """
+        if self.cache_dir is None:
+            return None
+
+        stat = os.stat(self.filename)
+        key = f"{self.filename.resolve()}:{stat.st_size}:{stat.st_mtime_ns}"
+        key_hash = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+        return self.cache_dir / f"{self.filename.stem}_{key_hash}{suffix}"
+
+    def _load_or_compute_tissue(self):
+        cache_filename = self.cache_filename(
+            f"_tissue_{TISSUE_THUMBNAIL_SIZE}_v{TISSUE_MASK_VERSION}.npz"
+        )
+
+        if cache_filename is not None and cache_filename.exists():
+            try:
+                with np.load(cache_filename) as cached:
+                    self._tissue_mask = cached["mask"].astype(bool)
+                    self._tissue_box_coords_wsi = CoordinatePair(
+                        *cached["box"].astype("int64")
+                    )
+                return
+            except (OSError, KeyError, ValueError):
+                pass  # unreadable cache: compute it again
+
+        self._tissue_mask, self._tissue_box_coords_wsi = self._compute_tissue()
+
+        if cache_filename is not None:
+            cache_filename.parent.mkdir(parents=True, exist_ok=True)
+            # other processes may cache the same slide
+            with atomic_open(cache_filename) as cache_file:
+                np.savez_compressed(
+                    cache_file,
+                    mask=self._tissue_mask,
+                    box=np.asarray(self._tissue_box_coords_wsi),
+                )
+
+    def _compute_tissue(self):
+        """
+        Compute the tissue mask on the thumbnail and the level-0 box of its biggest region.
+
+        Returns
+        -------
+        tissue_mask: ndarray of bool
+            Tissue mask of the thumbnail
+        box_coords: Coordinates
+            [x_ul, y_ul, x_br, y_br] coordinates of the box containing the tissue
+
         """
 
         w_out, h_out = self.get_dimensions(level=0)  # ! openslide image dimensions: WxH
 
-        thumb = np.array(self.get_thumbnail(1000))
+        thumb = np.array(self.get_thumbnail(TISSUE_THUMBNAIL_SIZE))
         h_in, w_in, ch = thumb.shape
 
         thumb = color.rgb2gray(thumb)
@@ -115,11 +266,20 @@ class WSI:
             target_size=(w_out, h_out),
         )
 
-        return out_coords
+        return thumb_filter_dilated_filled.astype(bool), out_coords
 
-    def extract_tile(self, coords, level):
+    def extract_tile(self, coords, level, size=None, as_array=False):
         """
         Extract a tile of the image, scaled to the selected level
+
+        If the read cache is enabled (`region_cache_bytes` > 0), the tile is sliced out of
+        cached aligned super-regions of `super_region_size` pixels; its image is an RGBA
+        PIL image either way, unless `as_array` is True. At levels with an integer
+        downsample, cached tiles are identical to the ones read directly, and tiles not
+        aligned to the level pixels are read directly. At levels with a non-integer
+        downsample (e.g. 4.0002), where OpenSlide reads at sub-pixel offsets, tiles and
+        super-regions are read at their level-0 coordinates rounded to the level pixel
+        grid, so cached tiles may be shifted by less than a pixel.
         
         Parameters
         ----------
@@ -127,11 +287,19 @@ class WSI:
             Coordinates in the first level (0)
         level : int 
             Level from which to extract the tile
+        size : array_like of int, optional
+            (width, height) of the tile at level `level`. If None (default), it is
+            computed scaling `coords` to the level.
+        as_array : bool
+            Whether the image of the tile is an (height, width, 4) ndarray instead of a
+            PIL image. Tiles sliced out of a single cached super-region are then
+            read-only views of it, without any copy. Default is False.
         
         Returns
         -------
         tile : Tile
-            Image containing the selected tile
+            Image containing the selected tile, whose image is an RGBA PIL image, or an
+            RGBA ndarray if `as_array` is True
 
         """
         # TODO: check for Coordinates
@@ -140,17 +308,139 @@ class WSI:
             self.image.level_dimensions
         ), f"this image has only {len(self.image.level_dimensions)} levels"
 
-        coords_level = scale_coordinates(
-            reference_coords=coords,
-            reference_size=self.get_dimensions(level=0),
-            target_size=self.get_dimensions(level=level),
-        )
+        if size is not None:
+            w_l, h_l = size
+        elif level == 0:
+            w_l = coords[2] - coords[0]
+            h_l = coords[3] - coords[1]
+        else:
+            coords_level = scale_coordinates(
+                reference_coords=coords,
+                reference_size=self.get_dimensions(level=0),
+                target_size=self.get_dimensions(level=level),
+            )
 
-        h_l = coords_level.y_br - coords_level.y_ul
-        w_l = coords_level.x_br - coords_level.x_ul
+            h_l = coords_level.y_br - coords_level.y_ul
+            w_l = coords_level.x_br - coords_level.x_ul
+
+        if self.region_cache_bytes:
+            patch = self._read_cached_region(coords, level, (int(w_l), int(h_l)))
+            if patch is not None:
+                if as_array:
+                    return Tile(patch, level, coords)
+                # the same PIL image type as read_region, so that the cache is transparent
+                return Tile(Image.fromarray(patch), level, coords)
 
         patch = self.image.read_region(
-            location=(coords[0], coords[1]), level=level, size=(w_l, h_l)
+            location=(int(coords[0]), int(coords[1])),
+            level=level,
+            size=(int(w_l), int(h_l)),
         )
+        if as_array:
+            patch = np.asarray(patch)
         tile = Tile(patch, level, coords)
         return tile
+
+    def clear_region_cache(self):
+        """Empty the super-region read cache and reset its hit and miss counters."""
+        with self._super_regions_lock:
+            self._super_regions.clear()
+            self._super_regions_nbytes = 0
+            self.region_cache_hits = 0
+            self.region_cache_misses = 0
+
+    def _read_cached_region(self, coords, level, size):
+        """
+        Read a region of the level from the cached super-regions.
+
+        Parameters
+        ----------
+        coords : Coordinates
+            Coordinates in the first level (0), only the upper left corner is used
+        level : int
+            Level from which to read the region
+        size : tuple of int
+            (width, height) of the region at level `level`
+
+        Returns
+        -------
+        ndarray of uint8 or None
+            (height, width, 4) RGBA region, or None if it is outside of the slide or, at
+            a level with an integer downsample, not aligned to the level pixels
+
+        """
+        downsample = float(self.image.level_downsamples[level])
+        x_ul, y_ul = int(coords[0]), int(coords[1])
+        if x_ul < 0 or y_ul < 0:
+            return None
+
+        if downsample.is_integer():
+            downsample = int(downsample)
+            if x_ul % downsample or y_ul % downsample:
+                return None
+            x_lvl, y_lvl = x_ul // downsample, y_ul // downsample
+        else:
+            # OpenSlide would read at a sub-pixel offset: snap to the level pixel grid
+            x_lvl, y_lvl = int(round(x_ul / downsample)), int(round(y_ul / downsample))
+
+        w, h = size
+        side = self.super_region_size
+        col_ul, row_ul = x_lvl // side, y_lvl // side
+        col_br, row_br = (x_lvl + w - 1) // side, (y_lvl + h - 1) // side
+
+        if col_ul == col_br and row_ul == row_br:
+            super_region = self._super_region(level, col_ul, row_ul)
+            x, y = x_lvl - col_ul * side, y_lvl - row_ul * side
+            return super_region[y : y + h, x : x + w]
+
+        region = np.empty((h, w, 4), dtype=np.uint8)
+        for row in range(row_ul, row_br + 1):
+            for col in range(col_ul, col_br + 1):
+                super_region = self._super_region(level, col, row)
+                x_start = max(x_lvl, col * side)
+                x_stop = min(x_lvl + w, (col + 1) * side)
+                y_start = max(y_lvl, row * side)
+                y_stop = min(y_lvl + h, (row + 1) * side)
+                region[
+                    y_start - y_lvl : y_stop - y_lvl, x_start - x_lvl : x_stop - x_lvl
+                ] = super_region[
+                    y_start - row * side : y_stop - row * side,
+                    x_start - col * side : x_stop - col * side,
+                ]
+        region.flags.writeable = False
+        return region
+
+    def _super_region(self, level, col, row):
+        """Return the super-region (`col`, `row`) of the level, reading it if not cached."""
+        key = (level, col, row)
+        with self._super_regions_lock:
+            super_region = self._super_regions.get(key)
+            if super_region is not None:
+                self._super_regions.move_to_end(key)
+                self.region_cache_hits += 1
+                return super_region
+            self.region_cache_misses += 1
+
+        side = self.super_region_size
+        downsample = self.image.level_downsamples[level]
+        super_region = np.array(
+            self.image.read_region(
+                location=(
+                    int(round(col * side * downsample)),
+                    int(round(row * side * downsample)),
+                ),
+                level=level,
+                size=(side, side),
+            )
+        )
+        super_region.flags.writeable = False
+
+        with self._super_regions_lock:
+            if key not in self._super_regions:
+                self._super_regions[key] = super_region
+                self._super_regions_nbytes += super_region.nbytes
+                # least recently used first
+                while self._super_regions_nbytes > self.region_cache_bytes:
+                    _, evicted = self._super_regions.popitem(last=False)
+                    self._super_regions_nbytes -= evicted.nbytes
+        return super_region
@@ -1,5 +1,12 @@
 import argparse
+import csv
+import io
+import multiprocessing
 import os
+import re
+from collections import namedtuple
+from functools import partial
+from itertools import compress
 from pathlib import Path
 
 import gin
@@ -7,6 +14,21 @@ import numpy as np
 import pandas as pd
 from PIL import Image, UnidentifiedImageError
 
+from histo_lib import ShardReader, atomic_open
+
+from .tables import TABLE_FORMATS, write_table
+
+ManifestEntry = namedtuple(
+    "ManifestEntry",
+    ("path", "size", "mtime_ns", "header_only", "config", "valid", "reason"),
+)
+
+# modes of at most 8 bits per channel, that tiles are converted to RGB from
+TILE_MODES = ("1", "L", "LA", "P", "PA", "RGB", "RGBA", "RGBX", "CMYK", "YCbCr")
+CHECK_CHUNK_SIZE = 256
+
+_shard_reader = None
+
 
 def check_image_readable(tile_filename):
     """
@@ -36,6 +58,126 @@ def check_image_readable(tile_filename):
     return Image.open(tile_filename).convert("RGB")
 
 
+def _parse_tile_size(tile_size):
+    try:
+        getattr(tile_size, "__len__")
+        assert len(tile_size) == 2, "size should be integer or [size_w, size_h]"
+        tile_w, tile_h = tile_size
+    except AttributeError:
+        tile_w = tile_h = int(tile_size)
+    except AssertionError as ae:
+        raise ValueError from ae
+    return tile_w, tile_h
+
+
+@gin.configurable
+def check_tile_size(image, tile_size):
+    """
+    Check that the tile provided has `tile_size` size, reading only the image header.
+
+    Parameters
+    ----------
+    image: PIL.Image
+        The image to be tested, opened but not necessarily decoded
+    tile_size : int or tuple/list of int of shape (2,)
+        (width, height) requested for the tile or a single int value if width == height
+
+    Raises
+    ------
+    ValueError
+        If `tile_size` is a sequence but doesn't have two elements (one or more than two)
+    ValueError
+        If the tile size is different from `tile_size`
+
+    """
+    tile_w, tile_h = _parse_tile_size(tile_size)
+
+    if image.size != (tile_w, tile_h):
+        raise ValueError(
+            f"Tile size is incorrect: {image.size} instead of ({tile_w}, {tile_h})"
+        )
+
+
+def check_tile_mode(image):
+    """
+    Check that the tile provided has a mode convertible to RGB (e.g. RGB, RGBA, L or P)
+    with at most 8 bits per channel, reading only the image header.
+
+    The same rule applies whether the tile is then decoded or not (see `check_tile`).
+    The bit depth is read from the raw mode of the decoder (e.g. "RGB;16B" for 16-bit
+    PNG, "P;4" for 16 colors palette PNG); formats whose raw mode does not carry it
+    (e.g. JPEG) are 8 bits per channel.
+
+    Parameters
+    ----------
+    image: PIL.Image
+        The image to be tested, opened but not necessarily decoded
+
+    Raises
+    ------
+    ValueError
+        If the tile mode is not one of `TILE_MODES`
+    TypeError
+        If the tile is stored with more than 8 bits per channel
+
+    """
+    if image.mode not in TILE_MODES:
+        raise ValueError(
+            f"Tile mode is incorrect: {image.mode} instead of {' or '.join(TILE_MODES)}"
+        )
+
+    # the raw mode of the decoder is e.g. "RGB;16B" for 16 bits per channel
+    raw_modes = {_raw_mode(tile[3]) for tile in image.tile}
+    wrong_raw_modes = [
+        raw_mode for raw_mode in raw_modes if (_raw_mode_bits(raw_mode) or 8) > 8
+    ]
+    if wrong_raw_modes:
+        raise TypeError(
+            f"Bit depth is incorrect: raw mode {', '.join(sorted(wrong_raw_modes))} "
+            "instead of at most 8 bits per channel"
+        )
+
+
+def _raw_mode(decoder_args):
+    """Return the raw mode from the decoder arguments of a tile of a PIL image."""
+    # e.g. "RGB" for PNG, ("RGB", "") for JPEG and ("RGB", 0, 1) for TIFF
+    if isinstance(decoder_args, tuple):
+        decoder_args = decoder_args[0] if decoder_args else None
+    return decoder_args if isinstance(decoder_args, str) else ""
+
+
+def _raw_mode_bits(raw_mode):
+    """Return the bits per channel of a raw mode, or None if it does not carry them."""
+    match = re.search(r";(\d+)", raw_mode)
+    return int(match.group(1)) if match else None
+
+
+def check_tile_header(tile_filename):
+    """
+    Check size, mode and bit depth of the tile from its header, without decoding it.
+
+    Parameters
+    ----------
+    tile_filename : str, pathlib.Path or file object
+        Path to the tile to be tested
+
+    Raises
+    ------
+    FileNotFoundError
+        If the file cannot be found
+    UnidentifiedImageError
+        If the image cannot be opened and identified.
+    ValueError
+        If the tile size or mode is incorrect
+    TypeError
+        If the tile is stored with more than 8 bits per channel
+
+    """
+    with Image.open(tile_filename) as image:
+        check_tile_size(image)
+        check_tile_mode(image)
+
+
 @gin.configurable
 def check_tile_shape(image, tile_size):
     """
@@ -43,7 +185,7 @@ def check_tile_shape(image, tile_size):
 
     Parameters
     ----------
-    image: PIL.Image
+    image: PIL.Image or ndarray
         The image to be tested
     tile_size : int or tuple/list of int of shape (2,)
         (width, height) requested for the tile or a single int value if width == height 
@@ -56,19 +198,12 @@ def check_tile_shape(image, tile_size):
         If the tile shape is different from `tile_size`
 
     """
-    try:
-        getattr(tile_size, "__len__")
-        assert len(tile_size) == 2, "size should be integer or [size_w, size_h]"
-        tile_w, tile_h = tile_size
-    except AttributeError:
-        tile_w = tile_h = int(tile_size)
-    except AssertionError as ae:
-        raise ValueError from ae
+    tile_w, tile_h = _parse_tile_size(tile_size)
 
-    im_array = np.array(image)
-    if im_array.shape != (tile_w, tile_h, 3):
+    im_array = np.asarray(image)
+    if im_array.shape != (tile_h, tile_w, 3):
         raise ValueError(
-            f"Tile shape is incorrect: {im_array.shape} instead of ({tile_w}, {tile_h}, 3)"
+            f"Tile shape is incorrect: {im_array.shape} instead of ({tile_h}, {tile_w}, 3)"
         )
 
 
@@ -78,7 +213,7 @@ def check_tile_uint8(image):
 
     Parameters
     ----------
-    image: PIL.Image
+    image: PIL.Image or ndarray
             The image to be tested
 
     Raises
@@ -88,7 +223,7 @@ def check_tile_uint8(image):
 
     """
 
-    im_array = np.array(image)
+    im_array = np.asarray(image)
     if im_array.dtype != "uint8":
         raise TypeError(f'Data type is incorrect: {im_array.dtype} instead of "uint8"')
 
@@ -99,7 +234,7 @@ def check_tile_values_range(image):
 
     Parameters
     ----------
-    image: PIL.Image
+    image: PIL.Image or ndarray
         The image to be tested
 
     Raises
@@ -109,23 +244,32 @@ def check_tile_values_range(image):
 
     """
 
-    im_array = np.array(image)
+    im_array = np.asarray(image)
     if not ((im_array >= 0).all() and (im_array <= 255).all()):
         raise ValueError("Pixel values should be between 0 and 255")
 
 
-def check_tile(tile_filename):
+def check_tile(tile_filename, header_only=False):
     """
     Performs checks on the tile:
     * if the tile is readable
+    * if the tile has a mode convertible to RGB, with at most 8 bits per channel
+      (see `check_tile_mode`)
     * if the tile has the correct shape
     * if the tile has the correct dtype
     * if the pixel values of the tile are in the correct range
 
+    If `header_only` is True, only size, mode and bit depth are checked from the image
+    header (see `check_tile_header`), without decoding the tile. Both ways accept the
+    same modes and bit depths.
+
     Parameters
     ----------
-    tile_filename : [type]
-        [description]
+    tile_filename : str, pathlib.Path or file object
+        Path to the tile to be tested
+    header_only : bool
+        Whether to check the image header only. Default is False, i.e. the tile is
+        fully decoded, which also detects truncated or corrupted pixel data.
 
     Returns
     -------
@@ -133,24 +277,324 @@ def check_tile(tile_filename):
         True if the tile is compliant with all the checks, False otherwise
         
     """
+    reason = _tile_failure_reason(tile_filename, header_only)
+    if reason is not None:
+        print(reason)
+        return False
+
+    else:
+        return True
+
+
+def _configured_tile_size(check):
+    """Return the (width, height) with which gin calls `check`, or None if not bound."""
     try:
-        image = check_image_readable(tile_filename)
+        tile_size = gin.query_parameter(f"{check.__name__}.tile_size")
+    except ValueError:
+        return None
+    if isinstance(tile_size, gin.config.ConfigurableReference):
+        tile_size = tile_size.scoped_configurable_fn()  # e.g. a macro, as %tile_size
+    return _parse_tile_size(tile_size)
 
-        check_tile_shape(image)
-        check_tile_uint8(image)
-        check_tile_values_range(image)
 
-    except (FileNotFoundError, UnidentifiedImageError, ValueError, TypeError) as e:
-        print(e)
-        return False
+def _check_config(header_only=False):
+    """Return the parameters of the checks performed by `check_tile`, as a string."""
+    tile_size = _configured_tile_size(
+        check_tile_size if header_only else check_tile_shape
+    )
+    return "" if tile_size is None else "tile_size={}x{}".format(*tile_size)
+
+
+def _tile_failure_reason(tile_filename, header_only=False):
+    """Return why the tile fails `check_tile`, or None if it passes all the checks."""
+    try:
+        if header_only:
+            check_tile_header(tile_filename)
+        else:
+            with Image.open(tile_filename) as image:
+                # the same modes and bit depths as the header only checks
+                check_tile_mode(image)
+                # decoded once, the checks share the same array
+                image = np.asarray(image.convert("RGB"))
+
+            check_tile_shape(image)
+            check_tile_uint8(image)
+            check_tile_values_range(image)
+
+    # OSError: e.g. truncated image data
+    except (
+        FileNotFoundError,
+        UnidentifiedImageError,
+        OSError,
+        ValueError,
+        TypeError,
+    ) as e:
+        return str(e) or type(e).__name__
 
     else:
-        return True
+        return None
+
+
+def _tiles_failure_reasons(tile_filenames, header_only, n_workers, chunksize):
+    failure_reason = partial(_tile_failure_reason, header_only=header_only)
+
+    if n_workers == 1:
+        return list(map(failure_reason, tile_filenames))
+
+    with multiprocessing.Pool(n_workers) as pool:
+        return pool.map(failure_reason, tile_filenames, chunksize=chunksize)
+
+
+def read_manifest(manifest_filename):
+    """
+    Read a validation manifest written by `write_manifest`.
+
+    Parameters
+    ----------
+    manifest_filename : str or pathlib.Path
+        Path to the manifest
+
+    Returns
+    -------
+    dict
+        ManifestEntry for each tile path. Empty if the manifest does not exist.
+
+    """
+    if not os.path.exists(manifest_filename):
+        return {}
+
+    with open(manifest_filename, newline="") as manifest_file:
+        return {
+            row["path"]: ManifestEntry(
+                path=row["path"],
+                size=int(row["size"]),
+                mtime_ns=int(row["mtime_ns"]),
+                header_only=row["header_only"] == "True",
+                # missing in the manifests written before it was recorded
+                config=row.get("config") or "",
+                valid=row["valid"] == "True",
+                reason=row["reason"],
+            )
+            for row in csv.DictReader(manifest_file, delimiter="\t")
+        }
+
+
+def write_manifest(manifest, manifest_filename):
+    """
+    Write atomically a validation manifest as a tab separated file.
+
+    Parameters
+    ----------
+    manifest : dict
+        ManifestEntry for each tile path
+    manifest_filename : str or pathlib.Path
+        Path to the manifest
+
+    """
+    with atomic_open(manifest_filename, "w", newline="") as manifest_file:
+        writer = csv.writer(manifest_file, delimiter="\t")
+        writer.writerow(ManifestEntry._fields)
+        writer.writerows(manifest.values())
+
+
+def _incremental_failure_reasons(
+    tile_filenames, manifest_filename, header_only, n_workers, chunksize
+):
+    """
+    Return the failure reason of each tile, checking only the tiles that are missing
+    from the manifest, whose size or modification time changed, or that were checked
+    in another mode or with other parameters (e.g. another tile size), and update the
+    manifest with them.
+
+    The entries of the tiles no longer present in the folders of `tile_filenames`, e.g.
+    extracted again under other names, are removed from the manifest.
+    """
+    manifest = read_manifest(manifest_filename)
+    config = _check_config(header_only)
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_filename))
+
+    reasons = [None] * len(tile_filenames)
+    to_check = []
+    paths = set()
+    for i, tile_filename in enumerate(tile_filenames):
+        path = os.path.relpath(os.path.abspath(tile_filename), manifest_dir)
+        paths.add(path)
+        try:
+            stat = os.stat(tile_filename)
+        except OSError:
+            to_check.append((i, path, None))  # not recorded, the check reports why
+            continue
+
+        entry = manifest.get(path)
+        if (
+            entry is not None
+            and entry.size == stat.st_size
+            and entry.mtime_ns == stat.st_mtime_ns
+            and entry.header_only == header_only
+            and entry.config == config
+        ):
+            reasons[i] = None if entry.valid else entry.reason
+        else:
+            to_check.append((i, path, stat))
+
+    tiles_dirs = {os.path.dirname(path) for path in paths}
+    removed_paths = [
+        path
+        for path in manifest
+        if path not in paths and os.path.dirname(path) in tiles_dirs
+    ]
+    for path in removed_paths:
+        del manifest[path]
+
+    if not to_check:
+        if removed_paths:
+            write_manifest(manifest, manifest_filename)
+        return reasons
+
+    checked_reasons = _tiles_failure_reasons(
+        [tile_filenames[i] for i, _, _ in to_check], header_only, n_workers, chunksize
+    )
+    for (i, path, stat), reason in zip(to_check, checked_reasons):
+        reasons[i] = reason
+        if stat is not None:
+            manifest[path] = ManifestEntry(
+                path=path,
+                size=stat.st_size,
+                mtime_ns=stat.st_mtime_ns,
+                header_only=header_only,
+                config=config,
+                valid=reason is None,
+                reason=reason or "",
+            )
+
+    write_manifest(manifest, manifest_filename)
+    return reasons
+
+
+def check_tiles(
+    tile_filenames,
+    header_only=False,
+    n_workers=1,
+    chunksize=CHECK_CHUNK_SIZE,
+    manifest_filename=None,
+):
+    """
+    Performs `check_tile` on many tiles, optionally across a pool of processes.
+
+    If `manifest_filename` is provided, the results are recorded in a persistent
+    manifest (path, size, modification time, check mode and parameters, result and
+    failure reason of every tile) and a re-run only checks the tiles that are new or
+    modified since, or whose checks changed (e.g. another configured tile size).
+
+    Parameters
+    ----------
+    tile_filenames : list of str or pathlib.Path
+        Paths to the tiles to be tested
+    header_only : bool
+        Whether to check the image headers only (see `check_tile`). Default is False.
+    n_workers : int, optional
+        Number of worker processes. Default is 1, i.e. tiles are checked serially.
+        If None, the number of CPUs is used.
+    chunksize : int
+        Number of tiles sent to a worker at a time. Default is `CHECK_CHUNK_SIZE`.
+    manifest_filename : str or pathlib.Path, optional
+        Path to the validation manifest, whose tile paths are relative to its folder.
+        Default is None, i.e. all the tiles are checked.
+
+    Returns
+    -------
+    list of bool
+        For each tile, whether it is compliant with all the checks
+
+    """
+    tile_filenames = list(tile_filenames)
+
+    if manifest_filename is None:
+        reasons = _tiles_failure_reasons(
+            tile_filenames, header_only, n_workers, chunksize
+        )
+    else:
+        reasons = _incremental_failure_reasons(
+            tile_filenames, manifest_filename, header_only, n_workers, chunksize
+        )
+
+    for reason in reasons:
+        if reason is not None:
+            print(reason)
+
+    return [reason is None for reason in reasons]
+
+
+def _open_shard_reader(shards_dir):
+    global _shard_reader
+    _shard_reader = ShardReader(shards_dir)
+
+
+def _check_shard_tile(name, header_only=False):
+    return check_tile(io.BytesIO(_shard_reader.read_bytes(name)), header_only)
+
+
+def check_shard_tiles(
+    shards_dir,
+    slide_id=None,
+    header_only=False,
+    n_workers=1,
+    chunksize=CHECK_CHUNK_SIZE,
+):
+    """
+    Performs `check_tile` on the tiles stored in the shards of `shards_dir`.
+
+    Parameters
+    ----------
+    shards_dir : str or pathlib.Path
+        Folder containing the shards (see `histo_lib.ShardWriter`)
+    slide_id : str, optional
+        Slide whose tiles are checked, i.e. the filename stem of its WSI, as recorded
+        in the shards index. Default is None, i.e. the tiles of every slide are checked.
+    header_only : bool
+        Whether to check the image headers only (see `check_tile`). Default is False.
+    n_workers : int, optional
+        Number of worker processes, each one with its own shard reader. Default is 1,
+        i.e. tiles are checked serially. If None, the number of CPUs is used.
+    chunksize : int
+        Number of tiles sent to a worker at a time. Default is `CHECK_CHUNK_SIZE`.
+
+    Returns
+    -------
+    list of str
+        Names of the tiles compliant with all the checks
+
+    """
+    with ShardReader(shards_dir) as reader:
+        names = [
+            record.name
+            for record in reader.records()
+            if slide_id is None or record.slide_id == slide_id
+        ]
+
+        if n_workers == 1:
+            results = [
+                check_tile(io.BytesIO(reader.read_bytes(name)), header_only)
+                for name in names
+            ]
+        else:
+            with multiprocessing.Pool(
+                n_workers, initializer=_open_shard_reader, initargs=(shards_dir,)
+            ) as pool:
+                results = pool.map(
+                    partial(_check_shard_tile, header_only=header_only),
+                    names,
+                    chunksize=chunksize,
+                )
+
+    return list(compress(names, results))
 
 
 def save_csv(data, filename):
     """
-    Save provided `data` as a csv at `filename`
+    Save provided `data` as a csv at `filename`, or as a Parquet or Feather table if
+    `filename` has one of their extensions (see `write_table`). Any other extension
+    (e.g. .tsv, .txt or none) is written as a csv.
 
     Parameters
     ----------
@@ -160,5 +604,8 @@ def save_csv(data, filename):
         Where to save the csv
 
     """
-    csv_out = pd.DataFrame(data)
-    csv_out.to_csv(filename, index=False)
+    ext = os.path.splitext(filename)[1].lower()
+    if TABLE_FORMATS.get(ext, "csv") != "csv":
+        write_table(data, filename)
+    else:
+        pd.DataFrame(data).to_csv(filename, index=False)
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 
 
@@ -24,9 +25,13 @@ def reverse_dict(dictionary):
     return {i: value for value, i in dictionary.items()}
 
 
-def encode_label(dataframe, column, column_encoded, encoding_dictionary=None):
+def encode_label(
+    dataframe, column, column_encoded, encoding_dictionary=None, categorical=True
+):
     """Encode ``column`` label in ``dataframe`` with ``encoding_dictionary`` provided.
 
+    See ``encode_labels`` to encode several columns at once.
+
     Parameters
     ----------
     dataframe : pandas.DataFrame
@@ -39,11 +44,14 @@ def encode_label(dataframe, column, column_encoded, encoding_dictionary=None):
         Dictionary used to encode values, where the keys are the original values and the
         values are the encoded values. If None (which is the default) each categorical
         value will be mapped to an integer (0 to n_values - 1).
+    categorical : bool, optional
+        Whether ``column`` is converted to categorical in the result. Default is True.
 
     Returns
     -------
     pandas.DataFrame
-        A copy of ``dataframe`` with the new column ``column_encoded``.
+        A shallow copy of ``dataframe`` with the new column ``column_encoded``, where
+        ``column`` is categorical if ``categorical`` is True.
 
     dict
         Encoding dict reversed
@@ -55,28 +63,104 @@ def encode_label(dataframe, column, column_encoded, encoding_dictionary=None):
     ValueError
         If the ``encoding_dict`` is missing some values to encode (keys).
     """
+    dataframe_encoded, reversed_encoding_dicts = encode_labels(
+        dataframe, [column], [column_encoded], [encoding_dictionary], categorical
+    )
+
+    return dataframe_encoded, reversed_encoding_dicts[column]
 
-    if column not in dataframe.columns:
-        raise ValueError(f"Column {column} does not exist in dataframe")
 
-    if encoding_dictionary:
-        values_to_encode = set(dataframe[column].unique())
+def encode_labels(
+    dataframe,
+    columns,
+    columns_encoded=None,
+    encoding_dictionaries=None,
+    categorical=True,
+):
+    """Encode the ``columns`` labels in ``dataframe`` with the ``encoding_dictionaries``.
 
-        if values_to_encode > set(encoding_dictionary.keys()):
-            missing_values = values_to_encode - set(encoding_dictionary.keys())
+    Values are encoded through the categories of the label columns, so that each
+    distinct value is looked up once. The result is a shallow copy of ``dataframe``:
+    only the encoded (and categorical) columns are allocated, the others are shared and
+    unchanged. Label columns are stored as categorical unless ``categorical`` is False,
+    which shrinks string label columns to a few bytes per row.
+
+    Parameters
+    ----------
+    dataframe : pandas.DataFrame
+        The DataFrame to read and to write to.
+    columns : list of str
+        Names of the columns to encode
+    columns_encoded : list of str, optional
+        Names of the encoded columns, which will be added to ``dataframe``. If None
+        (which is the default) they are named ``{column}_encoded``.
+    encoding_dictionaries : list of dict, optional
+        Dictionaries used to encode values of each column (see ``encode_label``). If
+        None (which is the default), or for None items, each categorical value will be
+        mapped to an integer (0 to n_values - 1).
+    categorical : bool, optional
+        Whether ``columns`` are converted to categorical in the result, instead of
+        keeping their dtype. Default is True.
+
+    Returns
+    -------
+    pandas.DataFrame
+        A shallow copy of ``dataframe`` with the new columns ``columns_encoded``, where
+        ``columns`` are categorical if ``categorical`` is True.
+
+    dict
+        Encoding dict reversed for each column
+
+    Raises
+    ------
+    ValueError
+        If a column of ``columns`` does not exist in ``dataframe``.
+    ValueError
+        If an encoding dictionary is missing some values to encode (keys).
+    """
+    if columns_encoded is None:
+        columns_encoded = [f"{column}_encoded" for column in columns]
+    if encoding_dictionaries is None:
+        encoding_dictionaries = [None] * len(columns)
+
+    missing_columns = [column for column in columns if column not in dataframe.columns]
+    if missing_columns:
+        raise ValueError(
+            f"Column {', '.join(missing_columns)} does not exist in dataframe"
+        )
+
+    # the (e.g. filename) columns of large tables are not copied
+    dataframe_encoded = dataframe.copy(deep=False)
+    reversed_encoding_dicts = {}
+    for column, column_encoded, encoding_dictionary in zip(
+        columns, columns_encoded, encoding_dictionaries
+    ):
+        if not encoding_dictionary:
+            encoding_dictionary = {
+                value: i for i, value in enumerate(dataframe[column].unique())
+            }
+
+        labels = pd.Categorical(dataframe[column])
+        keys = pd.Index(list(encoding_dictionary.keys()))
+
+        # position in `keys` of each category, then of NaN for the -1 (missing) codes
+        categories_keys = np.append(
+            keys.get_indexer(labels.categories), keys.get_indexer([np.nan])
+        )
+        values_keys = categories_keys[labels.codes]
+
+        if (values_keys == -1).any():
+            missing_values = pd.unique(np.asarray(labels)[values_keys == -1])
             raise ValueError(
-                "Encoding dictionary is missing some keys: ", ", ".join(missing_values)
+                "Encoding dictionary is missing some keys: "
+                + ", ".join(map(str, missing_values))
             )
 
-    dataframe_encoded = pd.DataFrame(dataframe)  # make a copy
-    if not encoding_dictionary:
-        encoding_dictionary = {
-            value: i for i, value in enumerate(dataframe[column].unique())
-        }
-    dataframe_encoded[column_encoded] = dataframe_encoded[column].apply(
-        lambda x: encoding_dictionary[x]
-    )
+        encoded_values = np.asarray(list(encoding_dictionary.values()))
+        if categorical:
+            dataframe_encoded[column] = labels
+        dataframe_encoded[column_encoded] = encoded_values[values_keys]
 
-    reversed_encoding_dict = reverse_dict(encoding_dictionary)
+        reversed_encoding_dicts[column] = reverse_dict(encoding_dictionary)
 
-    return dataframe_encoded, reversed_encoding_dict
+    return dataframe_encoded, reversed_encoding_dicts
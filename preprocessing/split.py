@@ -1,23 +1,92 @@
 
 import numpy as np
-from sklearn.model_selection import train_test_split
+import pandas as pd
+from sklearn.model_selection import KFold, StratifiedKFold, train_test_split
+
+
+def patients_labels(dataset_df, patient_col, label_col):
+    """
+    Collapse the dataset to one row per patient, with the patient labels.
+
+    Parameters
+    ----------
+    dataset_df : pandas.DataFrame
+        The dataset, e.g. with one row per tile
+    patient_col : str
+        Column of the patients
+    label_col : str or list of str
+        Column(s) of the labels, constant within each patient
+
+    Returns
+    -------
+    pandas.DataFrame
+        The first non-null label(s) of each patient, indexed by patient
+
+    """
+    label_cols = [label_col] if isinstance(label_col, str) else list(label_col)
+    # observed: categorical patients without rows are left out
+    return dataset_df.groupby(patient_col, observed=True)[label_cols].first()
+
+
+def _strata(labels_df):
+    """Return an integer stratum for each combination of labels, NaN included."""
+    codes = np.stack(
+        [pd.factorize(labels_df[col])[0] for col in labels_df.columns], axis=1
+    )
+    return np.unique(codes, axis=0, return_inverse=True)[1].ravel()
 
 
 def train_test_df_patient_wise(
-    dataset_df, patient_col, label_col, test_size=0.2, stratify=True, seed=1234
+    dataset_df,
+    patient_col,
+    label_col,
+    test_size=0.2,
+    stratify=True,
+    seed=1234,
+    return_mapping=False,
 ):
-    patient_with_labels = (
-        dataset_df.groupby(patient_col)[label_col].apply(list)
-    )
-    unique_patients = patient_with_labels.index.values
-    patients_labels = np.array(list(patient_with_labels.values))
+    """
+    Split the dataset in train and test, so that all the rows of a patient are in the
+    same split.
+
+    Parameters
+    ----------
+    dataset_df : pandas.DataFrame
+        The dataset to split
+    patient_col : str
+        Column of the patients
+    label_col : str or list of str
+        Column(s) of the labels, used to stratify the split. If more than one, the split
+        is stratified by their combinations.
+    test_size : float
+        Proportion of the patients in the test split. Default is 0.2.
+    stratify : bool
+        Whether to stratify the split by `label_col`. Default is True.
+    seed : int
+        Seed of the split. Default is 1234.
+    return_mapping : bool
+        Whether to also return the split of each patient. Default is False.
+
+    Returns
+    -------
+    dataset_train_df : pandas.DataFrame
+        Rows of the train patients
+    dataset_test_df : pandas.DataFrame
+        Rows of the test patients
+    split_mapping : pandas.Series
+        "train" or "test" for each patient, indexed by patient. Only returned if
+        `return_mapping` is True.
+
+    """
+    labels_df = patients_labels(dataset_df, patient_col, label_col)
+    unique_patients = labels_df.index.to_numpy()
 
     if stratify:
         train_patients, test_patients = train_test_split(
             unique_patients,
             test_size=test_size,
             random_state=seed,
-            stratify=patients_labels,
+            stratify=_strata(labels_df),
         )
     else:
         train_patients, test_patients = train_test_split(
@@ -27,4 +96,64 @@ def train_test_df_patient_wise(
     dataset_train_df = dataset_df.loc[dataset_df[patient_col].isin(train_patients)]
     dataset_test_df = dataset_df.loc[dataset_df[patient_col].isin(test_patients)]
 
+    if return_mapping:
+        split_mapping = pd.concat(
+            [
+                pd.Series("train", index=train_patients),
+                pd.Series("test", index=test_patients),
+            ]
+        ).rename("split")
+        return dataset_train_df, dataset_test_df, split_mapping
+
     return dataset_train_df, dataset_test_df
+
+
+def k_fold_patient_wise(
+    dataset_df, patient_col, label_col, n_splits=5, stratify=True, seed=1234
+):
+    """
+    Assign every patient to one of `n_splits` folds, so that all the rows of a patient
+    are in the same fold.
+
+    The dataset is collapsed to one row per patient once (see `patients_labels`), and
+    the returned table is enough to select the rows of every fold, e.g.
+    `dataset_df[patient_col].map(folds["fold"]) == k`.
+
+    Parameters
+    ----------
+    dataset_df : pandas.DataFrame
+        The dataset to split
+    patient_col : str
+        Column of the patients
+    label_col : str or list of str
+        Column(s) of the labels, used to stratify the folds. If more than one, the folds
+        are stratified by their combinations.
+    n_splits : int
+        Number of folds. Default is 5.
+    stratify : bool
+        Whether to stratify the folds by `label_col`. Default is True.
+    seed : int
+        Seed of the folds. Default is 1234.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Labels and fold (int8, from 0 to `n_splits` - 1) of each patient, indexed by
+        patient
+
+    """
+    folds = patients_labels(dataset_df, patient_col, label_col)
+
+    if stratify:
+        k_fold = StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=seed)
+    else:
+        k_fold = KFold(n_splits=n_splits, shuffle=True, random_state=seed)
+
+    fold = np.empty(len(folds), dtype=np.int8)
+    for k, (_, fold_indices) in enumerate(
+        k_fold.split(np.zeros(len(folds)), _strata(folds))
+    ):
+        fold[fold_indices] = k
+
+    folds["fold"] = fold
+    return folds
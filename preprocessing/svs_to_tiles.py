@@ -1,8 +1,59 @@
+import multiprocessing
+import multiprocessing.util
 import os
 
 import gin
 
-from histo_lib import WSI, RandomTiler
+from histo_lib import STAIN_NORMALIZERS, WSI, GridTiler, RandomTiler, ShardWriter
+
+
+def _stain_normalizer(stain_normalization, stain_target):
+    """Return the stain normalizer loading its target, or None if not requested."""
+    if stain_normalization is None:
+        return None
+    if stain_normalization not in STAIN_NORMALIZERS:
+        raise ValueError(
+            f"stain_normalization must be {' or '.join(STAIN_NORMALIZERS)}. Got {stain_normalization}."
+        )
+    if stain_target is None:
+        raise ValueError("stain_target is needed to normalize the stains")
+
+    return STAIN_NORMALIZERS[stain_normalization]().load(stain_target)
+
+
+# shard writers of a worker process of `extract_tiles_parallel`, by shards folder, kept
+# open across its slides so that shards only roll over at their maximum size
+_worker_shard_writers = None
+
+
+def _init_extraction_worker():
+    global _worker_shard_writers
+    _worker_shard_writers = {}
+    # closed when the worker exits, i.e. after the pool is closed and joined
+    multiprocessing.util.Finalize(None, _close_worker_shard_writers, exitpriority=10)
+
+
+def _close_worker_shard_writers():
+    for writer in _worker_shard_writers.values():
+        writer.close()
+    _worker_shard_writers.clear()
+
+
+def _extract(tiler, wsi, shards_dir):
+    if shards_dir is None:
+        return tiler.extract(wsi)
+
+    if _worker_shard_writers is None:
+        with ShardWriter(shards_dir) as writer:
+            tile_filenames = tiler.extract(wsi, writer)
+    else:
+        writer = _worker_shard_writers.get(shards_dir)
+        if writer is None:
+            writer = _worker_shard_writers[shards_dir] = ShardWriter(shards_dir)
+        tile_filenames = tiler.extract(wsi, writer)
+        # the index of a finished slide survives a later crash of the worker
+        writer.flush()
+    return list(map(os.path.basename, tile_filenames))
 
 
 @gin.configurable
@@ -16,6 +67,14 @@ def extract_random_tiles(
     prefix="",
     suffix=".png",
     max_iter=1e4,
+    sampling="box",
+    n_workers=1,
+    tissue_cache_dir=None,
+    shards_dir=None,
+    stain_normalization=None,
+    stain_target=None,
+    block_sampling=False,
+    region_cache_bytes=0,
 ):
     """
     Extract random tiles from the WSI and save them to disk.
@@ -41,6 +100,41 @@ def extract_random_tiles(
     max_iter : int
         Maximum number of iterations performed when searching for eligible (if check_tissue=True) tiles.
         Must be grater than or equal to `n_tiles`.
+    sampling : {box, mask}
+        How candidate tiles are drawn: uniformly within the tissue box ('box') or from
+        the cells overlapping the tissue mask, weighted by tissue fraction ('mask').
+        Default is 'box'.
+    n_workers : int
+        Number of threads of each extraction stage (region read, tissue check, encode and
+        write). Default is 1, i.e. tiles are processed serially.
+    tissue_cache_dir : str or pathlib.Path, optional
+        Folder where the tissue mask and box of the WSI are cached, so that re-runs
+        skip tissue detection. Default is None, i.e. no cache on disk.
+    shards_dir : str or pathlib.Path, optional
+        If provided, tiles are appended to shard files in this folder (see
+        `histo_lib.ShardWriter`) instead of being saved as separate files.
+        Default is None.
+    stain_normalization : {reinhard, macenko}, optional
+        If provided, tiles are stain normalized during the extraction (see
+        `histo_lib.StainNormalizer`), towards the statistics of `stain_target`. The
+        statistics of the WSI are cached in `tissue_cache_dir`. Default is None.
+    stain_target : str or pathlib.Path, optional
+        Target statistics saved by `histo_lib.StainNormalizer.save`. Needed if
+        `stain_normalization` is provided.
+    block_sampling : bool
+        Whether to draw the candidate coordinates in blocks (see
+        `histo_lib.RandomTiler`): faster with mask sampling, but for a given seed it
+        yields different tiles than previous releases. Default is False.
+    region_cache_bytes : int
+        Size in bytes of the super-region read cache of the WSI (see `histo_lib.WSI`),
+        so that nearby tiles are sliced from regions read once. Default is 0, i.e. every
+        tile is read from the slide.
+
+    Returns
+    -------
+    list of str
+        Filenames of the saved tiles (names of the tiles in the shards if `shards_dir`
+        is provided, without the folders of `prefix`)
 
     Raises
     ------
@@ -48,6 +142,9 @@ def extract_random_tiles(
         If wsi_filename does not exist.
     IsADirectoryError
         If wsi_filename is a directory and not a file
+    ValueError
+        If stain_normalization is not 'reinhard' or 'macenko', or stain_target is
+        missing
 
     """
     if not os.path.exists(wsi_filename):
@@ -57,9 +154,243 @@ def extract_random_tiles(
             f"{wsi_filename} is a directory, while a file is needed."
         )
 
-    wsi = WSI(wsi_filename)
+    wsi = WSI(
+        wsi_filename,
+        cache_dir=tissue_cache_dir,
+        region_cache_bytes=region_cache_bytes,
+    )
 
     tiler = RandomTiler(
-        tile_size, n_tiles, level, seed, check_tissue, prefix, suffix, max_iter
+        tile_size,
+        n_tiles,
+        level,
+        seed,
+        check_tissue,
+        prefix,
+        suffix,
+        max_iter,
+        sampling,
+        n_workers,
+        _stain_normalizer(stain_normalization, stain_target),
+        block_sampling=block_sampling,
     )
-    tiler.extract(wsi)
+    return _extract(tiler, wsi, shards_dir)
+
+
+@gin.configurable
+def extract_grid_tiles(
+    wsi_filename,
+    tile_size,
+    level=0,
+    pixel_overlap=0,
+    check_tissue=True,
+    mask_threshold=0.0,
+    prefix="",
+    suffix=".png",
+    n_workers=1,
+    tissue_cache_dir=None,
+    shards_dir=None,
+    region_cache_bytes=0,
+    stain_normalization=None,
+    stain_target=None,
+):
+    """
+    Extract tiles on a regular grid from the WSI and save them to disk.
+
+    Parameters
+    ----------
+    wsi_filename : str or pathlib.Path
+        The filename of the wsi from which to extract the tiles.
+    tile_size : int, tuple or list of int
+        (width, height) of the extracted tiles.
+    level : int
+        Level from which extract the tiles. Default is 0.
+    pixel_overlap : int
+        Number of overlapping pixels (at level `level`) between adjacent tiles.
+        Default is 0, i.e. no overlap.
+    check_tissue : bool
+        Whether to check if the tile has enough tissue to be saved. Default is True.
+    mask_threshold : float
+        Minimum fraction of the tile area covered by the thumbnail tissue mask for the
+        tile to be read from the slide. Default is 0.0.
+    prefix : str
+        Prefix to be added to the tile filename. Default is an empty string.
+    suffix : str
+        Suffix to be added to the tile filename. Default is '.png'
+    n_workers : int
+        Number of threads of each extraction stage (region read, tissue check, encode and
+        write). Default is 1, i.e. tiles are processed serially.
+    tissue_cache_dir : str or pathlib.Path, optional
+        Folder where the tissue mask and box of the WSI are cached, so that re-runs
+        skip tissue detection. Default is None, i.e. no cache on disk.
+    shards_dir : str or pathlib.Path, optional
+        If provided, tiles are appended to shard files in this folder (see
+        `histo_lib.ShardWriter`) instead of being saved as separate files.
+        Default is None.
+    region_cache_bytes : int
+        Size in bytes of the super-region read cache of the WSI (see `histo_lib.WSI`),
+        so that adjacent and overlapping tiles are sliced from regions read once.
+        Default is 0, i.e. every tile is read from the slide.
+    stain_normalization : {reinhard, macenko}, optional
+        If provided, tiles are stain normalized during the extraction (see
+        `histo_lib.StainNormalizer`), towards the statistics of `stain_target`. The
+        statistics of the WSI are cached in `tissue_cache_dir`. Default is None.
+    stain_target : str or pathlib.Path, optional
+        Target statistics saved by `histo_lib.StainNormalizer.save`. Needed if
+        `stain_normalization` is provided.
+
+    Returns
+    -------
+    list of str
+        Filenames of the saved tiles (names of the tiles in the shards if `shards_dir`
+        is provided, without the folders of `prefix`)
+
+    Raises
+    ------
+    FileNotFoundError
+        If wsi_filename does not exist.
+    IsADirectoryError
+        If wsi_filename is a directory and not a file
+    ValueError
+        If stain_normalization is not 'reinhard' or 'macenko', or stain_target is
+        missing
+
+    """
+    if not os.path.exists(wsi_filename):
+        raise FileNotFoundError(f"File {wsi_filename} does not exist.")
+    if os.path.isdir(wsi_filename):
+        raise IsADirectoryError(
+            f"{wsi_filename} is a directory, while a file is needed."
+        )
+
+    wsi = WSI(
+        wsi_filename,
+        cache_dir=tissue_cache_dir,
+        region_cache_bytes=region_cache_bytes,
+    )
+
+    tiler = GridTiler(
+        tile_size,
+        level,
+        pixel_overlap,
+        check_tissue,
+        mask_threshold,
+        prefix,
+        suffix,
+        n_workers,
+        _stain_normalizer(stain_normalization, stain_target),
+    )
+    return _extract(tiler, wsi, shards_dir)
+
+
+EXTRACTION_FUNCTIONS = {"random": extract_random_tiles, "grid": extract_grid_tiles}
+
+
+def _extract_tiles_worker(task):
+    """Extract the tiles of a single WSI in a worker process.
+
+    The WSI is opened by the worker itself, so that OpenSlide handles are never
+    shared between processes. Errors are returned instead of raised, so that a broken
+    slide does not stop the extraction of the others.
+
+    Parameters
+    ----------
+    task : tuple
+        (wsi_filename, prefix, extraction_mode, kwargs) of the WSI to process
+
+    Returns
+    -------
+    tuple
+        (wsi_filename, tile_filenames, error), where error is None on success
+    """
+    wsi_filename, prefix, extraction_mode, kwargs = task
+    try:
+        tile_filenames = EXTRACTION_FUNCTIONS[extraction_mode](
+            wsi_filename, prefix=prefix, **kwargs
+        )
+    except Exception as e:
+        return wsi_filename, [], f"{type(e).__name__}: {e}"
+    else:
+        return wsi_filename, tile_filenames, None
+
+
+def extract_tiles_parallel(
+    wsi_filenames, output_folders, extraction_mode="random", n_processes=None, **kwargs
+):
+    """
+    Extract tiles from many WSI in parallel, one WSI at a time per worker process.
+
+    Every worker opens its own WSI handles and is reused for many slides, so that the
+    interpreter startup and the gin configuration parsing are paid once per worker
+    instead of once per slide. If tiles are written to shards (`shards_dir`), every
+    worker appends the tiles of all its slides to the same `histo_lib.ShardWriter`,
+    so that a new shard is started only when the current one reaches its maximum size.
+    Tiles are saved following the filename pattern of `extract_random_tiles` (or
+    `extract_grid_tiles`), prefixed with `{output_folder}/{wsi_filename_no_ext}_`.
+
+    Parameters
+    ----------
+    wsi_filenames : list of str or pathlib.Path
+        The filenames of the WSI from which to extract the tiles.
+    output_folders : str, pathlib.Path or list of them
+        Folder in which to save the tiles, either the same for all the WSI or one for each WSI.
+    extraction_mode : {random, grid}
+        Tiles extraction mode. Default is random.
+    n_processes : int, optional
+        Number of worker processes. By default is None, which means the number of CPUs.
+    **kwargs
+        Additional arguments passed to `extract_random_tiles` (or `extract_grid_tiles`),
+        overriding the gin configuration, e.g. `n_workers`, the number of threads of
+        each worker process.
+
+    Returns
+    -------
+    tiles_per_wsi : dict
+        Filenames of the saved tiles (list of str) for each WSI filename
+    failed_wsi : dict
+        Error message for each WSI filename for which the extraction failed
+
+    Raises
+    ------
+    ValueError
+        If extraction_mode is not 'random' or 'grid'
+    ValueError
+        If the number of output folders is different than the number of WSI
+
+    """
+    if extraction_mode not in EXTRACTION_FUNCTIONS:
+        raise ValueError(
+            f"extraction_mode must be {' or '.join(EXTRACTION_FUNCTIONS)}. Got {extraction_mode}."
+        )
+
+    if isinstance(output_folders, (str, os.PathLike)):
+        output_folders = [output_folders] * len(wsi_filenames)
+    if len(output_folders) != len(wsi_filenames):
+        raise ValueError(
+            f"The number of output folders ({len(output_folders)}) is different than "
+            f"the number of WSI ({len(wsi_filenames)})"
+        )
+
+    tasks = []
+    for wsi_filename, output_folder in zip(wsi_filenames, output_folders):
+        wsi_filename_no_ext = os.path.splitext(os.path.basename(wsi_filename))[0]
+        prefix = f"{output_folder}/{wsi_filename_no_ext}_"
+        tasks.append((wsi_filename, prefix, extraction_mode, kwargs))
+
+    tiles_per_wsi = {}
+    failed_wsi = {}
+    with multiprocessing.Pool(n_processes, initializer=_init_extraction_worker) as pool:
+        for wsi_filename, tile_filenames, error in pool.imap_unordered(
+            _extract_tiles_worker, tasks
+        ):
+            if error is None:
+                tiles_per_wsi[wsi_filename] = tile_filenames
+            else:
+                print(f"{wsi_filename}: {error}")
+                failed_wsi[wsi_filename] = error
+
+        # workers exit on their own, closing their shard writers
+        pool.close()
+        pool.join()
+
+    return tiles_per_wsi, failed_wsi
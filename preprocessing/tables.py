@@ -0,0 +1,192 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+TABLE_FORMATS = {".csv": "csv", ".parquet": "parquet", ".feather": "feather"}
+STRING_COLUMNS = ("filename",)
+CATEGORICAL_COLUMNS = ("patient", "wsi_id", "split")
+COORDINATE_COLUMNS = ("level", "x_ul", "y_ul", "x_br", "y_br")
+# tile filenames as written by histo_lib.Tiler: ..._level{level}_{x_ul}-{y_ul}-{x_br}-{y_br}.ext
+TILE_COORDINATES_PATTERN = r"_level(\d+)_(\d+)-(\d+)-(\d+)-(\d+)\.[^.]+$"
+# dtype of the string columns read or built by pandas (object, unless it infers strings)
+STRING_DTYPE = pd.Series([""]).dtype
+
+
+def table_format(filename):
+    """
+    Return the format of a table file from its extension.
+
+    Parameters
+    ----------
+    filename : str or pathlib.Path
+        Path of the table
+
+    Returns
+    -------
+    str
+        One of the values of `TABLE_FORMATS`
+
+    Raises
+    ------
+    ValueError
+        If the extension is not one of the keys of `TABLE_FORMATS`
+
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    if ext not in TABLE_FORMATS:
+        raise ValueError(
+            f"Table extension must be {' or '.join(TABLE_FORMATS)}. Got {ext}."
+        )
+    return TABLE_FORMATS[ext]
+
+
+def typed_table(dataframe):
+    """
+    Return `dataframe` with compact dtypes for the known columns.
+
+    `CATEGORICAL_COLUMNS` become categorical, and `COORDINATE_COLUMNS` without missing
+    values become int64. `STRING_COLUMNS` and `CATEGORICAL_COLUMNS` without any value,
+    e.g. in an empty table, are strings (`STRING_DTYPE`) instead of float64.
+
+    Parameters
+    ----------
+    dataframe : pandas.DataFrame
+        The table to type
+
+    Returns
+    -------
+    pandas.DataFrame
+        A shallow copy of `dataframe` with the typed columns
+
+    """
+    typed = {}
+    for column in STRING_COLUMNS + CATEGORICAL_COLUMNS:
+        if (
+            column in dataframe.columns
+            and dataframe[column].dtype.kind == "f"
+            and dataframe[column].isna().all()
+        ):
+            typed[column] = dataframe[column].astype(STRING_DTYPE)
+    for column in CATEGORICAL_COLUMNS:
+        if column in dataframe.columns and dataframe[column].dtype.name != "category":
+            typed[column] = typed.get(column, dataframe[column]).astype("category")
+    for column in COORDINATE_COLUMNS:
+        if column in dataframe.columns and not dataframe[column].isna().any():
+            typed[column] = dataframe[column].astype("int64")
+
+    return dataframe.assign(**typed) if typed else dataframe
+
+
+def tile_coordinates(filenames):
+    """
+    Parse level and level-0 coordinates of the tiles from their filenames.
+
+    Parameters
+    ----------
+    filenames : list of str or pandas.Series
+        Tile filenames, following the pattern of `histo_lib.Tiler`
+
+    Returns
+    -------
+    pandas.DataFrame
+        `COORDINATE_COLUMNS` of each tile, NaN if the filename does not match
+
+    """
+    coordinates = pd.Series(filenames, dtype=object).str.extract(
+        TILE_COORDINATES_PATTERN
+    )
+    coordinates.columns = list(COORDINATE_COLUMNS)
+    return typed_table(coordinates.astype(np.float64))
+
+
+def read_table(filename, columns=None):
+    """
+    Read a CSV, Parquet or Feather table, depending on the extension of `filename`.
+
+    Parameters
+    ----------
+    filename : str or pathlib.Path
+        Path of the table
+    columns : list of str, optional
+        Columns to read. Default is None, i.e. all the columns.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The table, with the known columns typed (see `typed_table`)
+
+    """
+    fmt = table_format(filename)
+
+    if fmt == "parquet":
+        dataframe = pd.read_parquet(filename, columns=columns)
+    elif fmt == "feather":
+        dataframe = pd.read_feather(filename, columns=columns)
+    else:
+        dataframe = pd.read_csv(filename, usecols=columns)
+
+    return typed_table(dataframe)
+
+
+def _arrow_table(dataframe):
+    """
+    Return `dataframe` as a pyarrow Table, where `STRING_COLUMNS` and
+    `CATEGORICAL_COLUMNS` are strings (dictionary encoded for the categorical ones) even
+    without any value, so that empty tables have the same schema as the others.
+    """
+    import pyarrow as pa
+
+    schema = pa.Schema.from_pandas(dataframe, preserve_index=False)
+    # type of the non-empty string columns
+    string_type = pa.array(pd.Series([""], dtype=STRING_DTYPE)).type
+    fields = []
+    for field in schema:
+        if field.name in STRING_COLUMNS and pa.types.is_null(field.type):
+            field = pa.field(field.name, string_type)
+        elif (
+            field.name in CATEGORICAL_COLUMNS
+            and pa.types.is_dictionary(field.type)
+            and pa.types.is_null(field.type.value_type)
+        ):
+            field = pa.field(
+                field.name, pa.dictionary(field.type.index_type, string_type)
+            )
+        fields.append(field)
+
+    return pa.Table.from_pandas(
+        dataframe,
+        schema=pa.schema(fields, metadata=schema.metadata),
+        preserve_index=False,
+    )
+
+
+def write_table(data, filename):
+    """
+    Write `data` as a CSV, Parquet or Feather table, depending on the extension of
+    `filename`.
+
+    Parquet and Feather keep the categorical and integer dtypes of the columns (see
+    `typed_table`); both need pyarrow.
+
+    Parameters
+    ----------
+    data : ndarray (structured or homogeneous), Iterable, dict, or DataFrame
+        Dict can contain Series, arrays, constants, or list-like objects.
+    filename : str or pathlib.Path
+        Path of the table
+
+    """
+    fmt = table_format(filename)
+    dataframe = typed_table(pd.DataFrame(data))
+
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+
+        pq.write_table(_arrow_table(dataframe), filename)
+    elif fmt == "feather":
+        from pyarrow import feather
+
+        feather.write_feather(_arrow_table(dataframe), filename)
+    else:
+        dataframe.to_csv(filename, index=False)
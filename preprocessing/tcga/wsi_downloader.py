@@ -1,37 +1,92 @@
+import hashlib
 import os
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 import pandas as pd
 import requests
-from requests import RequestException
+from requests import HTTPError, RequestException
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
 
+DownloadRecord = namedtuple(
+    "DownloadRecord",
+    ("uuid", "filename", "status", "size", "seconds", "throughput", "retries", "error"),
+)
+
+GDC_DATA_ENDPOINT = "https://api.gdc.cancer.gov/data"
+DOWNLOAD_CHUNK_SIZE = 2 ** 20
+PARTIAL_SUFFIX = ".part"
+QUARANTINE_DIR = "quarantine"
+# seconds to wait for the connection and between received bytes
+REQUEST_TIMEOUT = 60
+# seconds before the first retry, doubled at every retry
+RETRY_BACKOFF = 1.0
+
+
+class IncompleteDownloadError(RequestException):
+    """The downloaded file is smaller or bigger than announced by the server."""
+
+
+class ChecksumMismatchError(RequestException):
+    """The md5 checksum of the downloaded file is different than expected."""
+
 
 class TCGAWSIDownloader:
     """TCGA WSI Downloader. 
 
+    Files are streamed in chunks to a `.part` file next to the output file, which is
+    renamed to the output file only when complete. An interrupted download is resumed
+    from the partial file with an HTTP Range request.
+    If the metadata has a `md5` column, files are hashed while streamed, and files
+    whose checksum does not match are moved to the `quarantine` subfolder of
+    `output_folder`.
+
     Attributes
     ----------
     metadata_path : str or pathlib.Path
-        Path to the CSV file containing `uuid` and `filename` columns.
+        Path to the CSV file containing `uuid` and `filename` columns, and optionally
+        a `md5` column with the expected checksums.
         The UUID is the TCGA file unique identifier.
     metadata : pandas.DataFrame
         The metadata DataFrame
     output_folder : str or pathlib.Path
         Folder where to save the downloaded WSI
+    data_endpoint : str
+        URL of the data endpoint, to which the file UUID is appended. Default is the
+        GDC data endpoint.
+    chunk_size : int
+        Size in bytes of the chunks streamed to disk. Default is 1 MiB.
     not_downloaded : list of str
         UUIDs of the WSI for which some error happened during download
+    report : pandas.DataFrame or None
+        One `DownloadRecord` (uuid, filename, status, size in bytes, seconds,
+        throughput in MB/s, retries and error) for each WSI of the last `download`
 
     """
 
-    def __init__(self, metadata_path, output_folder):
+    def __init__(
+        self,
+        metadata_path,
+        output_folder,
+        data_endpoint=GDC_DATA_ENDPOINT,
+        chunk_size=DOWNLOAD_CHUNK_SIZE,
+    ):
         self._metadata_path = Path(metadata_path)
         self._output_folder = Path(output_folder)
+        self.data_endpoint = data_endpoint
+        self.chunk_size = chunk_size
         self._not_downloaded = []
+        self._metadata = None
+        self.report = None
 
     @property
     def metadata(self):
-        return pd.read_csv(self.metadata_path)
+        if self._metadata is None:
+            self._metadata = pd.read_csv(self.metadata_path)
+        return self._metadata
 
     @property
     def metadata_path(self):
@@ -45,40 +100,123 @@ class TCGAWSIDownloader:
     def not_downloaded(self):
         return self._not_downloaded
 
-    @staticmethod
-    def _download_single_wsi(file_uuid, output_filename):
+    def _download_single_wsi(self, file_uuid, output_filename, session=None, md5=None):
         """Download a single WSI from TCGA data portal.
 
+        The file is streamed to `{output_filename}.part`, resuming it if it exists, and
+        renamed to `output_filename` once its size matches the one announced by the
+        server.
+
         Parameters
         ----------
         file_uuid : str
             TCGA UUID file reference.
         output_filename : str or pathlib.Path
             Filename to which the WSI is saved.
+        session : requests.Session, optional
+            Session used for the request, so that connections are reused. By default
+            a new connection is opened.
+        md5 : str, optional
+            Expected md5 checksum of the file, computed on the data as it is written.
+            By default the checksum is not verified.
 
         Raises
         ------
-        FileExistsError
-            If output_filename already exists.
+        KeyError
+            If the UUID does not correspond to a valid file.
+        IncompleteDownloadError
+            If the size of the downloaded file is different than announced. The
+            partial file is kept, so that the next attempt resumes it.
+        ChecksumMismatchError
+            If the md5 checksum of the file is different than `md5`. The file is moved
+            to the quarantine folder, so that the next attempt starts from scratch.
+        requests.RequestException
+            If the request fails.
 
         """
         os.makedirs(Path(output_filename).parent, exist_ok=True)
 
-        data_endpt = "https://api.gdc.cancer.gov/data/{}".format(file_uuid)
-
-        response = requests.get(
-            data_endpt, headers={"Content-Type": "application/json"}
+        data_endpt = f"{self.data_endpoint.rstrip('/')}/{file_uuid}"
+        partial_filename = f"{output_filename}{PARTIAL_SUFFIX}"
+        offset = (
+            os.path.getsize(partial_filename) if os.path.exists(partial_filename) else 0
         )
 
-        try:
-            # "Content-Disposition" key is found only if the UUID corresponds to a valid file
-            response_head_cd = response.headers["Content-Disposition"]
-        except KeyError as e:
-            # TODO: log the exception
-            raise
-        else:
-            with open(output_filename, "wb") as output_file:
-                output_file.write(response.content)
+        headers = {"Content-Type": "application/json"}
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+
+        with (session or requests).get(
+            data_endpt, headers=headers, stream=True, timeout=REQUEST_TIMEOUT
+        ) as response:
+            if offset and response.status_code == 416:
+                # range not satisfiable: the partial file is not a prefix of the file
+                os.remove(partial_filename)
+                return self._download_single_wsi(
+                    file_uuid, output_filename, session, md5
+                )
+
+            response.raise_for_status()
+
+            try:
+                # "Content-Disposition" key is found only if the UUID corresponds to a valid file
+                response_head_cd = response.headers["Content-Disposition"]
+            except KeyError as e:
+                # TODO: log the exception
+                raise
+
+            if response.status_code != 206:
+                offset = 0  # the whole file is sent, the range is ignored
+            expected_size = self._expected_size(response, offset)
+
+            md5_hash = hashlib.md5() if md5 else None
+            if md5_hash is not None and offset:
+                # the resumed prefix is hashed once, new data is hashed as it arrives
+                with open(partial_filename, "rb") as partial_file:
+                    for chunk in iter(lambda: partial_file.read(self.chunk_size), b""):
+                        md5_hash.update(chunk)
+
+            with open(partial_filename, "ab" if offset else "wb") as output_file:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    output_file.write(chunk)
+                    if md5_hash is not None:
+                        md5_hash.update(chunk)
+
+        size = os.path.getsize(partial_filename)
+        if expected_size is not None and size != expected_size:
+            raise IncompleteDownloadError(
+                f"{file_uuid}: downloaded {size} bytes instead of {expected_size}"
+            )
+
+        if md5_hash is not None and md5_hash.hexdigest() != md5.lower():
+            quarantine_filename = (
+                Path(output_filename).parent
+                / QUARANTINE_DIR
+                / Path(output_filename).name
+            )
+            os.makedirs(quarantine_filename.parent, exist_ok=True)
+            os.replace(partial_filename, quarantine_filename)
+            raise ChecksumMismatchError(
+                f"{file_uuid}: md5 {md5_hash.hexdigest()} instead of {md5}, "
+                f"file moved to {quarantine_filename}"
+            )
+
+        os.replace(partial_filename, output_filename)
+
+    @staticmethod
+    def _expected_size(response, offset):
+        """Return the total size of the file from the response headers, if available."""
+        content_range = response.headers.get("Content-Range")
+        if response.status_code == 206 and content_range is not None:
+            # e.g. "bytes 100-999/1000"
+            total = content_range.rsplit("/", 1)[-1]
+            if total != "*":
+                return int(total)
+
+        content_length = response.headers.get("Content-Length")
+        if content_length is not None and "Content-Encoding" not in response.headers:
+            return offset + int(content_length)
+        return None
 
     @staticmethod
     def _handle_existing_file(output_path, overwrite_mode):
@@ -97,12 +235,66 @@ class TCGAWSIDownloader:
             to_skip = False
         return to_skip
 
-    def _total_wsi_to_download(self, n):
-        return len(self.metadata) if n == 0 else n
+    @staticmethod
+    def _is_retryable(error):
+        """Whether a download error is transient, i.e. a network or server error."""
+        if isinstance(error, HTTPError):
+            return error.response is not None and error.response.status_code >= 500
+        return isinstance(error, RequestException)
 
-    def download(self, n=0, overwrite_mode="skip"):
+    def _download_with_retries(
+        self, file_uuid, filename, session, max_retries, md5=None
+    ):
+        """Download a single WSI, retrying transient errors, and return its record."""
+        output_path = self.output_folder / filename
+        partial_path = f"{output_path}{PARTIAL_SUFFIX}"
+        resumed_size = (
+            os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+        )
+        retries = 0
+        status = "downloaded"
+        error = None
+        start = time.perf_counter()
+
+        while True:
+            try:
+                self._download_single_wsi(file_uuid, output_path, session, md5)
+            except (RequestException, KeyError) as e:
+                if retries < max_retries and self._is_retryable(e):
+                    time.sleep(RETRY_BACKOFF * 2 ** retries)
+                    retries += 1
+                    continue
+                status = (
+                    "quarantined" if isinstance(e, ChecksumMismatchError) else "failed"
+                )
+                error = f"{type(e).__name__}: {e}"
+            break
+
+        seconds = time.perf_counter() - start
+        downloaded_path = partial_path if error else output_path
+        size = (
+            os.path.getsize(downloaded_path) - resumed_size
+            if os.path.exists(downloaded_path)
+            else 0
+        )
+        return DownloadRecord(
+            uuid=file_uuid,
+            filename=filename,
+            status=status,
+            size=size,
+            seconds=seconds,
+            throughput=size / seconds / 1e6 if seconds else 0.0,
+            retries=retries,
+            error=error,
+        )
+
+    def download(
+        self, n=0, overwrite_mode="skip", n_workers=1, max_retries=0, report_path=None
+    ):
         """Download WSI from TCGA data portal.
 
+        Downloads run on `n_workers` threads sharing a connection-pooled session.
+
         Parameters
         ----------
         n : int, optional
@@ -114,13 +306,26 @@ class TCGAWSIDownloader:
             * skip: Skip download
 
             Default is skip.
+        n_workers : int, optional
+            Number of concurrent downloads. Default is 1.
+        max_retries : int, optional
+            Maximum number of retries of a download after a network or server error,
+            each one resuming the partial file, or after a checksum mismatch,
+            starting from scratch. Default is 0.
+        report_path : str or pathlib.Path, optional
+            If provided, the download report (see `report`) is saved there as CSV.
+
+        Returns
+        -------
+        pandas.DataFrame
+            The download report, see `report`
 
         Raises
         ------
         ValueError
             If overwrite_mode is not 'strict', 'overwrite' or 'skip'
         FileExistsError
-            If output_filename already exists.
+            If output_filename already exists, in strict mode. Nothing is downloaded.
             
         """
         if overwrite_mode not in ["strict", "overwrite", "skip"]:
@@ -128,29 +333,55 @@ class TCGAWSIDownloader:
                 f"overwrite_mode must be 'strict', 'overwrite' or 'skip'. Got {overwrite_mode}."
             )
 
-        total_wsi_to_download = self._total_wsi_to_download(n)
-        for i, row in tqdm(self.metadata.iterrows(), total=total_wsi_to_download):
-
-            if n != 0 and i == n:
-                break
+        metadata = self.metadata if n == 0 else self.metadata.head(n)
+        if "md5" in metadata.columns:
+            # an all-NaN column is float: only non-empty strings are checksums
+            md5s = [m if isinstance(m, str) and m else None for m in metadata["md5"]]
+        else:
+            md5s = [None] * len(metadata)
 
-            uuid = row["uuid"]
-            filename = row["filename"]
+        records = []
+        to_download = []
+        for uuid, filename, md5 in zip(metadata["uuid"], metadata["filename"], md5s):
+            to_skip = self._handle_existing_file(
+                self.output_folder / filename, overwrite_mode
+            )
+            if to_skip:
+                records.append(
+                    DownloadRecord(uuid, filename, "skipped", 0, 0.0, 0.0, 0, None)
+                )
+            else:
+                to_download.append((uuid, filename, md5))
 
-            output_path = self.output_folder / filename
-            try:
-                to_skip = self._handle_existing_file(output_path, overwrite_mode)
-            except FileExistsError as e:
-                raise
+        with requests.Session() as session:
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(n_workers, 1))
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
 
-            else:
-                if not to_skip:
-                    try:
-                        self._download_single_wsi(uuid, output_path)
-                    except (RequestException, KeyError) as e:
-                        print(f"{type(e).__name__}: {e}")
+            with ThreadPoolExecutor(n_workers) as executor:
+                futures = [
+                    executor.submit(
+                        self._download_with_retries,
+                        uuid,
+                        filename,
+                        session,
+                        max_retries,
+                        md5,
+                    )
+                    for uuid, filename, md5 in to_download
+                ]
+                for future in tqdm(as_completed(futures), total=len(futures)):
+                    record = future.result()
+                    if record.error is not None:
+                        print(record.error)
+                        self._not_downloaded.append(record.uuid)
+                    records.append(record)
 
-                        self._not_downloaded.append(uuid)
+        self.report = pd.DataFrame(records, columns=DownloadRecord._fields)
+        if report_path is not None:
+            self.report.to_csv(report_path, index=False)
 
         if self._not_downloaded:
             print("Not downloaded: ", "\n".join(self._not_downloaded))
+
+        return self.report
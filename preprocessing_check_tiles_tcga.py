@@ -1,7 +1,9 @@
 import argparse
 import os
+from itertools import compress
 
-from preprocessing.check_tiles import check_tile, save_csv
+from preprocessing.check_tiles import check_shard_tiles, check_tiles, save_csv
+from preprocessing.tables import tile_coordinates
 from preprocessing.tcga.utils import (
     tile_filename_to_wsi_filename,
     wsi_filename_to_patient,
@@ -12,21 +14,66 @@ from preprocessing.tcga.utils import (
 def main():
     parser = argparse.ArgumentParser(description="Perform checks on the tiles")
     parser.add_argument(
-        "tiles_paths", type=str, nargs="+", help="Tiles paths to be checked"
+        "tiles_paths", type=str, nargs="*", help="Tiles paths to be checked"
     )
     parser.add_argument(
         "csv_out_filename",
         type=str,
-        help="Filename of the output csv with correct tiles only",
+        help="Filename of the output csv (or .parquet, .feather) with correct tiles only",
+    )
+    parser.add_argument(
+        "--shards_dir",
+        type=str,
+        help="Folder of the tiles shards to be checked, instead of `tiles_paths`",
+    )
+    parser.add_argument(
+        "--slide_id",
+        type=str,
+        help="With --shards_dir, only check the tiles of this slide (the filename "
+        "of its WSI without extension), as shards may hold the tiles of many slides",
+    )
+    parser.add_argument(
+        "--header_only",
+        action="store_true",
+        help="Check size, mode and bit depth from the image headers only, without decoding the tiles",
+    )
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        help="Validation manifest, so that only new or modified tiles are checked again",
+    )
+    parser.add_argument(
+        "--n_workers",
+        type=int,
+        default=1,
+        help="Number of worker processes checking the tiles",
     )
 
     args = parser.parse_args()
 
     tiles_paths = args.tiles_paths
     csv_out_filename = args.csv_out_filename
+    shards_dir = args.shards_dir
+    slide_id = args.slide_id
+    header_only = args.header_only
+    n_workers = args.n_workers
+    manifest_filename = args.manifest
 
-    correct_tiles_paths = filter(check_tile, tiles_paths)
-    correct_tiles_filenames = list(map(os.path.basename, correct_tiles_paths))
+    if shards_dir is not None:
+        correct_tiles_filenames = check_shard_tiles(
+            shards_dir, slide_id, header_only=header_only, n_workers=n_workers
+        )
+    else:
+        correct_tiles_paths = compress(
+            tiles_paths,
+            check_tiles(
+                tiles_paths,
+                header_only=header_only,
+                n_workers=n_workers,
+                manifest_filename=manifest_filename,
+            ),
+        )
+        correct_tiles_filenames = list(map(os.path.basename, correct_tiles_paths))
 
     correct_wsi_filenames = list(
         map(tile_filename_to_wsi_filename, correct_tiles_filenames)
@@ -40,6 +87,7 @@ def main():
         "patient": correct_patients,
         "wsi_id": correct_wsi_ids,
     }
+    csv_data.update(tile_coordinates(correct_tiles_filenames).items())
 
     save_csv(
         csv_data, csv_out_filename,
@@ -2,14 +2,30 @@ import argparse
 from pathlib import Path
 
 from preprocessing.tcga import TCGAWSIDownloader
+from preprocessing.tcga.wsi_downloader import GDC_DATA_ENDPOINT
 
 
-def main(metadata_path, output_folder, data_source):
+def main(
+    metadata_path,
+    output_folder,
+    data_source,
+    data_endpoint=GDC_DATA_ENDPOINT,
+    n_workers=1,
+    max_retries=0,
+    report_path=None,
+):
 
     if data_source == "TCGA":
 
-        downloader = TCGAWSIDownloader(metadata_path, output_folder)
-        downloader.download(overwrite_mode="overwrite")
+        downloader = TCGAWSIDownloader(
+            metadata_path, output_folder, data_endpoint=data_endpoint
+        )
+        downloader.download(
+            overwrite_mode="overwrite",
+            n_workers=n_workers,
+            max_retries=max_retries,
+            report_path=report_path,
+        )
 
 
 if __name__ == "__main__":
@@ -25,15 +41,47 @@ if __name__ == "__main__":
         type=str,
         help=f'Repository from which retrieve the data. Accepted values: {", ".join(accepted_data_sources)}',
     )
+    parser.add_argument(
+        "--data_endpoint",
+        type=str,
+        default=GDC_DATA_ENDPOINT,
+        help="URL of the data endpoint, to which the file UUID is appended",
+    )
+    parser.add_argument(
+        "--n_workers", type=int, default=1, help="Number of concurrent downloads"
+    )
+    parser.add_argument(
+        "--max_retries",
+        type=int,
+        default=0,
+        help="Maximum number of retries of a download after a network or server error",
+    )
+    parser.add_argument(
+        "--report_path",
+        type=str,
+        help="Where to save the download report (CSV), with throughput, retries and errors",
+    )
 
     args = parser.parse_args()
 
     metadata_path = args.metadata_path
     output_folder = Path(args.output_folder)
     data_source = args.data_source
+    data_endpoint = args.data_endpoint
+    n_workers = args.n_workers
+    max_retries = args.max_retries
+    report_path = args.report_path
 
     assert (
         data_source in accepted_data_sources
     ), f'Data source {data_source} not available. Accepted values: {", ".join(accepted_data_sources)}'
 
-    main(metadata_path, output_folder, data_source)
+    main(
+        metadata_path,
+        output_folder,
+        data_source,
+        data_endpoint,
+        n_workers,
+        max_retries,
+        report_path,
+    )
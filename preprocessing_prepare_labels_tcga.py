@@ -2,7 +2,8 @@ import argparse
 
 import pandas as pd
 
-from preprocessing.labels import encode_label
+from preprocessing.labels import encode_labels
+from preprocessing.tables import read_table, write_table
 from preprocessing.tcga.utils import read_clinical_file
 
 
@@ -15,7 +16,7 @@ def main(
     label_cols,
 ):
 
-    tiles = pd.read_csv(valid_tiles_file)
+    tiles = read_table(valid_tiles_file)
     clinical = read_clinical_file(clinical_file)
 
     if not set(label_cols + [patient_col_clinical_file]) <= set(clinical.columns):
@@ -45,10 +46,9 @@ def main(
 
     assert len(tiles_w_labels) == len(tiles)
 
-    for label in label_cols:
-        tiles_w_labels, _ = encode_label(tiles_w_labels, label, f"{label}_encoded")
+    tiles_w_labels, _ = encode_labels(tiles_w_labels, label_cols)
 
-    tiles_w_labels.to_csv(output_tiles_labels_file, index=None)
+    write_table(tiles_w_labels, output_tiles_labels_file)
 
 
 if __name__ == "__main__":
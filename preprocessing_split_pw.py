@@ -1,23 +1,34 @@
 import argparse
 from pathlib import Path
 
-import pandas as pd
+from preprocessing.split import k_fold_patient_wise, train_test_df_patient_wise
+from preprocessing.tables import read_table, write_table
 
-from preprocessing.split import train_test_df_patient_wise
 
+def main(
+    labels_file,
+    splitted_labels_file,
+    label_cols,
+    stratify,
+    n_folds=None,
+    folds_file=None,
+):
+    labels = read_table(labels_file)
 
-def main(labels_file, splitted_labels_file, label_cols, stratify):
-    labels = pd.read_csv(labels_file)
-
-    train_df, test_df = train_test_df_patient_wise(
-        labels, "patient", label_cols, stratify=stratify
+    _, _, split_mapping = train_test_df_patient_wise(
+        labels, "patient", label_cols, stratify=stratify, return_mapping=True
     )
 
-    labels["split"] = labels["filename"].apply(
-        lambda x: "train" if x in train_df["filename"].values else "test"
-    )
+    # rows without a train patient are test rows
+    labels["split"] = labels["patient"].map(split_mapping).fillna("test")
+
+    write_table(labels, splitted_labels_file)
 
-    labels.to_csv(splitted_labels_file, index=None)
+    if n_folds is not None:
+        folds = k_fold_patient_wise(
+            labels, "patient", label_cols, n_splits=n_folds, stratify=stratify
+        )
+        write_table(folds.reset_index(), folds_file)
 
 
 if __name__ == "__main__":
@@ -33,11 +44,26 @@ if __name__ == "__main__":
         help="Column(s) to be used as labels. Must be present in the labels file",
     )
     parser.add_argument("--stratify", action="store_true")
+    parser.add_argument(
+        "--n_folds",
+        type=int,
+        help="Number of patient-wise folds to assign, for cross-validation",
+    )
+    parser.add_argument(
+        "--folds_file",
+        type=str,
+        help="Path of the fold assignment file (one row per patient). Required with --n_folds",
+    )
 
     args = parser.parse_args()
     labels_file = args.labels_file
     splitted_labels_file = args.splitted_labels_file
     label_cols = args.label_cols
     stratify = args.stratify
+    n_folds = args.n_folds
+    folds_file = args.folds_file
+
+    if n_folds is not None and folds_file is None:
+        parser.error("--folds_file is required with --n_folds")
 
-    main(labels_file, splitted_labels_file, label_cols, stratify)
+    main(labels_file, splitted_labels_file, label_cols, stratify, n_folds, folds_file)
@@ -1,14 +1,21 @@
 import argparse
 import os
+import sys
 from pathlib import Path
 
-from preprocessing.svs_to_tiles import extract_random_tiles
+from preprocessing.svs_to_tiles import (
+    extract_grid_tiles,
+    extract_random_tiles,
+    extract_tiles_parallel,
+)
 
 if __name__ == "__main__":
-    accepted_extraction_modes = ["random"]
+    accepted_extraction_modes = ["random", "grid"]
 
-    parser = argparse.ArgumentParser(description="Extract random tiles from a WSI")
-    parser.add_argument("wsi_filename", type=str, help="Filename of the WSI")
+    parser = argparse.ArgumentParser(description="Extract tiles from one or more WSI")
+    parser.add_argument(
+        "wsi_filenames", type=str, nargs="+", help="Filename(s) of the WSI"
+    )
     parser.add_argument(
         "output_folder", type=str, help="Folder in which to save the tiles"
     )
@@ -17,11 +24,18 @@ if __name__ == "__main__":
         type=str,
         help=f"Tiles extraction mode. Available options: {', '.join(accepted_extraction_modes)}",
     )
+    parser.add_argument(
+        "--n_processes",
+        type=int,
+        default=1,
+        help="Number of worker processes used to extract the tiles of many WSI",
+    )
 
     args = parser.parse_args()
-    wsi_filename = args.wsi_filename
+    wsi_filenames = args.wsi_filenames
     output_folder = Path(args.output_folder)
     extraction_mode = args.extraction_mode
+    n_processes = args.n_processes
 
     output_folder.parent.mkdir(parents=True, exist_ok=True)
 
@@ -29,6 +43,22 @@ if __name__ == "__main__":
         extraction_mode in accepted_extraction_modes
     ), f"Extraction mode {extraction_mode} not available. Accepted values: {', '.join(accepted_extraction_modes)}"
 
-    wsi_filename_no_ext = os.path.splitext(os.path.basename(wsi_filename))[0]
+    if n_processes > 1 and len(wsi_filenames) > 1:
+        _, failed_wsi = extract_tiles_parallel(
+            wsi_filenames, output_folder, extraction_mode, n_processes
+        )
+        if failed_wsi:
+            # non-zero exit status, so that a partial extraction is not a success
+            sys.exit("Not extracted: " + "\n".join(failed_wsi))
+    else:
+        for wsi_filename in wsi_filenames:
+            wsi_filename_no_ext = os.path.splitext(os.path.basename(wsi_filename))[0]
 
-    extract_random_tiles(wsi_filename, prefix=f"{output_folder}/{wsi_filename_no_ext}_")
+            if extraction_mode == "random":
+                extract_random_tiles(
+                    wsi_filename, prefix=f"{output_folder}/{wsi_filename_no_ext}_"
+                )
+            elif extraction_mode == "grid":
+                extract_grid_tiles(
+                    wsi_filename, prefix=f"{output_folder}/{wsi_filename_no_ext}_"
+                )
@@ -1,29 +1,338 @@
 import argparse
+import errno
+import hashlib
+import os
 import shutil
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from functools import lru_cache, partial
 from pathlib import Path
 
 import pandas as pd
 from tqdm import tqdm
 
+from histo_lib import ShardReader, ShardWriter
+from preprocessing.tables import read_table, write_table
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows: reflinks fall back to copies
+    fcntl = None
+
+LINK_MODES = ("hardlink", "reflink", "symlink", "copy")
+RECOMPACTED_MARKERS_DIR = ".recompacted"
+# ioctl cloning a whole file, from linux/fs.h
+FICLONE = 0x40049409
+# errors of a link mode not supported between two file systems, not of a single tile
+UNSUPPORTED_LINK_ERRNOS = frozenset(
+    (errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTSUP, errno.ENOTTY, errno.EINVAL)
+)
+
+# (link_mode, source device, destination device) of the links that failed as not
+# supported, so that every later tile is copied straight away
+_unsupported_links = set()
+
+
+@lru_cache(maxsize=None)
+def _folder_device(folder):
+    return os.stat(folder).st_dev
+
+
+def _reflink(source, destination):
+    if fcntl is None:
+        raise OSError("reflinks are not supported on this platform")
+
+    with open(source, "rb") as source_file, open(destination, "wb") as dest_file:
+        fcntl.ioctl(dest_file.fileno(), FICLONE, source_file.fileno())
+
+
+def link_tile(source, destination, link_mode="reflink"):
+    """
+    Link (or copy) the tile `source` to `destination`, replacing it if it exists.
+
+    If the link cannot be created, e.g. hardlinks across devices or reflinks on a file
+    system without copy-on-write support (ext4, NFS), the tile is copied. A link mode
+    not supported between the file systems of the two folders is tried only once: the
+    later tiles between the same file systems are copied without trying to link them.
+
+    Reflinks and copies are independent of `source`. Hardlinks share its data and
+    symlinks point to it: with them, `source` must never be rewritten in place (e.g.
+    by saving a tile again with PIL, which truncates the same file), as that would
+    change or corrupt `destination` too.
+
+    Parameters
+    ----------
+    source : str or pathlib.Path
+        Path of the tile
+    destination : str or pathlib.Path
+        Path of the linked tile
+    link_mode : {hardlink, reflink, symlink, copy}
+        How to link the tile. Default is reflink.
+
+    Returns
+    -------
+    str
+        The link mode actually used, i.e. `link_mode` or 'copy'
+
+    Raises
+    ------
+    ValueError
+        If link_mode is not one of `LINK_MODES`
+
+    """
+    if link_mode not in LINK_MODES:
+        raise ValueError(
+            f"link_mode must be {' or '.join(LINK_MODES)}. Got {link_mode}."
+        )
+
+    link_key = None
+    if link_mode != "copy":
+        link_key = (
+            link_mode,
+            _folder_device(os.path.dirname(os.path.abspath(source))),
+            _folder_device(os.path.dirname(os.path.abspath(destination))),
+        )
+        if link_key in _unsupported_links:
+            link_mode = "copy"
+
+    # linked to a temporary name first, so that `destination` is replaced atomically
+    tmp_destination = f"{destination}.tmp"
+    if os.path.lexists(tmp_destination):
+        os.remove(tmp_destination)
+
+    try:
+        if link_mode == "hardlink":
+            os.link(source, tmp_destination)
+        elif link_mode == "reflink":
+            _reflink(source, tmp_destination)
+        elif link_mode == "symlink":
+            os.symlink(os.path.abspath(source), tmp_destination)
+        else:
+            shutil.copy(source, tmp_destination)
+    except OSError as e:
+        if link_mode == "copy":
+            raise
+        if e.errno in UNSUPPORTED_LINK_ERRNOS or fcntl is None:
+            _unsupported_links.add(link_key)
+        if os.path.lexists(tmp_destination):
+            os.remove(tmp_destination)
+        shutil.copy(source, tmp_destination)
+        link_mode = "copy"
+
+    os.replace(tmp_destination, destination)
+    return link_mode
+
+
+def _recompacted_marker(markers_dir, output_tiles_folder, summary_path, link_mode):
+    """Return the marker path of the slide of `summary_path` and its expected key.
+
+    The marker holds the key followed by the link modes actually used, e.g. 'copy' if
+    `link_mode` fell back to copies.
+
+    """
+    summary_path = os.path.abspath(summary_path)
+    output_tiles_folder = os.path.abspath(output_tiles_folder)
+    stat = os.stat(summary_path)
+    key = f"{output_tiles_folder}:{summary_path}"
+    key_hash = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    marker = Path(markers_dir) / key_hash
+    return marker, f"{key}:{stat.st_size}:{stat.st_mtime_ns}:{link_mode}"
+
+
+def recompact_slide(
+    tiles_dir,
+    filenames,
+    summary_path,
+    output_tiles_folder,
+    link_mode="reflink",
+    markers_dir=None,
+):
+    """
+    Link the tiles `filenames` of a slide from `tiles_dir` to `output_tiles_folder`.
+
+    If `markers_dir` is provided, when all the tiles are linked a marker keyed by the
+    output folder, the summary of the slide (path, size and modification time) and the
+    link mode is written in `markers_dir`, with the link modes actually used, so that
+    the slide is skipped by later runs as long as its linked tiles exist. `markers_dir` must be outside of
+    `output_tiles_folder`, which may be deleted as a whole (e.g. by Snakemake).
+
+    Parameters
+    ----------
+    tiles_dir : str or pathlib.Path
+        Folder containing the tiles of the slide
+    filenames : iterable of str
+        Names of the tiles to link
+    summary_path : str or pathlib.Path
+        Path of the valid tiles summary of the slide
+    output_tiles_folder : str or pathlib.Path
+        Folder where to link the tiles
+    link_mode : {hardlink, reflink, symlink, copy}
+        How to link the tiles (see `link_tile`). Default is reflink.
+    markers_dir : str or pathlib.Path, optional
+        Folder of the markers of the recompacted slides. Default is None, i.e. slides
+        are always recompacted.
+
+    Returns
+    -------
+    collections.Counter or None
+        Number of tiles linked with each link mode, e.g. {'copy': 10} if `link_mode`
+        fell back to copies. None if the slide was skipped, as already recompacted.
+
+    """
+    filenames = list(filenames)
+
+    if markers_dir is not None:
+        marker, marker_key = _recompacted_marker(
+            markers_dir, output_tiles_folder, summary_path, link_mode
+        )
+        if (
+            marker.exists()
+            and marker.read_text().rpartition(":")[0] == marker_key
+            and all(
+                os.path.lexists(Path(output_tiles_folder) / filename)
+                for filename in filenames
+            )
+        ):
+            return None
+
+    link_modes = Counter(
+        link_tile(
+            Path(tiles_dir) / filename, Path(output_tiles_folder) / filename, link_mode
+        )
+        for filename in filenames
+    )
+
+    if markers_dir is None:
+        return link_modes
+
+    marker.parent.mkdir(parents=True, exist_ok=True)
+    tmp_marker = marker.with_name(f"{marker.name}.tmp")
+    tmp_marker.write_text(f"{marker_key}:{'+'.join(sorted(link_modes))}\n")
+    os.replace(tmp_marker, marker)
+    return link_modes
+
+
+def recompact_shards(reader, filenames, writer, recompacted_names=frozenset()):
+    """
+    Copy the tiles `filenames` from the shards of `reader` to the shards of `writer`.
+
+    Encoded tiles are copied as they are, with their index record, without decoding them.
+    Tiles in `recompacted_names`, e.g. already in the destination shards from a previous
+    run, are skipped, so that reruns do not append duplicate records. As `reader` and
+    `writer` are thread safe, many slides can be copied concurrently with the same
+    reader and writer.
+
+    Parameters
+    ----------
+    reader : histo_lib.ShardReader
+        Reader of the source shards
+    filenames : iterable of str
+        Names of the tiles to copy
+    writer : histo_lib.ShardWriter
+        Writer of the destination shards
+    recompacted_names : set of str, optional
+        Names of the tiles to skip. Default is an empty set.
+
+    Returns
+    -------
+    int
+        Number of tiles copied
+
+    """
+    filenames = [
+        filename for filename in filenames if filename not in recompacted_names
+    ]
+    for filename in filenames:
+        record = reader.record(filename)
+        writer.append(
+            filename,
+            reader.read_bytes(filename),
+            record.slide_id,
+            record.level,
+            (record.x_ul, record.y_ul, record.x_br, record.y_br),
+            record.tissue_fraction,
+        )
+    return len(filenames)
+
 
 def main(
-    tiles_dirs, valid_tiles_summaries_path, output_tiles_folder, valid_tiles_csv_path,
+    tiles_dirs,
+    valid_tiles_summaries_path,
+    output_tiles_folder,
+    valid_tiles_csv_path,
+    shards=False,
+    link_mode="reflink",
+    n_workers=1,
+    markers_dir=None,
 ):
     output_tiles_folder.mkdir(parents=True, exist_ok=True)
 
-    summaries = []
-    for tile_dir, summary_path in tqdm(
-        zip(tiles_dirs, valid_tiles_summaries_path), total=len(tiles_dirs)
-    ):
-        summary = pd.read_csv(summary_path)
-        summaries.append(summary)
+    summaries = [
+        read_table(summary_path) for summary_path in valid_tiles_summaries_path
+    ]
 
-        for i, row in summary.iterrows():
-            filename = row["filename"]
-            shutil.copy(Path(tile_dir) / filename, output_tiles_folder / filename)
+    if shards:
+        # tiles already in the output shards, e.g. from a previous run
+        with ShardReader(output_tiles_folder) as recompacted:
+            recompacted_names = frozenset(recompacted.names)
+
+        with ExitStack() as stack:
+            # one reader per shards folder, which may be shared by many slides
+            readers = {
+                tiles_dir: stack.enter_context(ShardReader(tiles_dir))
+                for tiles_dir in set(map(str, tiles_dirs))
+            }
+            writer = stack.enter_context(ShardWriter(output_tiles_folder))
+            executor = stack.enter_context(ThreadPoolExecutor(n_workers))
+
+            recompact = partial(
+                recompact_shards, writer=writer, recompacted_names=recompacted_names
+            )
+            filenames = [summary["filename"].tolist() for summary in summaries]
+            n_copied = sum(
+                tqdm(
+                    executor.map(
+                        recompact,
+                        [readers[str(tiles_dir)] for tiles_dir in tiles_dirs],
+                        filenames,
+                    ),
+                    total=len(tiles_dirs),
+                )
+            )
+        n_tiles = sum(len(summary) for summary in summaries)
+        print(f"{n_tiles - n_copied} tiles already recompacted")
+    else:
+        recompact = partial(
+            recompact_slide,
+            output_tiles_folder=output_tiles_folder,
+            link_mode=link_mode,
+            markers_dir=markers_dir,
+        )
+        filenames = [summary["filename"].tolist() for summary in summaries]
+
+        with ThreadPoolExecutor(n_workers) as executor:
+            recompacted = list(
+                tqdm(
+                    executor.map(
+                        recompact, tiles_dirs, filenames, valid_tiles_summaries_path
+                    ),
+                    total=len(tiles_dirs),
+                )
+            )
+        print(
+            f"{sum(modes is None for modes in recompacted)} slides already recompacted"
+        )
+        link_modes = sum(filter(None, recompacted), Counter())
+        n_copies = sum(count for mode, count in link_modes.items() if mode != link_mode)
+        if n_copies:
+            print(
+                f"{n_copies} of {sum(link_modes.values())} tiles copied: "
+                f"{link_mode} is not supported between the tiles folders"
+            )
 
     valid_tiles_all = pd.concat(summaries, ignore_index=True)
-    valid_tiles_all.to_csv(valid_tiles_csv_path, index=False)
+    write_table(valid_tiles_all, valid_tiles_csv_path)
 
 
 if __name__ == "__main__":
@@ -47,6 +356,34 @@ if __name__ == "__main__":
         help="Path of the resulting CVS, "
         "as the concatenation of the tiles summaries provided",
     )
+    parser.add_argument(
+        "--shards",
+        action="store_true",
+        help="Tiles directories and output folder contain tiles shards, "
+        "instead of one file per tile",
+    )
+    parser.add_argument(
+        "--link_mode",
+        type=str,
+        default="reflink",
+        choices=LINK_MODES,
+        help="How to link the tiles to the output folder, "
+        "falling back to a copy when the link cannot be created. "
+        "With hardlink or symlink, the original tiles must never be rewritten",
+    )
+    parser.add_argument(
+        "--n_workers",
+        type=int,
+        default=1,
+        help="Number of slides recompacted in parallel",
+    )
+    parser.add_argument(
+        "--markers_dir",
+        type=str,
+        help="Folder of the markers of the recompacted slides, skipped by later runs. "
+        f"Must be outside of the output folder. By default '{RECOMPACTED_MARKERS_DIR}' "
+        "next to the resulting CSV",
+    )
 
     args = parser.parse_args()
 
@@ -54,6 +391,12 @@ if __name__ == "__main__":
     valid_tiles_summaries_path = args.valid_tiles_summaries_path
     output_tiles_folder = Path(args.output_tiles_folder)
     valid_tiles_csv_path = args.valid_tiles_csv_path
+    shards = args.shards
+    link_mode = args.link_mode
+    n_workers = args.n_workers
+    markers_dir = args.markers_dir or (
+        Path(valid_tiles_csv_path).parent / RECOMPACTED_MARKERS_DIR
+    )
 
     assert len(tiles_dirs) == len(
         valid_tiles_summaries_path
@@ -65,4 +408,8 @@ if __name__ == "__main__":
         valid_tiles_summaries_path,
         output_tiles_folder,
         valid_tiles_csv_path,
+        shards,
+        link_mode,
+        n_workers,
+        markers_dir,
     )
@@ -0,0 +1,62 @@
+import contextlib
+import io
+import json
+import shutil
+import tempfile
+import unittest
+
+import gin
+
+try:
+    from benchmarks.run_benchmarks import main
+except ImportError:  # synthetic slides are written with tifffile
+    main = None
+
+
+@unittest.skipIf(main is None, "tifffile is not installed")
+class RunBenchmarksTest(unittest.TestCase):
+    def test_runs_on_a_tiny_slide(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        output_filename = f"{tmp_dir}/results.json"
+        # the benchmarks bind the tile size of the checks: restored afterwards
+        for parameter in ("check_tile_size.tile_size", "check_tile_shape.tile_size"):
+            self.addCleanup(
+                gin.bind_parameter, parameter, gin.query_parameter(parameter)
+            )
+
+        report = io.StringIO()
+        with contextlib.redirect_stdout(report):
+            main(
+                output_filename,
+                width=1024,
+                height=768,
+                tissue_density=0.5,
+                tile_size=64,
+                n_tiles=4,
+                level=0,
+                repeats=1,
+                seed=7,
+            )
+
+        with open(output_filename) as output_file:
+            results = json.load(output_file)["results"]
+        names = [r["name"] for r in results]
+        self.assertIn("Tile.has_enough_tissue", names)
+        self.assertIn("RandomTiler.extract", names)
+        self.assertIn("recompact_slide(copy)", names)
+        for r in results:
+            with self.subTest(name=r["name"]):
+                self.assertGreater(r["n_tiles"], 0)
+                self.assertIsNotNone(r["tiles_per_s"])
+
+        # no bytes are measured for the tissue detection
+        tissue_box = results[names.index("WSI.tissue_box_coords_wsi")]
+        self.assertIsNone(tissue_box["mb_per_s"])
+        self.assertRegex(
+            report.getvalue(), r"WSI\.tissue_box_coords_wsi .* tiles/s +- MiB/s"
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,242 @@
+import importlib
+import io
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import zlib
+from unittest import mock
+
+import gin
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from histo_lib import ShardWriter
+from preprocessing.check_tiles import (
+    check_shard_tiles,
+    check_tile,
+    check_tiles,
+    read_manifest,
+    save_csv,
+)
+
+# the module, shadowed in preprocessing by its check_tiles function
+check_tiles_module = importlib.import_module("preprocessing.check_tiles")
+
+# tile size of preprocessing/preprocessing_config.gin
+TILE_SIZE = 512
+
+
+def _encoded_tile(image_format, size=TILE_SIZE):
+    tile = np.random.RandomState(7).randint(0, 256, (size, size, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(tile).save(buffer, image_format)
+    buffer.seek(0)
+    return buffer
+
+
+def _encoded_png(mode, size=TILE_SIZE):
+    tile = np.random.RandomState(7).randint(0, 4, (size, size), dtype=np.uint8)
+    image = Image.fromarray(tile, "L")
+    if mode == "P":
+        image = image.convert("P")
+        image.putpalette([0, 0, 0, 255, 0, 0, 0, 255, 0, 0, 0, 255])
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    buffer.seek(0)
+    return buffer
+
+
+def _png_rgb_16_bits(size=TILE_SIZE):
+    """Return a 16 bits per channel RGB PNG, which PIL cannot write."""
+
+    def chunk(chunk_type, data):
+        return (
+            struct.pack(">I", len(data))
+            + chunk_type
+            + data
+            + struct.pack(">I", zlib.crc32(chunk_type + data))
+        )
+
+    header = struct.pack(">IIBBBBB", size, size, 16, 2, 0, 0, 0)
+    rows = b"".join(b"\x00" + bytes(size * 6) for _ in range(size))
+    return io.BytesIO(
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", header)
+        + chunk(b"IDAT", zlib.compress(rows))
+        + chunk(b"IEND", b"")
+    )
+
+
+class CheckTileHeaderTest(unittest.TestCase):
+    def test_accepts_8_bits_tiles_of_any_format(self):
+        for image_format in ("PNG", "JPEG", "TIFF"):
+            with self.subTest(image_format=image_format):
+                self.assertTrue(
+                    check_tile(_encoded_tile(image_format), header_only=True)
+                )
+                self.assertTrue(check_tile(_encoded_tile(image_format)))
+
+    def test_accepts_grayscale_and_palette_tiles(self):
+        # a 4 colors palette PNG is stored with 2 bits per pixel
+        for mode in ("L", "P"):
+            with self.subTest(mode=mode):
+                self.assertTrue(check_tile(_encoded_png(mode), header_only=True))
+                self.assertTrue(check_tile(_encoded_png(mode)))
+
+    def test_rejects_wrong_size(self):
+        self.assertFalse(check_tile(_encoded_tile("JPEG", 256), header_only=True))
+
+    def test_rejects_16_bits_png(self):
+        self.assertFalse(check_tile(_png_rgb_16_bits(), header_only=True))
+        self.assertFalse(check_tile(_png_rgb_16_bits()))
+
+
+class CheckShardTilesTest(unittest.TestCase):
+    def setUp(self):
+        self.shards_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.shards_dir)
+
+        # two slides sharing the shards, with a tile of the wrong size each
+        with ShardWriter(self.shards_dir) as writer:
+            for slide_id in ("slide_a", "slide_b"):
+                for i, size in enumerate((TILE_SIZE, TILE_SIZE, 256)):
+                    writer.append(
+                        f"{slide_id}_tile_{i}.png",
+                        _encoded_tile("PNG", size).getvalue(),
+                        slide_id,
+                        0,
+                        (0, 0, size, size),
+                    )
+
+    def test_checks_the_tiles_of_the_slide_only(self):
+        for n_workers in (1, 2):
+            with self.subTest(n_workers=n_workers):
+                self.assertEqual(
+                    check_shard_tiles(
+                        self.shards_dir,
+                        "slide_b",
+                        header_only=True,
+                        n_workers=n_workers,
+                    ),
+                    ["slide_b_tile_0.png", "slide_b_tile_1.png"],
+                )
+
+    def test_checks_every_tile_without_slide(self):
+        self.assertEqual(
+            check_shard_tiles(self.shards_dir),
+            [
+                f"{slide_id}_tile_{i}.png"
+                for slide_id in ("slide_a", "slide_b")
+                for i in (0, 1)
+            ],
+        )
+
+
+class CheckTilesManifestTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.tiles_dir = os.path.join(self.root, "tiles")
+        os.mkdir(self.tiles_dir)
+        self.manifest_filename = os.path.join(self.root, "manifest.tsv")
+
+        self.tile_filenames = []
+        for i in range(3):
+            tile_filename = os.path.join(self.tiles_dir, f"tile_{i}.png")
+            with open(tile_filename, "wb") as tile_file:
+                tile_file.write(_encoded_tile("PNG").getvalue())
+            self.tile_filenames.append(tile_filename)
+
+        checks = mock.patch.object(
+            check_tiles_module,
+            "_tile_failure_reason",
+            wraps=check_tiles_module._tile_failure_reason,
+        )
+        self.checks = checks.start()
+        self.addCleanup(checks.stop)
+
+    def _n_checked(self, tile_filenames=None):
+        self.checks.reset_mock()
+        check_tiles(
+            self.tile_filenames if tile_filenames is None else tile_filenames,
+            manifest_filename=self.manifest_filename,
+        )
+        return self.checks.call_count
+
+    def test_rerun_skips_unchanged_tiles(self):
+        self.assertEqual(self._n_checked(), 3)
+        self.assertEqual(self._n_checked(), 0)
+
+    def test_rechecks_modified_tiles(self):
+        self._n_checked()
+
+        # another size
+        with open(self.tile_filenames[0], "wb") as tile_file:
+            tile_file.write(_encoded_tile("PNG", 256).getvalue())
+        # the same size, another modification time
+        stat = os.stat(self.tile_filenames[1])
+        os.utime(
+            self.tile_filenames[1], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9)
+        )
+
+        self.assertEqual(self._n_checked(), 2)
+        self.assertEqual(self._n_checked(), 0)
+        self.assertFalse(
+            read_manifest(self.manifest_filename)[
+                os.path.join("tiles", "tile_0.png")
+            ].valid
+        )
+
+    def test_rechecks_every_tile_with_another_tile_size(self):
+        self._n_checked()
+
+        tile_size = gin.query_parameter("check_tile_shape.tile_size")
+        self.addCleanup(gin.bind_parameter, "check_tile_shape.tile_size", tile_size)
+        gin.bind_parameter("check_tile_shape.tile_size", 256)
+
+        self.assertEqual(self._n_checked(), 3)
+        self.assertEqual(self._n_checked(), 0)
+
+    def test_removes_the_tiles_no_longer_present(self):
+        other_tile = os.path.join(self.root, "other_tile.png")
+        with open(other_tile, "wb") as tile_file:
+            tile_file.write(_encoded_tile("PNG").getvalue())
+        self._n_checked(self.tile_filenames + [other_tile])
+
+        # a tile extracted again under another name
+        renamed_tile = os.path.join(self.tiles_dir, "tile_renamed.png")
+        os.rename(self.tile_filenames[0], renamed_tile)
+        tile_filenames = [renamed_tile] + self.tile_filenames[1:]
+
+        self.assertEqual(self._n_checked(tile_filenames), 1)
+        self.assertEqual(
+            sorted(read_manifest(self.manifest_filename)),
+            sorted(
+                [os.path.join("tiles", "tile_renamed.png"), "other_tile.png"]
+                + [os.path.join("tiles", f"tile_{i}.png") for i in (1, 2)]
+            ),
+        )
+        # and no temporary file is left
+        self.assertEqual(
+            sorted(os.listdir(self.root)), ["manifest.tsv", "other_tile.png", "tiles"]
+        )
+
+
+class SaveCsvTest(unittest.TestCase):
+    def test_unknown_extensions_are_written_as_csv(self):
+        tables_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tables_dir)
+        data = {"filename": ["tile_0.png", "tile_1.png"], "valid": [True, False]}
+
+        for filename in ("summary.csv", "summary.tsv", "summary.txt", "summary"):
+            with self.subTest(filename=filename):
+                path = os.path.join(tables_dir, filename)
+                save_csv(data, path)
+                pd.testing.assert_frame_equal(pd.read_csv(path), pd.DataFrame(data))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from preprocessing.labels import encode_label, encode_labels
+
+
+class EncodeLabelsTest(unittest.TestCase):
+    def setUp(self):
+        self.dataframe = pd.DataFrame(
+            {
+                "filename": ["a.png", "b.png", "c.png", "d.png"],
+                "subtype": ["LumA", "Basal", "LumA", "Her2"],
+                "stage": ["I", "II", "II", "I"],
+            }
+        )
+
+    def test_encodes_values_in_order_of_appearance(self):
+        encoded, reversed_dicts = encode_labels(self.dataframe, ["subtype", "stage"])
+
+        np.testing.assert_array_equal(encoded["subtype_encoded"], [0, 1, 0, 2])
+        np.testing.assert_array_equal(encoded["stage_encoded"], [0, 1, 1, 0])
+        self.assertEqual(
+            reversed_dicts,
+            {"subtype": {0: "LumA", 1: "Basal", 2: "Her2"}, "stage": {0: "I", 1: "II"}},
+        )
+
+    def test_encodes_with_dictionary(self):
+        encoding_dictionary = {"Basal": 10, "Her2": 20, "LumA": 30}
+        encoded, reversed_dict = encode_label(
+            self.dataframe, "subtype", "label", encoding_dictionary
+        )
+
+        np.testing.assert_array_equal(encoded["label"], [30, 10, 30, 20])
+        self.assertEqual(reversed_dict, {10: "Basal", 20: "Her2", 30: "LumA"})
+
+    def test_label_columns_are_categorical(self):
+        dtype = self.dataframe["subtype"].dtype
+        encoded, _ = encode_labels(self.dataframe, ["subtype"])
+
+        self.assertEqual(encoded["subtype"].dtype.name, "category")
+        self.assertEqual(
+            encoded["subtype"].tolist(), self.dataframe["subtype"].tolist()
+        )
+        # the table of the caller is unchanged
+        self.assertEqual(self.dataframe["subtype"].dtype, dtype)
+
+        encoded, _ = encode_labels(self.dataframe, ["subtype"], categorical=False)
+        self.assertEqual(encoded["subtype"].dtype, dtype)
+
+    def test_missing_key_raises(self):
+        with self.assertRaisesRegex(ValueError, "missing some keys: Her2"):
+            encode_label(self.dataframe, "subtype", "label", {"LumA": 0, "Basal": 1})
+
+    def test_missing_column_raises(self):
+        with self.assertRaises(ValueError):
+            encode_labels(self.dataframe, ["grade"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from histo_lib.pipeline import batched, ordered_map
+
+
+def _slow_square(item):
+    # later items finish first
+    time.sleep(0.01 * (5 - item % 5))
+    return item * item
+
+
+class OrderedMapTest(unittest.TestCase):
+    def test_yields_results_in_order(self):
+        with ThreadPoolExecutor(4) as executor:
+            results = list(ordered_map(_slow_square, range(20), executor, 8))
+
+        self.assertEqual(results, [item * item for item in range(20)])
+
+    def test_keeps_at_most_max_pending_items_submitted(self):
+        pulled = []
+
+        def items():
+            for item in range(100):
+                pulled.append(item)
+                yield item
+
+        with ThreadPoolExecutor(2) as executor:
+            results = ordered_map(_slow_square, items(), executor, 3)
+            next(results)
+            # one consumed, three pending
+            self.assertEqual(len(pulled), 4)
+            results.close()
+
+    def test_close_cancels_the_tasks_not_started(self):
+        started = []
+        release = threading.Event()
+
+        def wait(item):
+            started.append(item)
+            if item:
+                release.wait()
+            return item
+
+        with ThreadPoolExecutor(1) as executor:
+            results = ordered_map(wait, range(10), executor, 5)
+            self.assertEqual(next(results), 0)
+            results.close()
+            release.set()
+
+        # at most the task running when closing was not cancelled
+        self.assertLessEqual(set(started), {0, 1})
+
+    def test_empty_iterable(self):
+        with ThreadPoolExecutor(2) as executor:
+            self.assertEqual(list(ordered_map(_slow_square, [], executor, 4)), [])
+
+
+class BatchedTest(unittest.TestCase):
+    def test_splits_in_order(self):
+        self.assertEqual(list(batched(range(7), 3)), [[0, 1, 2], [3, 4, 5], [6]])
+        self.assertEqual(list(batched([], 3)), [])
+
+    def test_is_lazy(self):
+        pulled = []
+
+        def items():
+            for item in range(10):
+                pulled.append(item)
+                yield item
+
+        batches = batched(items(), 4)
+        self.assertEqual(next(batches), [0, 1, 2, 3])
+        self.assertEqual(pulled, [0, 1, 2, 3])
+        batches.close()
+        self.assertEqual(pulled, [0, 1, 2, 3])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,196 @@
+import contextlib
+import errno
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import recompact_valid_tiles
+from histo_lib import ShardReader, ShardWriter
+from preprocessing.tables import write_table
+from recompact_valid_tiles import link_tile, main, recompact_slide
+
+
+class RecompactTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.root)
+        self.addCleanup(recompact_valid_tiles._unsupported_links.clear)
+        self.tiles_dir = self.root / "slide" / "tiles"
+        self.tiles_dir.mkdir(parents=True)
+        self.output_dir = self.root / "tiles"
+        self.output_dir.mkdir()
+        self.markers_dir = self.root / "markers"
+
+
+class LinkTileTest(RecompactTestCase):
+    def test_falls_back_to_copies_once_per_file_systems(self):
+        for i in range(3):
+            (self.tiles_dir / f"tile_{i}.png").write_bytes(bytes([i]) * 10)
+
+        cross_device = OSError(errno.EXDEV, "Invalid cross-device link")
+        with mock.patch.object(os, "link", side_effect=cross_device) as link:
+            link_modes = [
+                link_tile(
+                    self.tiles_dir / f"tile_{i}.png",
+                    self.output_dir / f"tile_{i}.png",
+                    "hardlink",
+                )
+                for i in range(3)
+            ]
+
+        self.assertEqual(link_modes, ["copy"] * 3)
+        # the later tiles are copied without trying to link them
+        self.assertEqual(link.call_count, 1)
+        for i in range(3):
+            self.assertEqual(
+                (self.output_dir / f"tile_{i}.png").read_bytes(), bytes([i]) * 10
+            )
+        self.assertFalse(list(self.output_dir.glob("*.tmp")))
+
+    def test_hardlink(self):
+        source = self.tiles_dir / "tile.png"
+        source.write_bytes(b"tile")
+
+        self.assertEqual(
+            link_tile(source, self.output_dir / "tile.png", "hardlink"), "hardlink"
+        )
+        self.assertTrue(os.path.samefile(source, self.output_dir / "tile.png"))
+
+
+class RecompactSlideTest(RecompactTestCase):
+    def setUp(self):
+        super().setUp()
+        self.filenames = [f"tile_{i}.png" for i in range(3)]
+        for filename in self.filenames:
+            (self.tiles_dir / filename).write_bytes(filename.encode())
+        self.summary_path = self.root / "slide" / "valid_tiles.csv"
+        write_table({"filename": self.filenames}, self.summary_path)
+
+    def _recompact(self, link_mode="hardlink"):
+        return recompact_slide(
+            self.tiles_dir,
+            self.filenames,
+            self.summary_path,
+            self.output_dir,
+            link_mode,
+            self.markers_dir,
+        )
+
+    def _marker_link_modes(self):
+        (marker,) = self.markers_dir.iterdir()
+        return marker.read_text().strip().rpartition(":")[2]
+
+    def test_skips_recompacted_slides(self):
+        self.assertEqual(self._recompact(), {"hardlink": 3})
+        self.assertEqual(self._marker_link_modes(), "hardlink")
+
+        self.assertIsNone(self._recompact())
+
+    def test_recompacts_again_when_invalidated(self):
+        self._recompact()
+
+        # a tile removed from the output
+        (self.output_dir / "tile_1.png").unlink()
+        self.assertEqual(self._recompact(), {"hardlink": 3})
+        self.assertTrue((self.output_dir / "tile_1.png").exists())
+
+        # a summary changed
+        stat = os.stat(self.summary_path)
+        os.utime(self.summary_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertEqual(self._recompact(), {"hardlink": 3})
+        self.assertIsNone(self._recompact())
+
+        # another link mode
+        self.assertEqual(self._recompact("copy"), {"copy": 3})
+        self.assertIsNone(self._recompact("copy"))
+
+    def test_marker_records_the_fallback_copies(self):
+        cross_device = OSError(errno.EXDEV, "Invalid cross-device link")
+        with mock.patch.object(os, "link", side_effect=cross_device):
+            self.assertEqual(self._recompact(), {"copy": 3})
+        self.assertEqual(self._marker_link_modes(), "copy")
+
+        # the fallback is not a reason to recompact the slide again
+        self.assertIsNone(self._recompact())
+
+    def test_main_reports_the_fallback_copies(self):
+        output = io.StringIO()
+        cross_device = OSError(errno.EXDEV, "Invalid cross-device link")
+        with mock.patch.object(os, "link", side_effect=cross_device):
+            with contextlib.redirect_stdout(output), contextlib.redirect_stderr(
+                io.StringIO()
+            ):
+                main(
+                    [self.tiles_dir],
+                    [self.summary_path],
+                    self.output_dir,
+                    self.root / "valid_tiles.csv",
+                    link_mode="hardlink",
+                    markers_dir=self.markers_dir,
+                )
+
+        self.assertIn("3 of 3 tiles copied", output.getvalue())
+
+
+class RecompactShardsTest(RecompactTestCase):
+    def _write_slide(self, writer, slide_id, n_tiles):
+        filenames = [f"{slide_id}_tile_{i}.png" for i in range(n_tiles)]
+        for i, filename in enumerate(filenames):
+            writer.append(filename, filename.encode(), slide_id, 0, (i, 0, i + 1, 1))
+        summary_path = self.root / f"{slide_id}.csv"
+        write_table({"filename": filenames}, summary_path)
+        return summary_path
+
+    def test_copies_the_valid_tiles_once(self):
+        # two slides sharing a shards folder
+        with ShardWriter(self.tiles_dir) as writer:
+            summaries = [
+                self._write_slide(writer, "slide_0", 3),
+                self._write_slide(writer, "slide_1", 2),
+            ]
+            writer.append("invalid_tile.png", b"invalid", "slide_1", 0, (0, 0, 1, 1))
+
+        shard_readers = []
+
+        class CountingReader(ShardReader):
+            def __init__(self, root):
+                super().__init__(root)
+                shard_readers.append(root)
+
+        with mock.patch.object(recompact_valid_tiles, "ShardReader", CountingReader):
+            for _ in range(2):  # a rerun appends nothing
+                with contextlib.redirect_stdout(
+                    io.StringIO()
+                ), contextlib.redirect_stderr(io.StringIO()):
+                    main(
+                        [self.tiles_dir] * 2,
+                        summaries,
+                        self.output_dir,
+                        self.root / "valid_tiles.csv",
+                        shards=True,
+                        n_workers=2,
+                    )
+
+        # per run, one reader of the output and one of the shared source folder
+        self.assertEqual(len(shard_readers), 4)
+        with ShardReader(self.output_dir) as reader:
+            self.assertEqual(
+                sorted(reader.names),
+                sorted(
+                    [f"slide_0_tile_{i}.png" for i in range(3)]
+                    + [f"slide_1_tile_{i}.png" for i in range(2)]
+                ),
+            )
+            self.assertEqual(len(list(reader.records())), 5)
+            self.assertEqual(reader.record("slide_1_tile_1.png").slide_id, "slide_1")
+            self.assertEqual(
+                reader.read_bytes("slide_0_tile_2.png"), b"slide_0_tile_2.png"
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
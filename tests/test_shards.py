@@ -0,0 +1,135 @@
+import io
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from PIL import Image
+
+from histo_lib.shards import ShardReader, ShardWriter
+
+
+def _png(value):
+    buffer = io.BytesIO()
+    Image.fromarray(np.full((8, 8, 3), value, dtype=np.uint8)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+class ShardRoundTripTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def test_reads_the_written_tiles(self):
+        with ShardWriter(self.root) as writer:
+            for i in range(5):
+                writer.append(
+                    f"tile_{i}.png", _png(i), "slide", 1, (i, 0, i + 8, 8), 0.5
+                )
+
+        with ShardReader(self.root) as reader:
+            self.assertEqual(len(reader), 5)
+            self.assertEqual(reader.names, [f"tile_{i}.png" for i in range(5)])
+            for i in range(5):
+                record = reader.record(f"tile_{i}.png")
+                self.assertEqual(record.slide_id, "slide")
+                self.assertEqual(record.level, 1)
+                self.assertEqual(
+                    (record.x_ul, record.y_ul, record.x_br, record.y_br),
+                    (i, 0, i + 8, 8),
+                )
+                self.assertEqual(record.tissue_fraction, 0.5)
+                self.assertEqual(reader.read_bytes(f"tile_{i}.png"), _png(i))
+                np.testing.assert_array_equal(
+                    np.asarray(reader.read_image(f"tile_{i}.png")),
+                    np.full((8, 8, 3), i, dtype=np.uint8),
+                )
+            self.assertNotIn("tile_5.png", reader)
+            with self.assertRaises(KeyError):
+                reader.read_bytes("tile_5.png")
+
+    def test_rolls_over_to_a_new_shard(self):
+        data = [bytes([i]) * 40 for i in range(5)]
+        with ShardWriter(self.root, max_shard_size=100) as writer:
+            for i, tile_data in enumerate(data):
+                writer.append(f"tile_{i}.png", tile_data, "slide", 0, (0, 0, 1, 1))
+
+        # two tiles of 40 bytes per shard of at most 100 bytes
+        self.assertEqual(len(writer.shards), 3)
+        with ShardReader(self.root) as reader:
+            self.assertEqual(
+                [reader.record(f"tile_{i}.png").shard for i in range(5)],
+                [writer.shards[i // 2] for i in range(5)],
+            )
+            for i, tile_data in enumerate(data):
+                self.assertEqual(reader.read_bytes(f"tile_{i}.png"), tile_data)
+
+    def test_appending_a_slide_keeps_the_existing_shards(self):
+        with ShardWriter(self.root) as writer:
+            writer.append("slide_0_tile.png", b"slide 0", "slide_0", 0, (0, 0, 1, 1))
+        first_shard = writer.shards[0]
+        first_shard_data = first_shard.read_bytes()
+
+        with ShardWriter(self.root) as writer:
+            writer.append("slide_1_tile.png", b"slide 1", "slide_1", 0, (0, 0, 1, 1))
+
+        self.assertNotEqual(writer.shards[0], first_shard)
+        self.assertEqual(first_shard.read_bytes(), first_shard_data)
+        with ShardReader(self.root) as reader:
+            self.assertEqual(reader.read_bytes("slide_0_tile.png"), b"slide 0")
+            self.assertEqual(reader.read_bytes("slide_1_tile.png"), b"slide 1")
+            self.assertEqual(
+                sorted(record.slide_id for record in reader.records()),
+                ["slide_0", "slide_1"],
+            )
+
+
+class ShardReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def _write_tiles(self, n_tiles):
+        with ShardWriter(self.root) as writer:
+            for i in range(n_tiles):
+                writer.append(
+                    f"tile_{i}.png", bytes([i]) * 100, "slide", 0, (i, 0, i, 0)
+                )
+        return writer.shards[0]
+
+    def test_skips_torn_index_row(self):
+        shard = self._write_tiles(3)
+        index_path = shard.with_suffix(".idx")
+        index_text = index_path.read_text()
+        last_row_start = index_text.rstrip("\r\n").rfind("\n") + 1
+
+        # cut the last row in the middle of its fields and in the middle of its length
+        for cut in (last_row_start + 15, len(index_text.rstrip("\r\n")) - 1):
+            with self.subTest(cut=cut):
+                index_path.write_text(index_text[:cut])
+                with ShardReader(self.root) as reader:
+                    self.assertEqual(reader.names, ["tile_0.png", "tile_1.png"])
+                    self.assertEqual(reader.read_bytes("tile_1.png"), bytes([1]) * 100)
+
+    def test_skips_rows_past_the_data(self):
+        shard = self._write_tiles(3)
+        with open(shard, "r+b") as data_file:
+            data_file.truncate(250)
+
+        with ShardReader(self.root) as reader:
+            self.assertEqual(reader.names, ["tile_0.png", "tile_1.png"])
+
+    def test_skips_rows_that_do_not_parse(self):
+        shard = self._write_tiles(2)
+        index_path = shard.with_suffix(".idx")
+        index_path.write_text(
+            index_path.read_text()
+            + "tile_2.png\tslide\tzero\t0\t0\t0\t0\tnan\t0\t1\r\n"
+        )
+
+        with ShardReader(self.root) as reader:
+            self.assertEqual(reader.names, ["tile_0.png", "tile_1.png"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+import preprocessing_split_pw
+from preprocessing.split import k_fold_patient_wise, train_test_df_patient_wise
+
+
+def _dataset():
+    rng = np.random.RandomState(0)
+    patients = [f"patient_{i}" for i in range(40)]
+    labels = dict(zip(patients, rng.choice(["LumA", "Basal", "Her2"], 40)))
+    # several tiles per patient, shuffled
+    rows = rng.choice(patients, 400)
+    return pd.DataFrame(
+        {
+            "filename": [f"tile_{i}.png" for i in range(400)],
+            "patient": rows,
+            "subtype": [labels[patient] for patient in rows],
+        }
+    )
+
+
+class TrainTestPatientWiseTest(unittest.TestCase):
+    def setUp(self):
+        self.dataset = _dataset()
+
+    def test_mapping_matches_the_splits(self):
+        for stratify in (True, False):
+            with self.subTest(stratify=stratify):
+                train_df, test_df, split_mapping = train_test_df_patient_wise(
+                    self.dataset,
+                    "patient",
+                    "subtype",
+                    stratify=stratify,
+                    return_mapping=True,
+                )
+
+                # one split per patient
+                self.assertTrue(split_mapping.index.is_unique)
+                self.assertEqual(set(split_mapping.index), set(self.dataset["patient"]))
+                self.assertEqual((split_mapping == "test").sum(), 8)
+
+                tiles_split = self.dataset["patient"].map(split_mapping)
+                pd.testing.assert_frame_equal(
+                    train_df, self.dataset.loc[tiles_split == "train"]
+                )
+                pd.testing.assert_frame_equal(
+                    test_df, self.dataset.loc[tiles_split == "test"]
+                )
+
+    def test_same_splits_without_mapping(self):
+        train_df, test_df = train_test_df_patient_wise(
+            self.dataset, "patient", "subtype"
+        )
+        mapped_train_df, mapped_test_df, _ = train_test_df_patient_wise(
+            self.dataset, "patient", "subtype", return_mapping=True
+        )
+
+        pd.testing.assert_frame_equal(train_df, mapped_train_df)
+        pd.testing.assert_frame_equal(test_df, mapped_test_df)
+
+
+class SplitPatientWiseMainTest(unittest.TestCase):
+    def setUp(self):
+        self.tables_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tables_dir)
+        self.labels_file = os.path.join(self.tables_dir, "labels.csv")
+        self.splitted_labels_file = os.path.join(self.tables_dir, "splitted.csv")
+
+    def test_assigns_the_split_of_each_patient(self):
+        dataset = _dataset()
+        dataset.to_csv(self.labels_file, index=False)
+
+        preprocessing_split_pw.main(
+            self.labels_file, self.splitted_labels_file, ["subtype"], stratify=True
+        )
+
+        splitted = pd.read_csv(self.splitted_labels_file)
+        _, _, split_mapping = train_test_df_patient_wise(
+            dataset, "patient", ["subtype"], return_mapping=True
+        )
+        self.assertEqual(
+            splitted["split"].tolist(),
+            dataset["patient"].map(split_mapping).tolist(),
+        )
+        # the tiles of a patient are all in the same split
+        self.assertTrue((splitted.groupby("patient")["split"].nunique() == 1).all())
+
+    def test_rows_without_patient_are_test_rows(self):
+        dataset = _dataset()
+        dataset.loc[:9, "patient"] = np.nan
+        dataset.to_csv(self.labels_file, index=False)
+
+        preprocessing_split_pw.main(
+            self.labels_file, self.splitted_labels_file, ["subtype"], stratify=False
+        )
+
+        splitted = pd.read_csv(self.splitted_labels_file)
+        self.assertEqual(len(splitted), 400)
+        self.assertEqual(set(splitted["split"]), {"train", "test"})
+        self.assertTrue((splitted.loc[:9, "split"] == "test").all())
+
+
+class KFoldPatientWiseTest(unittest.TestCase):
+    def setUp(self):
+        self.dataset = _dataset()
+
+    def _check_folds(self, folds, n_splits):
+        # one fold per patient
+        self.assertTrue(folds.index.is_unique)
+        self.assertEqual(set(folds.index), set(self.dataset["patient"]))
+        self.assertEqual(set(folds["fold"]), set(range(n_splits)))
+
+        # the tiles of the folds partition the dataset, and no patient is in two folds
+        tiles_fold = self.dataset["patient"].map(folds["fold"])
+        patients_by_fold = [
+            set(self.dataset.loc[tiles_fold == k, "patient"]) for k in range(n_splits)
+        ]
+        self.assertEqual(sum(len(patients) for patients in patients_by_fold), 40)
+        self.assertEqual(sum((tiles_fold == k).sum() for k in range(n_splits)), 400)
+
+    def test_never_splits_a_patient(self):
+        for stratify in (True, False):
+            with self.subTest(stratify=stratify):
+                folds = k_fold_patient_wise(
+                    self.dataset, "patient", "subtype", n_splits=5, stratify=stratify
+                )
+                self._check_folds(folds, 5)
+
+    def test_same_seed_same_folds(self):
+        folds = k_fold_patient_wise(self.dataset, "patient", "subtype", seed=3)
+        pd.testing.assert_frame_equal(
+            folds, k_fold_patient_wise(self.dataset, "patient", "subtype", seed=3)
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
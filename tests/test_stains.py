@@ -0,0 +1,219 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from histo_lib import WSI, stains
+from histo_lib.stains import (
+    MacenkoNormalizer,
+    ReinhardNormalizer,
+    sample_tissue_pixels,
+    slide_stain_colors,
+)
+
+try:
+    from benchmarks.synthetic_slide import TISSUE_COLOR, synthetic_slide
+except ImportError:  # synthetic slides are written with tifffile
+    synthetic_slide = None
+
+# optical density of hematoxylin and eosin, the reference of Macenko et al.
+STAINS = np.array([[0.5626, 0.7201, 0.4062], [0.2159, 0.8012, 0.5581]])
+STAINS /= np.linalg.norm(STAINS, axis=1, keepdims=True)
+
+
+def _stained_images(stains, max_concentrations, seed):
+    """Return (4, 32, 32, 3) uint8 images of tissue stained by `stains`."""
+    rng = np.random.RandomState(seed)
+    # mostly one stain per pixel, so that both stain vectors can be estimated
+    concentrations = rng.uniform(0.05, 1, (4 * 32 * 32, 2))
+    concentrations[
+        np.arange(len(concentrations)), rng.randint(2, size=4 * 32 * 32)
+    ] *= 0.1
+    concentrations *= max_concentrations
+    densities = concentrations @ stains
+    pixels = np.clip(np.rint(256 * np.exp(-densities) - 1), 0, 255)
+    return pixels.astype(np.uint8).reshape(4, 32, 32, 3)
+
+
+class StainNormalizerTest(unittest.TestCase):
+    def setUp(self):
+        self.target = _stained_images(STAINS, [1.0, 0.6], seed=0)
+        # a lighter and differently stained source
+        source_stains = STAINS + [[0.1, -0.1, 0.1], [0.1, 0.0, -0.05]]
+        source_stains /= np.linalg.norm(source_stains, axis=1, keepdims=True)
+        self.source = _stained_images(source_stains, [0.5, 0.4], seed=1)
+
+    def _check_round_trip(self, normalizer_class):
+        normalizer = normalizer_class().fit(self.target)
+
+        # the reference is (almost) unchanged by its own statistics
+        normalized = normalizer.normalize(self.target)
+        self.assertEqual(normalized.dtype, np.uint8)
+        self.assertEqual(normalized.shape, self.target.shape)
+        error = np.abs(normalized.astype(int) - self.target)
+        self.assertLess(error.mean(), 2)
+
+        # another source gets the statistics of the reference
+        normalized = normalizer.normalize(self.source)
+        self.assertEqual(normalized.shape, self.source.shape)
+        target_mean = self.target.reshape(-1, 3).mean(axis=0)
+        before = np.abs(self.source.reshape(-1, 3).mean(axis=0) - target_mean)
+        after = np.abs(normalized.reshape(-1, 3).mean(axis=0) - target_mean)
+        self.assertLess(after.max(), before.max() / 4)
+
+        return normalizer
+
+    def test_reinhard_round_trip(self):
+        normalizer = self._check_round_trip(ReinhardNormalizer)
+
+        refitted = ReinhardNormalizer().fit(normalizer.normalize(self.source))
+        np.testing.assert_allclose(
+            refitted.target["mean"], normalizer.target["mean"], atol=0.02
+        )
+        np.testing.assert_allclose(
+            refitted.target["std"], normalizer.target["std"], atol=0.02
+        )
+
+    def test_macenko_round_trip(self):
+        normalizer = self._check_round_trip(MacenkoNormalizer)
+
+        # the stain vectors of the reference are recovered
+        stain_matrix = normalizer.target["stain_matrix"]
+        stain_matrix = stain_matrix / np.linalg.norm(stain_matrix, axis=0)
+        np.testing.assert_allclose(stain_matrix.T, STAINS, atol=0.05)
+
+    def test_save_and_load(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        filename = os.path.join(tmp_dir, "target.npz")
+
+        for normalizer_class in (ReinhardNormalizer, MacenkoNormalizer):
+            with self.subTest(normalizer=normalizer_class.__name__):
+                normalizer = normalizer_class().fit(self.target)
+                normalizer.save(filename)
+                loaded = normalizer_class().load(filename)
+
+                self.assertEqual(loaded.target.keys(), normalizer.target.keys())
+                np.testing.assert_array_equal(
+                    loaded.normalize(self.source), normalizer.normalize(self.source)
+                )
+                self.assertEqual(os.listdir(tmp_dir), ["target.npz"])
+
+
+@unittest.skipIf(synthetic_slide is None, "tifffile is not installed")
+class SlideStainColorsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.slide_dir = tempfile.mkdtemp()
+        cls.slide_filename = f"{cls.slide_dir}/slide.tiff"
+        synthetic_slide(cls.slide_filename, width=1024, height=768, n_levels=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.slide_dir)
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.params = dict(n_pixels=1000, tile_size=64, n_tiles=8)
+
+    def _count_samplings(self):
+        sampling = mock.patch.object(
+            stains, "sample_tissue_pixels", wraps=stains.sample_tissue_pixels
+        )
+        self.addCleanup(sampling.stop)
+        return sampling.start()
+
+    def test_samples_tissue_pixels(self):
+        wsi = WSI(self.slide_filename)
+        np.random.seed(0)
+        global_state = np.random.get_state()[1].copy()
+
+        pixels = sample_tissue_pixels(wsi, **self.params)
+
+        self.assertEqual(pixels.shape, (1000, 3))
+        self.assertEqual(pixels.dtype, np.uint8)
+        # tissue pixels, not background ones
+        self.assertLess(np.abs(pixels.mean(axis=0) - TISSUE_COLOR).max(), 60)
+        # the global random state of the caller is kept
+        np.testing.assert_array_equal(np.random.get_state()[1], global_state)
+
+    def test_same_seed_same_pixels_and_colors(self):
+        wsi = WSI(self.slide_filename)
+        other_wsi = WSI(self.slide_filename)
+
+        pixels = sample_tissue_pixels(wsi, seed=3, **self.params)
+        np.testing.assert_array_equal(
+            sample_tissue_pixels(other_wsi, seed=3, **self.params), pixels
+        )
+        self.assertFalse(
+            np.array_equal(
+                sample_tissue_pixels(other_wsi, seed=4, **self.params), pixels
+            )
+        )
+
+        np.testing.assert_array_equal(
+            slide_stain_colors(other_wsi, seed=3, **self.params),
+            slide_stain_colors(wsi, seed=3, **self.params),
+        )
+
+    def test_colors_are_memoized_on_the_slide(self):
+        sampling = self._count_samplings()
+        wsi = WSI(self.slide_filename)
+
+        colors = slide_stain_colors(wsi, **self.params)
+        self.assertEqual(colors.shape, (3, 3))
+        self.assertIs(slide_stain_colors(wsi, **self.params), colors)
+        self.assertEqual(sampling.call_count, 1)
+
+        # other parameters are fitted again
+        self.assertEqual(
+            slide_stain_colors(wsi, n_colors=2, **self.params).shape, (2, 3)
+        )
+        self.assertEqual(sampling.call_count, 2)
+
+    def test_colors_are_cached_on_disk(self):
+        sampling = self._count_samplings()
+
+        colors = slide_stain_colors(
+            WSI(self.slide_filename, self.cache_dir), **self.params
+        )
+        cached_colors = slide_stain_colors(
+            WSI(self.slide_filename, self.cache_dir), **self.params
+        )
+
+        np.testing.assert_array_equal(cached_colors, colors)
+        self.assertEqual(sampling.call_count, 1)
+        # the tissue and the colors caches, and no temporary file
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+
+    def test_normalizer_slide_params_are_cached_on_disk(self):
+        sampling = self._count_samplings()
+
+        params = MacenkoNormalizer(**self.params).slide_params(
+            WSI(self.slide_filename, self.cache_dir)
+        )
+        cached_params = MacenkoNormalizer(**self.params).slide_params(
+            WSI(self.slide_filename, self.cache_dir)
+        )
+
+        self.assertEqual(cached_params.keys(), params.keys())
+        for key in params:
+            np.testing.assert_array_equal(cached_params[key], params[key])
+        self.assertEqual(sampling.call_count, 1)
+        # the tissue and the slide params caches, and no temporary file
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+
+    def test_no_tissue_tiles_raises(self):
+        wsi = WSI(self.slide_filename)
+        with mock.patch.object(stains, "_sample_tissue_tiles", return_value=[]):
+            self.assertEqual(sample_tissue_pixels(wsi, **self.params).shape, (0, 3))
+            with self.assertRaisesRegex(ValueError, "No tissue tiles found"):
+                slide_stain_colors(wsi, **self.params)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from histo_lib import ShardReader
+from preprocessing.svs_to_tiles import extract_tiles_parallel
+
+try:
+    from benchmarks.synthetic_slide import synthetic_slide
+except ImportError:  # synthetic slides are written with tifffile
+    synthetic_slide = None
+
+# small tiles at level 0, instead of the ones of preprocessing_config.gin
+EXTRACTION_KWARGS = dict(tile_size=64, n_tiles=3, level=0)
+
+
+@unittest.skipIf(synthetic_slide is None, "tifffile is not installed")
+class ExtractTilesParallelTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.slide_dir = tempfile.mkdtemp()
+        cls.wsi_filenames = []
+        for i in range(3):
+            wsi_filename = f"{cls.slide_dir}/slide_{i}.tiff"
+            synthetic_slide(wsi_filename, width=1024, height=768, n_levels=2, seed=i)
+            cls.wsi_filenames.append(wsi_filename)
+
+        cls.broken_wsi_filename = f"{cls.slide_dir}/broken.svs"
+        with open(cls.broken_wsi_filename, "w") as broken_wsi_file:
+            broken_wsi_file.write("not a slide")
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.slide_dir)
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output_dir)
+
+    def test_extracts_every_slide(self):
+        output_folders = [f"{self.output_dir}/{i}" for i in range(3)]
+        for output_folder in output_folders:
+            os.mkdir(output_folder)
+
+        tiles_per_wsi, failed_wsi = extract_tiles_parallel(
+            self.wsi_filenames, output_folders, n_processes=2, **EXTRACTION_KWARGS
+        )
+
+        self.assertEqual(failed_wsi, {})
+        self.assertEqual(set(tiles_per_wsi), set(self.wsi_filenames))
+        for i, wsi_filename in enumerate(self.wsi_filenames):
+            tile_filenames = tiles_per_wsi[wsi_filename]
+            self.assertEqual(len(tile_filenames), 3)
+            for tile_filename in tile_filenames:
+                self.assertTrue(
+                    os.path.basename(tile_filename).startswith(f"slide_{i}_tile_")
+                )
+                self.assertEqual(os.path.dirname(tile_filename), output_folders[i])
+                self.assertTrue(os.path.isfile(tile_filename))
+
+    def test_reports_the_failed_slides(self):
+        wsi_filenames = [self.wsi_filenames[0], self.broken_wsi_filename]
+
+        tiles_per_wsi, failed_wsi = extract_tiles_parallel(
+            wsi_filenames, self.output_dir, n_processes=2, **EXTRACTION_KWARGS
+        )
+
+        self.assertEqual(list(tiles_per_wsi), [self.wsi_filenames[0]])
+        self.assertEqual(len(tiles_per_wsi[self.wsi_filenames[0]]), 3)
+        self.assertEqual(list(failed_wsi), [self.broken_wsi_filename])
+        self.assertIn("broken.svs", failed_wsi[self.broken_wsi_filename])
+
+    def test_one_shard_writer_per_worker(self):
+        shards_dir = f"{self.output_dir}/shards"
+
+        tiles_per_wsi, failed_wsi = extract_tiles_parallel(
+            self.wsi_filenames,
+            self.output_dir,
+            n_processes=2,
+            shards_dir=shards_dir,
+            **EXTRACTION_KWARGS,
+        )
+
+        self.assertEqual(failed_wsi, {})
+        with ShardReader(shards_dir) as reader:
+            records = reader.records()
+            self.assertEqual(
+                sorted(reader.names),
+                sorted(sum(tiles_per_wsi.values(), [])),
+            )
+            self.assertEqual(
+                sorted(record.slide_id for record in records),
+                sorted([f"slide_{i}" for i in range(3)] * 3),
+            )
+            for record in records:
+                self.assertTrue(reader.read_bytes(record.name).startswith(b"\x89PNG"))
+
+        # the slides of a worker are appended to its shard, not to a shard per slide
+        shards = {record.shard for record in records}
+        self.assertLessEqual(len(shards), 2)
+        self.assertEqual(len(os.listdir(shards_dir)), 2 * len(shards))
+        # no tile saved as a file
+        self.assertEqual(sorted(os.listdir(self.output_dir)), ["shards"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from preprocessing.tables import tile_coordinates, write_table
+
+try:
+    import pyarrow.feather
+    import pyarrow.parquet
+except ImportError:  # parquet and feather tables need pyarrow
+    pyarrow = None
+
+
+def _summary(filenames):
+    summary = {
+        "filename": filenames,
+        "patient": [filename[:12] for filename in filenames],
+        "wsi_id": [filename[:16] for filename in filenames],
+    }
+    summary.update(tile_coordinates(filenames).items())
+    return summary
+
+
+@unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+class WriteTableTest(unittest.TestCase):
+    def setUp(self):
+        self.tables_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tables_dir)
+
+    def test_empty_table_has_the_same_schema(self):
+        filenames = ["TCGA-A1-A0SB-01Z-00-DX1_tile_0_level2_0-0-2048-2048.png"]
+        read_schemas = {
+            "parquet": pyarrow.parquet.read_schema,
+            "feather": lambda filename: pyarrow.feather.read_table(filename).schema,
+        }
+
+        for ext, read_schema in read_schemas.items():
+            with self.subTest(ext=ext):
+                empty_filename = os.path.join(self.tables_dir, f"empty.{ext}")
+                filename = os.path.join(self.tables_dir, f"summary.{ext}")
+                write_table(_summary([]), empty_filename)
+                write_table(_summary(filenames), filename)
+
+                self.assertEqual(
+                    read_schema(empty_filename).remove_metadata(),
+                    read_schema(filename).remove_metadata(),
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()
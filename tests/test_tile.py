@@ -0,0 +1,86 @@
+import unittest
+
+import numpy as np
+from PIL import Image
+
+from histo_lib import Tile
+
+TILE_SIZE = 64
+
+
+def _tiles():
+    """Return RGB tiles from full white to full tissue, with H&E-like noisy tissue."""
+    random_state = np.random.RandomState(7)
+    yy, xx = np.mgrid[:TILE_SIZE, :TILE_SIZE]
+    tiles = []
+    for tissue_side in (0, 16, 40, 54, 64):
+        tissue = (yy < tissue_side) & (xx < tissue_side)
+        tile = np.full((TILE_SIZE, TILE_SIZE, 3), 240, dtype=np.uint8)
+        noise = random_state.randint(-30, 31, size=(tissue.sum(), 1))
+        tile[tissue] = np.clip(np.array([180, 90, 170]) + noise, 0, 255)
+        tiles.append(tile)
+    # a single color and a noisy tile
+    tiles.append(np.full((TILE_SIZE, TILE_SIZE, 3), 120, dtype=np.uint8))
+    tiles.append(random_state.randint(0, 256, (TILE_SIZE, TILE_SIZE, 3), np.uint8))
+    return [
+        Tile(Image.fromarray(tile), 0, (0, 0, TILE_SIZE, TILE_SIZE)) for tile in tiles
+    ]
+
+
+class HasEnoughTissueBatchTest(unittest.TestCase):
+    def test_equals_has_enough_tissue(self):
+        tiles = _tiles()
+
+        enough_tissue, tissue_fraction = Tile.has_enough_tissue_batch(tiles)
+
+        self.assertEqual(
+            enough_tissue.tolist(), [tile.has_enough_tissue() for tile in tiles]
+        )
+        self.assertTrue(enough_tissue.any() and not enough_tissue.all())
+        self.assertEqual(tissue_fraction.shape, (len(tiles),))
+        self.assertTrue(((tissue_fraction >= 0) & (tissue_fraction <= 1)).all())
+
+    def test_thresholds_apply_to_the_whole_batch(self):
+        tiles = _tiles()
+
+        for threshold in (0.2, 0.5, 0.8):
+            with self.subTest(threshold=threshold):
+                enough_tissue, _ = Tile.has_enough_tissue_batch(tiles, threshold)
+                self.assertEqual(
+                    enough_tissue.tolist(),
+                    [tile.has_enough_tissue(threshold) for tile in tiles],
+                )
+
+    def test_empty_batch(self):
+        enough_tissue, tissue_fraction = Tile.has_enough_tissue_batch(
+            np.zeros((0, TILE_SIZE, TILE_SIZE, 3), dtype=np.uint8)
+        )
+
+        self.assertEqual(enough_tissue.shape, (0,))
+        self.assertEqual(tissue_fraction.shape, (0,))
+
+
+class BalanceWhiteBatchTest(unittest.TestCase):
+    def test_balances_each_image_and_channel(self):
+        tiles = _tiles()
+        # a tile with a black channel
+        dark = np.asarray(tiles[2].image).copy() // 2
+        dark[..., 1] = 0
+        tiles.append(Tile(Image.fromarray(dark), 0, (0, 0, TILE_SIZE, TILE_SIZE)))
+
+        balanced = Tile.balance_white_batch(tiles)
+
+        self.assertEqual(balanced.shape, (len(tiles), TILE_SIZE, TILE_SIZE, 3))
+        self.assertEqual(balanced.dtype, np.uint8)
+        for tile, balanced_tile in zip(tiles, balanced):
+            image_arr = np.asarray(tile.image)
+            maxs = np.maximum(image_arr.max(axis=(0, 1)), 1)
+            expected = (image_arr / maxs * 255.0).astype(np.uint8)
+            np.testing.assert_array_equal(balanced_tile, expected)
+            np.testing.assert_array_equal(balanced_tile, tile.balance_white())
+        self.assertTrue((balanced[-1, ..., 1] == 0).all())
+        self.assertEqual(balanced[-1, ..., 0].max(), 255)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,187 @@
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from PIL import Image
+
+from histo_lib import WSI, GridTiler, RandomTiler
+
+try:
+    from benchmarks.synthetic_slide import synthetic_slide
+except ImportError:  # synthetic slides are written with tifffile
+    synthetic_slide = None
+
+
+@unittest.skipIf(synthetic_slide is None, "tifffile is not installed")
+class TilerTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.slide_dir = tempfile.mkdtemp()
+        cls.slide_filename = f"{cls.slide_dir}/slide.tiff"
+        # 1024x768 at level 0, 256x192 at level 1
+        synthetic_slide(cls.slide_filename, width=1024, height=768, n_levels=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.slide_dir)
+
+    def setUp(self):
+        self.wsi = WSI(self.slide_filename)
+
+
+class GridTilerTest(TilerTestCase):
+    def test_grid_coordinates(self):
+        tiler = GridTiler(128, check_tissue=False)
+
+        coords = tiler._grid_tile_coordinates(self.wsi)
+
+        # 8 columns and 6 rows, row by row
+        self.assertEqual(coords.shape, (48, 4))
+        np.testing.assert_array_equal(coords[:9, 0], [*range(0, 1024, 128), 0])
+        np.testing.assert_array_equal(coords[:9, 1], [0] * 8 + [128])
+        np.testing.assert_array_equal(coords[:, 2:] - coords[:, :2], 128)
+        np.testing.assert_array_equal(coords[-1], [896, 640, 1024, 768])
+
+    def test_grid_coordinates_with_overlap(self):
+        tiler = GridTiler((128, 96), pixel_overlap=32, check_tissue=False)
+        self.assertEqual(tiler.stride, (96, 64))
+
+        coords = tiler._grid_tile_coordinates(self.wsi)
+
+        # only the tiles entirely within the slide
+        xs = np.arange(0, 1024 - 128 + 1, 96)
+        ys = np.arange(0, 768 - 96 + 1, 64)
+        self.assertEqual(len(coords), len(xs) * len(ys))
+        np.testing.assert_array_equal(np.unique(coords[:, 0]), xs)
+        np.testing.assert_array_equal(np.unique(coords[:, 1]), ys)
+        np.testing.assert_array_equal(coords[:, 2] - coords[:, 0], 128)
+        np.testing.assert_array_equal(coords[:, 3] - coords[:, 1], 96)
+        # adjacent tiles overlap by 32 pixels
+        self.assertEqual(coords[0, 2] - coords[1, 0], 32)
+
+    def test_grid_coordinates_at_level_1(self):
+        tiler = GridTiler(64, level=1, pixel_overlap=16, check_tissue=False)
+
+        coords = tiler._grid_tile_coordinates(self.wsi)
+
+        # the level 1 grid (stride 48) scaled to level 0
+        xs = np.arange(0, 256 - 64 + 1, 48) * 4
+        ys = np.arange(0, 192 - 64 + 1, 48) * 4
+        np.testing.assert_array_equal(np.unique(coords[:, 0]), xs)
+        np.testing.assert_array_equal(np.unique(coords[:, 1]), ys)
+        np.testing.assert_array_equal(coords[:, 2:] - coords[:, :2], 256)
+
+    def test_tissue_grid_is_a_subset_of_the_grid(self):
+        grid = GridTiler(64, check_tissue=False)._grid_tile_coordinates(self.wsi)
+        tissue_grid = GridTiler(64)._grid_tile_coordinates(self.wsi)
+
+        self.assertGreater(len(tissue_grid), 0)
+        self.assertLess(len(tissue_grid), len(grid))
+        self.assertTrue(set(map(tuple, tissue_grid)) <= set(map(tuple, grid)))
+
+
+class StreamTest(TilerTestCase):
+    def _check_stream_matches_extract(self, tiler):
+        batches = list(tiler.stream(self.wsi, batch_size=5))
+
+        prefix_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, prefix_dir)
+        tiler.prefix = f"{prefix_dir}/"
+        filenames = tiler.extract(self.wsi)
+
+        n_tiles = len(filenames)
+        self.assertGreater(n_tiles, 5)
+        self.assertEqual(
+            [len(coords) for coords, _ in batches],
+            [5] * (n_tiles // 5) + ([n_tiles % 5] if n_tiles % 5 else []),
+        )
+        coords = np.concatenate([coords for coords, _ in batches])
+        images = np.concatenate([images for _, images in batches])
+        self.assertEqual(coords.dtype, np.int64)
+        self.assertEqual(images.dtype, np.uint8)
+        self.assertEqual(images.shape, (n_tiles, 64, 64, 3))
+
+        # the same tiles as the saved ones, in the same order
+        for filename, tile_coords, image in zip(filenames, coords, images):
+            self.assertTrue(
+                filename.endswith(f"_level1_{'-'.join(map(str, tile_coords))}.png")
+            )
+            with Image.open(filename) as saved:
+                np.testing.assert_array_equal(np.asarray(saved.convert("RGB")), image)
+
+    def test_grid_stream_matches_extract(self):
+        self._check_stream_matches_extract(GridTiler(64, level=1, check_tissue=False))
+
+    def test_random_stream_matches_extract(self):
+        self._check_stream_matches_extract(
+            RandomTiler(64, n_tiles=7, level=1, check_tissue=False)
+        )
+
+
+class RandomTilerTest(TilerTestCase):
+    def _stream(self, **kwargs):
+        tiler = RandomTiler(64, n_tiles=4, **kwargs)
+        batches = list(tiler.stream(self.wsi))
+        coords = np.concatenate([coords for coords, _ in batches])
+        images = np.concatenate([images for _, images in batches])
+        return coords, images
+
+    def test_same_seed_same_tiles(self):
+        for sampling in ("box", "mask"):
+            with self.subTest(sampling=sampling):
+                coords, images = self._stream(sampling=sampling, seed=3)
+                self.assertEqual(len(coords), 4)
+
+                other_coords, other_images = self._stream(sampling=sampling, seed=3)
+                np.testing.assert_array_equal(other_coords, coords)
+                np.testing.assert_array_equal(other_images, images)
+
+                # with more threads too
+                other_coords, other_images = self._stream(
+                    sampling=sampling, seed=3, n_workers=4
+                )
+                np.testing.assert_array_equal(other_coords, coords)
+                np.testing.assert_array_equal(other_images, images)
+
+                other_coords, _ = self._stream(sampling=sampling, seed=4)
+                self.assertFalse(np.array_equal(other_coords, coords))
+
+    def test_tiles_are_within_the_slide(self):
+        for sampling in ("box", "mask"):
+            with self.subTest(sampling=sampling):
+                coords, _ = self._stream(sampling=sampling)
+                self.assertTrue(np.all(coords[:, :2] >= 0))
+                self.assertTrue(np.all(coords[:, 2] <= 1024))
+                self.assertTrue(np.all(coords[:, 3] <= 768))
+                np.testing.assert_array_equal(coords[:, 2:] - coords[:, :2], 64)
+
+    def test_default_draws_are_made_one_tile_at_a_time(self):
+        tiler = RandomTiler(64, n_tiles=4)
+        box = tiler.box_coords_lvl(self.wsi)
+
+        np.random.seed(5)
+        coords = tiler._random_tile_coordinates(self.wsi, 20, box)
+
+        np.random.seed(5)
+        for x_ul, y_ul, _, _ in coords:
+            self.assertEqual(x_ul, np.random.randint(box.x_ul, box.x_br - 65))
+            self.assertEqual(y_ul, np.random.randint(box.y_ul, box.y_br - 65))
+
+    def test_default_mask_draws_are_made_one_tile_at_a_time(self):
+        tiler = RandomTiler(64, n_tiles=4, sampling="mask")
+        cells, probabilities = tiler._tissue_cells(self.wsi)
+
+        np.random.seed(5)
+        coords = tiler._random_mask_tile_coordinates(self.wsi, cells, probabilities, 20)
+
+        np.random.seed(5)
+        for x_ul, y_ul, _, _ in coords:
+            cell = cells[np.random.choice(len(cells), p=probabilities)]
+            dx, dy = np.random.randint(-32, 33), np.random.randint(-32, 33)
+            self.assertEqual(x_ul, np.clip(cell[0] + dx, 0, 1024 - 64))
+            self.assertEqual(y_ul, np.clip(cell[1] + dy, 0, 768 - 64))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,159 @@
+import importlib
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+from PIL import Image
+
+from histo_lib import WSI
+
+wsi_module = importlib.import_module("histo_lib.wsi")
+
+try:
+    from benchmarks.synthetic_slide import synthetic_slide
+except ImportError:  # synthetic slides are written with tifffile
+    synthetic_slide = None
+
+
+@unittest.skipIf(synthetic_slide is None, "tifffile is not installed")
+class ExtractTileTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.slide_dir = tempfile.mkdtemp()
+        cls.slide_filename = f"{cls.slide_dir}/slide.tiff"
+        synthetic_slide(cls.slide_filename, width=1024, height=768, n_levels=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.slide_dir)
+
+    def test_region_cache_returns_the_same_pil_images(self):
+        wsi = WSI(self.slide_filename)
+        cached_wsi = WSI(
+            self.slide_filename, region_cache_bytes=2 ** 20, super_region_size=256
+        )
+
+        # within a super-region, across super-regions and at level 1
+        for coords, level in (
+            ((0, 0, 128, 128), 0),
+            ((192, 192, 320, 320), 0),
+            ((256, 256, 768, 768), 1),
+        ):
+            with self.subTest(coords=coords, level=level):
+                tile = wsi.extract_tile(coords, level, size=(128, 128))
+                cached_tile = cached_wsi.extract_tile(coords, level, size=(128, 128))
+
+                self.assertIsInstance(cached_tile.image, Image.Image)
+                self.assertEqual(cached_tile.image.mode, tile.image.mode)
+                np.testing.assert_array_equal(
+                    np.asarray(cached_tile.image), np.asarray(tile.image)
+                )
+        self.assertGreater(cached_wsi.region_cache_misses, 0)
+
+    def test_cached_arrays_are_views_of_the_super_regions(self):
+        wsi = WSI(self.slide_filename)
+        cached_wsi = WSI(
+            self.slide_filename, region_cache_bytes=2 ** 20, super_region_size=256
+        )
+
+        tile = wsi.extract_tile((64, 64, 192, 192), 0, as_array=True)
+        cached_tile = cached_wsi.extract_tile((64, 64, 192, 192), 0, as_array=True)
+        other_tile = cached_wsi.extract_tile((0, 0, 128, 128), 0, as_array=True)
+
+        for array in (tile.image, cached_tile.image):
+            self.assertIsInstance(array, np.ndarray)
+            self.assertEqual(array.shape, (128, 128, 4))
+        np.testing.assert_array_equal(cached_tile.image, tile.image)
+        # both tiles are sliced out of the same super-region, without copies
+        self.assertTrue(np.shares_memory(cached_tile.image, other_tile.image))
+        self.assertFalse(cached_tile.image.flags.writeable)
+
+
+@unittest.skipIf(synthetic_slide is None, "tifffile is not installed")
+class TissueCacheTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.slide_dir = tempfile.mkdtemp()
+        cls.slide_filename = f"{cls.slide_dir}/slide.tiff"
+        synthetic_slide(cls.slide_filename, width=1024, height=768, n_levels=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.slide_dir)
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.cache_dir = f"{self.root}/cache"
+        # a copy of the slide, whose modification time can be changed
+        self.slide_copy = f"{self.root}/slide.tiff"
+        shutil.copy(self.slide_filename, self.slide_copy)
+
+        compute_tissue = mock.patch.object(
+            WSI, "_compute_tissue", autospec=True, side_effect=WSI._compute_tissue
+        )
+        self.compute_tissue = compute_tissue.start()
+        self.addCleanup(compute_tissue.stop)
+
+    def _tissue(self):
+        wsi = WSI(self.slide_copy, self.cache_dir)
+        return wsi.tissue_mask, wsi.tissue_box_coords_wsi
+
+    def test_cache_hit(self):
+        mask, box = self._tissue()
+        cached_mask, cached_box = self._tissue()
+
+        self.assertEqual(self.compute_tissue.call_count, 1)
+        np.testing.assert_array_equal(cached_mask, mask)
+        self.assertEqual(cached_box, box)
+        # the cache only, no temporary file
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+    def test_modified_slide_is_computed_again(self):
+        self._tissue()
+
+        stat = os.stat(self.slide_copy)
+        os.utime(self.slide_copy, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self._tissue()
+
+        self.assertEqual(self.compute_tissue.call_count, 2)
+
+    def test_other_thumbnail_size_or_version_is_computed_again(self):
+        self._tissue()
+
+        with mock.patch.object(wsi_module, "TISSUE_THUMBNAIL_SIZE", 500):
+            mask, _ = self._tissue()
+        self.assertEqual(self.compute_tissue.call_count, 2)
+        self.assertLessEqual(max(mask.shape), 500)
+
+        with mock.patch.object(
+            wsi_module, "TISSUE_MASK_VERSION", wsi_module.TISSUE_MASK_VERSION + 1
+        ):
+            self._tissue()
+        self.assertEqual(self.compute_tissue.call_count, 3)
+
+        # the first cache is still valid
+        self._tissue()
+        self.assertEqual(self.compute_tissue.call_count, 3)
+
+    def test_unreadable_cache_is_computed_again(self):
+        mask, box = self._tissue()
+        (cache_filename,) = os.listdir(self.cache_dir)
+        with open(os.path.join(self.cache_dir, cache_filename), "wb") as cache_file:
+            cache_file.write(b"not a npz file")
+
+        recomputed_mask, recomputed_box = self._tissue()
+        self.assertEqual(self.compute_tissue.call_count, 2)
+        np.testing.assert_array_equal(recomputed_mask, mask)
+        self.assertEqual(recomputed_box, box)
+
+        # and cached again
+        self._tissue()
+        self.assertEqual(self.compute_tissue.call_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,266 @@
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+
+import pandas as pd
+
+from preprocessing.tcga import wsi_downloader
+from preprocessing.tcga.wsi_downloader import (
+    ChecksumMismatchError,
+    DownloadRecord,
+    IncompleteDownloadError,
+    TCGAWSIDownloader,
+)
+
+FILE_UUID = "0b5dd5ae-1b9d-4a4c-9e33-3d9ab5a2d2f0"
+FILE_DATA = os.urandom(1000)
+FILES = {
+    FILE_UUID: FILE_DATA,
+    **{
+        f"1f3c0e7a-4d2b-4c8e-9a51-7e0d3b6c2a0{i}": os.urandom(700 + i) for i in range(3)
+    },
+}
+
+
+class _DataHandler(BaseHTTPRequestHandler):
+    """
+    Serve each of `FILES` at `/data/{uuid}` like the GDC data endpoint, honoring
+    `Range: bytes={start}-` requests.
+
+    If the server `truncate_at` attribute is set, ranges are served only up to that
+    byte, while the Content-Range still announces the whole file.
+    The first `corrupt_requests` requests of the server are served with corrupted
+    bytes, of the right size. If the server `barrier` is set, each request of a
+    file waits for it before sending the file.
+
+    """
+
+    def do_GET(self):
+        self.server.ranges.append(self.headers.get("Range"))
+
+        file_uuid = self.path.rpartition("/")[2]
+        if self.path != f"/data/{file_uuid}" or file_uuid not in FILES:
+            self.send_error(404)
+            return
+        file_data = FILES[file_uuid]
+
+        with self.server.lock:
+            corrupt = self.server.corrupt_requests > 0
+            self.server.corrupt_requests -= corrupt
+        if corrupt:
+            file_data = bytes(b ^ 0xFF for b in file_data)
+        if self.server.barrier is not None:
+            self.server.barrier.wait()
+
+        start = 0
+        range_match = re.match(r"bytes=(\d+)-$", self.headers.get("Range", ""))
+        if range_match:
+            start = int(range_match.group(1))
+            if start >= len(file_data):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(file_data)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+        stop = len(file_data)
+        if range_match and self.server.truncate_at is not None:
+            stop = self.server.truncate_at
+        body = file_data[start:stop]
+
+        if range_match:
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", f"bytes {start}-{stop - 1}/{len(file_data)}"
+            )
+        else:
+            self.send_response(200)
+        self.send_header("Content-Disposition", f"attachment; filename={file_uuid}.svs")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TCGAWSIDownloaderTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), _DataHandler)
+        cls.server.lock = threading.Lock()
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.ranges = []
+        self.server.truncate_at = None
+        self.server.corrupt_requests = 0
+        self.server.barrier = None
+
+        self.output_folder = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.output_folder)
+        self.output_filename = self.output_folder / "slide.svs"
+        self.partial_filename = Path(f"{self.output_filename}.part")
+
+        self.downloader = TCGAWSIDownloader(
+            self.output_folder / "metadata.csv",
+            self.output_folder,
+            data_endpoint=f"http://127.0.0.1:{self.server.server_port}/data",
+            chunk_size=64,
+        )
+
+    def test_resumes_partial_file_with_range(self):
+        self.partial_filename.write_bytes(FILE_DATA[:300])
+
+        self.downloader._download_single_wsi(
+            FILE_UUID,
+            self.output_filename,
+            md5=hashlib.md5(FILE_DATA).hexdigest(),
+        )
+
+        self.assertEqual(self.server.ranges, ["bytes=300-"])
+        self.assertEqual(self.output_filename.read_bytes(), FILE_DATA)
+        self.assertFalse(self.partial_filename.exists())
+
+    def test_range_not_satisfiable_on_complete_partial_file(self):
+        self.partial_filename.write_bytes(FILE_DATA)
+
+        self.downloader._download_single_wsi(FILE_UUID, self.output_filename)
+
+        # the partial file is discarded and the file downloaded from scratch
+        self.assertEqual(self.server.ranges, [f"bytes={len(FILE_DATA)}-", None])
+        self.assertEqual(self.output_filename.read_bytes(), FILE_DATA)
+        self.assertFalse(self.partial_filename.exists())
+
+    def test_truncated_response_raises_and_keeps_partial_file(self):
+        self.partial_filename.write_bytes(FILE_DATA[:100])
+        self.server.truncate_at = 500
+
+        with self.assertRaises(IncompleteDownloadError):
+            self.downloader._download_single_wsi(FILE_UUID, self.output_filename)
+
+        self.assertFalse(self.output_filename.exists())
+        self.assertEqual(self.partial_filename.read_bytes(), FILE_DATA[:500])
+
+        # the next attempt resumes from the kept partial file
+        self.server.truncate_at = None
+        self.downloader._download_single_wsi(FILE_UUID, self.output_filename)
+
+        self.assertEqual(self.server.ranges, ["bytes=100-", "bytes=500-"])
+        self.assertEqual(self.output_filename.read_bytes(), FILE_DATA)
+
+    def test_checksum_mismatch_quarantines_file(self):
+        self.server.corrupt_requests = 1
+
+        with self.assertRaises(ChecksumMismatchError):
+            self.downloader._download_single_wsi(
+                FILE_UUID,
+                self.output_filename,
+                md5=hashlib.md5(FILE_DATA).hexdigest(),
+            )
+
+        quarantine_filename = self.output_folder / "quarantine" / "slide.svs"
+        self.assertEqual(
+            quarantine_filename.read_bytes(), bytes(b ^ 0xFF for b in FILE_DATA)
+        )
+        self.assertFalse(self.output_filename.exists())
+        self.assertFalse(self.partial_filename.exists())
+
+    @mock.patch.object(wsi_downloader, "RETRY_BACKOFF", 0)
+    def test_checksum_mismatch_is_retried_from_scratch(self):
+        self.server.corrupt_requests = 1
+
+        record = self.downloader._download_with_retries(
+            FILE_UUID,
+            "slide.svs",
+            None,
+            max_retries=1,
+            md5=hashlib.md5(FILE_DATA).hexdigest(),
+        )
+
+        self.assertEqual(record.status, "downloaded")
+        self.assertEqual(record.retries, 1)
+        self.assertIsNone(record.error)
+        # the retry is not a range request on the quarantined file
+        self.assertEqual(self.server.ranges, [None, None])
+        self.assertEqual(self.output_filename.read_bytes(), FILE_DATA)
+
+    @mock.patch.object(wsi_downloader, "RETRY_BACKOFF", 0)
+    def test_checksum_mismatch_reported_as_quarantined(self):
+        self.server.corrupt_requests = 2
+        pd.DataFrame(
+            {
+                "uuid": [FILE_UUID],
+                "filename": ["slide.svs"],
+                "md5": [hashlib.md5(FILE_DATA).hexdigest()],
+            }
+        ).to_csv(self.downloader.metadata_path, index=False)
+
+        report = self.downloader.download(max_retries=1)
+
+        self.assertEqual(report["status"].tolist(), ["quarantined"])
+        self.assertEqual(report["retries"].tolist(), [1])
+        self.assertTrue(report["error"][0].startswith("ChecksumMismatchError"))
+        self.assertEqual(self.downloader.not_downloaded, [FILE_UUID])
+        self.assertTrue((self.output_folder / "quarantine" / "slide.svs").exists())
+        self.assertFalse(self.output_filename.exists())
+
+    def test_concurrent_downloads_and_report_file(self):
+        # every request waits for a second one: the downloads must be concurrent
+        self.server.barrier = threading.Barrier(2, timeout=10)
+        uuids = list(FILES)
+        filenames = [f"slide_{i}.svs" for i in range(len(uuids))]
+        (self.output_folder / "skipped.svs").write_bytes(b"")
+        pd.DataFrame(
+            {
+                "uuid": ["skipped-uuid"] + uuids + ["missing-uuid"],
+                "filename": ["skipped.svs"] + filenames + ["missing.svs"],
+                "md5": [None]
+                + [hashlib.md5(FILES[uuid]).hexdigest() for uuid in uuids]
+                + [None],
+            }
+        ).to_csv(self.downloader.metadata_path, index=False)
+        report_path = self.output_folder / "report.csv"
+
+        report = self.downloader.download(n_workers=2, report_path=report_path)
+
+        for uuid, filename in zip(uuids, filenames):
+            self.assertEqual((self.output_folder / filename).read_bytes(), FILES[uuid])
+        self.assertEqual(self.downloader.not_downloaded, ["missing-uuid"])
+
+        saved_report = pd.read_csv(report_path).set_index("uuid")
+        self.assertEqual(list(report.columns), list(DownloadRecord._fields))
+        self.assertEqual(set(saved_report.index), set(report["uuid"]))
+        self.assertEqual(
+            saved_report["status"].to_dict(),
+            {
+                "skipped-uuid": "skipped",
+                **{uuid: "downloaded" for uuid in uuids},
+                "missing-uuid": "failed",
+            },
+        )
+        self.assertEqual(
+            saved_report.loc[uuids, "size"].tolist(),
+            [len(FILES[uuid]) for uuid in uuids],
+        )
+        self.assertEqual(saved_report.loc[uuids, "filename"].tolist(), filenames)
+        self.assertTrue(saved_report.loc[uuids, "error"].isna().all())
+        self.assertTrue(
+            saved_report.loc["missing-uuid", "error"].startswith("HTTPError")
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()